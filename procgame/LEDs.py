@@ -34,8 +34,10 @@
 import logging
 import yaml
 import weakref
-import time
 import uuid
+import heapq
+import itertools
+import bisect
 
 
 class LEDshow(object):
@@ -80,6 +82,11 @@ class LEDshow(object):
         self.blend = False  # when an LED is off in this show, should it allow
         # lower priority LEDs to show through?
         self.LEDshow_actions = None  # show commands from LEDshow yaml file
+        self.steps = []  # the actions compiled by _compile(), one tuple per
+        # location: (tocks, leds, changes)
+        self.resync = True  # the show sends all the LEDs of each location,
+        # not only the ones that changed, until it reaches location 0
+        self.location_tocks = []  # the tock each location starts at
         self.current_location = 0  # index of which command block (tock) a
         # running show is in need to be serviced.
         self.last_action_time = 0.0  # when the last action happened
@@ -120,6 +127,12 @@ class LEDshow(object):
         self.game.LEDs.registered_shows.append(weakref.proxy(self))
 
         self.LEDshow_actions = LEDshow_actions
+        self.steps = self._compile(LEDshow_actions)
+        self.location_tocks = []
+        tock = 0
+        for (tocks, leds, changes) in self.steps:
+            self.location_tocks.append(tock)
+            tock += tocks
 
         # count how many total locations are in the show. We need this later
         # so we can know when we're at the end of a show
@@ -128,6 +141,66 @@ class LEDshow(object):
         if not self.game.LEDs.initialized:
             self.game.LEDs._initialize()
 
+    def _compile(self, LEDshow_actions):
+        # Parses the colors of the show once so _advance() doesn't have to.
+        # Returns a list of (tocks, leds, changes) tuples, one per location,
+        # where leds holds an entry for every LED of that location and
+        # changes only the entries that differ from what the show set that
+        # LED to earlier. The changes are only valid once the show went
+        # through location 0, see _advance(). Each entry is a tuple of:
+        # LEDname
+        # color - list of ints, or None when the LED fades
+        # dest_color - list of ints, or None when the LED doesn't fade
+        # fade - fade time in tocks, or None
+        locations = []
+        for action in LEDshow_actions:
+            leds = []
+            for LEDname, color in action['LEDs'].iteritems():
+                color = str(color)
+                if "-f" in color:
+                    colorwithfade = color.split('-f')
+                    leds.append((LEDname, None,
+                        LEDcontroller.convert_hex_to_list(colorwithfade[0]),
+                        int(colorwithfade[1])))
+                else:
+                    leds.append((LEDname,
+                        LEDcontroller.convert_hex_to_list(color), None, None))
+            locations.append((action['tocks'], leds))
+
+        # what every LED was last set to at the end of the show, location 0
+        # follows it when the show repeats
+        last = {}
+        for (tocks, leds) in locations:
+            for entry in leds:
+                last[entry[0]] = entry
+
+        steps = []
+        current = {}
+        for (tocks, leds) in locations:
+            changes = []
+            for entry in leds:
+                if steps:
+                    previous = current.get(entry[0])
+                else:
+                    previous = last.get(entry[0])
+                # a fade is sent again even if it is the same, it restarts
+                if entry[3] is not None or previous != entry:
+                    changes.append(entry)
+                current[entry[0]] = entry
+            steps.append((tocks, leds, changes))
+        return steps
+
+    def location_at(self, tock):
+        """Returns the location the show is at *tock* tocks after it started
+        (looping if it repeats). Pass it to :meth:`play` as *start_location*
+        to resume a show from there.
+        """
+        if not self.location_tocks:
+            return 0
+        (tocks, leds, changes) = self.steps[-1]
+        tock %= self.location_tocks[-1] + tocks
+        return bisect.bisect_right(self.location_tocks, tock) - 1
+
     def play(self, repeat=False, priority=0, blend=False, hold=False,
              tocks_per_sec=32, start_location=-1, callback=None,
              num_repeats=0):
@@ -276,48 +349,42 @@ class LEDshow(object):
         while self.next_action_time <= self.game.LEDs.current_time:
             action_loop_count += 1
 
+            (tocks, leds, changes) = self.steps[self.current_location]
+
             # Set the next action time & step to the next location
-            self.next_action_time = ((self.LEDshow_actions[self.current_location]
-                                     ['tocks'] * self.secs_per_tock) +
+            self.next_action_time = ((tocks * self.secs_per_tock) +
                                      self.last_action_time)
             self.last_action_time = self.next_action_time
 
-            # create a dictionary of the current actions
-            for LEDname, color in (self.LEDshow_actions[self.current_location]
-                                   ['LEDs'].iteritems()):
-
-                # convert colorwithfade (like 111111-f2) into dictionary of:
-                # color:
-                # fadestart:
-                # fadeend:
+            # Only the LEDs that changed need an update, but the changes
+            # assume the show went through location 0 since it was started
+            if self.resync:
+                if self.current_location == 0:
+                    self.resync = False
+            else:
+                leds = changes
 
-                color = str(color).zfill(6)
+            for (LEDname, color, dest_color, fade) in leds:
                 LED_dic = {'LEDname': LEDname, 'color': color,
                            'priority': self.priority, 'blend': self.blend}
 
-                if "-f" in color:
-                    color = self._convert_colorwithfades_to_time(color,
-                                                            self.secs_per_tock)
-                    LED_dic['dest_color'] = str(color['dest_color']).zfill(6)
-                    LED_dic['fadestart'] = color['fadestart']
-                    LED_dic['fadeend'] = color['fadeend']
-                    LED_dic['color'] = None
+                if fade is not None:
+                    LED_dic['dest_color'] = dest_color
+                    LED_dic['fadestart'] = self.game.LEDs.current_time
+                    LED_dic['fadeend'] = ((fade * self.secs_per_tock) +
+                                          self.game.LEDs.current_time)
 
                 self.game.LEDs._add_to_update_list(LED_dic)
 
                 # If this LED is off and not involved in a fade,
                 # remove it from the active list
-                if LEDname in self.active_LEDs:
-                    if (LED_dic.get('dest_color', None) == '000000' or \
-                            LED_dic.get('dest_color', None) is None) \
-                            and (LED_dic['color'] == '000000'):
-                        self.active_LEDs.pop(LEDname)
+                if fade is None and not any(color):
+                    self.active_LEDs.pop(LEDname, None)
 
                 else:
                     # Update this show's active LEDs list with the latest
                     # settings
                     active_LEDs_dic = {}
-                    # loop through current actions
                     if LEDname in self.active_LEDs:
                         # if we have a current entry for this LEDname, copy its
                         # color to the prevcolor key. (We need this to restore
@@ -325,15 +392,13 @@ class LEDshow(object):
                         active_LEDs_dic['prevcolor'] = self.active_LEDs[
                             LEDname]['color']
 
-                    active_LEDs_dic['color'] = LED_dic.get('color', None)
+                    active_LEDs_dic['color'] = color
                     active_LEDs_dic['fadestart'] = LED_dic.get('fadestart',
                                                                None)
                     active_LEDs_dic['fadeend'] = LED_dic.get('fadeend', None)
-                    active_LEDs_dic['dest_color'] = LED_dic.get('dest_color',
-                                                                None)
+                    active_LEDs_dic['dest_color'] = dest_color
 
-                    new_dic = {LEDname: active_LEDs_dic}
-                    self.active_LEDs.update(new_dic)
+                    self.active_LEDs[LEDname] = active_LEDs_dic
 
             # increment this show's current_location pointer and handle repeats
 
@@ -365,30 +430,6 @@ class LEDshow(object):
             if action_loop_count == self.total_locations:
                 return
 
-    def _convert_colorwithfades_to_time(self, color, secs_per_tock):
-        # Receives the combined color-fade combinations from LEDshow files
-        # and breaks them out into colors and real time fade targets.
-
-        # Receives inputs of hex colors with fades specified in tocks, like:
-        # ff00aa-f2
-        # (This is a hex color of #ff00aa with a fade of 2 tocks)
-
-        # Returns a tuple of:
-        # color: ff00aa
-        # fadestart: time start in real time since epoch, like 123456789012.123
-        # fadeend: time target in real time since epoch, like 123456789012.123
-
-        # Look through our dictionary for any "-f" characters indicating fade
-        # times that are still in tocks
-        colorwithfade = color.split('-f')
-        i = {}
-        i['dest_color'] = colorwithfade[0]
-        i['fadestart'] = self.game.LEDs.current_time
-        i['fadeend'] = ((int(colorwithfade[1]) * secs_per_tock) +
-                        self.game.LEDs.current_time)
-        return i
-        # todo check to make sure we received a list?
-
 
 class Playlist(object):
     """A list of :class:`LEDshow` objects which are then played sequentially.
@@ -610,9 +651,7 @@ class Playlist(object):
                 # we stop the current show, we have to come back one.
                 action['show'].stop()
         self.running = False
-        for item in self.game.LEDs.queue:
-            if item['playlist'] == self:
-                self.game.LEDs.queue.remove(item)
+        self.game.LEDs._unqueue(lambda item: item.get('playlist') == self)
         if reset:
             self.current_step_position = 0
             self.current_repeat_loop = 0
@@ -682,8 +721,8 @@ class Playlist(object):
         # if we don't have a trigger_show but we have a time value for this
         # step, set up the time to move on
         if step_time and not step_trigger_show:
-            self.game.LEDs.queue.append({'playlist': self,
-                                        'action_time': (self.game.LEDs.current_time + step_time)})
+            self.game.LEDs._queue({'playlist': self,
+                                   'action_time': (self.game.LEDs.current_time + step_time)})
 
         # Advance our current_step_position counter
         if self.current_step_position == len(self.steps)-1:
@@ -729,10 +768,11 @@ class LEDcontroller(object):
         self.logger = logging.getLogger("LEDcontroller")
         self.game = game
         self.registered_shows = []
-        self.update_list = []
-        # self.update_list is a list of dicts:
+        self.update_list = {}
+        # self.update_list is a dict of dicts keyed by (LEDname, priority),
+        # so only the latest update of each pair is kept:
         # LEDname (str)
-        # color (str)
+        # color (list of ints)
         # fade(ms) (int)
         # priority (int)
         # fadeend (float)
@@ -743,8 +783,9 @@ class LEDcontroller(object):
         # whatever last set each LED in the machine
         self.initialized = False  # We need to run some stuff once but we can't
         # do it here since this loads because our LED game items are created
-        self.queue = []  # contains list of dics for things that need to be
-        # serviced in the future, including: (not all are always used)
+        self.queue = []  # heap of (action_time, seq, dic) for things that
+        # need to be serviced in the future. The dics include: (not all are
+        # always used)
         # LEDname
         # priority
         # blend
@@ -753,6 +794,8 @@ class LEDcontroller(object):
         # color
         # playlist
         # action_time
+        self.queue_seq = itertools.count()  # keeps the heap first in, first
+        # out for the same action_time
         self.active_scripts = []  # list of active scripts that have been
         # converted to LEDshows. We need this to facilitate removing shows when
         # they're done, since programmers don't use a name for scripts like
@@ -769,7 +812,7 @@ class LEDcontroller(object):
         # color - the current color *or* fade destination color
         # priority
         # fadeend - (optional) realtime of when the fade should end
-        self.current_time = time.time()
+        self.current_time = self.game.clock.time()
         # we use a common system time for the entire LED system so that every
         # "current_time" of a single update cycle is the same everywhere. This
         # ensures that multiple shows, scripts, and commands start in-sync
@@ -789,6 +832,7 @@ class LEDcontroller(object):
         show.running = True
         show.ending = False
         show.current_repeat_step = 0
+        show.resync = True
         show.last_action_time = self.current_time
         # or in the advance loop?
         self.running_shows.append(show)  # should this be a set?
@@ -838,7 +882,7 @@ class LEDcontroller(object):
 
             none
         """
-        self.current_time = time.time()
+        self.current_time = self.game.clock.time()
         # we calculate current_time one per loop because we want every action
         # in this loop to write the same "last action time" so they all stay
         # in sync. Also we truncate to 3 decimals for ease of comparisons later
@@ -859,37 +903,52 @@ class LEDcontroller(object):
                     break
 
         # Check to see if we need to service any items from our queue. This can
-        # be single commands or playlists
-        # Make a copy of the queue since we might delete items as we iterate
-        # through it
-
-        queue_copy = list(self.queue)
-
-        for item in queue_copy:
-            if item['action_time'] <= self.current_time:
-                # If the queue is for a fade, we ignore the current color
-                if item.get('fadeend', None):
-                    self._add_to_update_list({'LEDname': item['LEDname'],
-                                             'priority': item['priority'],
-                                             'blend': item.get('blend', None),
-                                             'fadeend': item.get('fadeend', None),
-                                             'dest_color': item.get('dest_color',
-                                                                    None)})
-                elif item.get('color', None):
-                    self._add_to_update_list({'LEDname': item['LEDname'],
-                                             'priority': item['priority'],
-                                             'color': item.get('color', None)})
-                elif item.get('playlist', None):
-                    item['playlist']._advance()
-
-                # We have to check again since one of these advances could have
-                # removed it already
-                if item in self.queue:
-                    self.queue.remove(item)
+        # be single commands or playlists. The queue is a heap so the due items
+        # are at the front.
+
+        while self.queue and self.queue[0][0] <= self.current_time:
+            item = heapq.heappop(self.queue)[2]
+            # If the queue is for a fade, we ignore the current color
+            if item.get('fadeend', None):
+                self._add_to_update_list({'LEDname': item['LEDname'],
+                                         'priority': item['priority'],
+                                         'blend': item.get('blend', None),
+                                         'fadeend': item.get('fadeend', None),
+                                         'dest_color': item.get('dest_color',
+                                                                None)})
+            elif item.get('color', None):
+                self._add_to_update_list({'LEDname': item['LEDname'],
+                                         'priority': item['priority'],
+                                         'color': item.get('color', None)})
+            elif item.get('playlist', None):
+                item['playlist']._advance()
 
         if self.update_list:
             self._do_update()
 
+    def next_deadline(self):
+        """Returns the time at which :meth:`update` next has a show action or
+        queued command to service, or None if nothing is scheduled.
+        """
+        deadlines = [show.next_action_time for show in self.running_shows]
+        if self.queue:
+            deadlines.append(self.queue[0][0])
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def _queue(self, item):
+        # Queues a dic to be serviced by update() at its action_time
+        heapq.heappush(self.queue, (item['action_time'], next(self.queue_seq),
+                                    item))
+
+    def _unqueue(self, predicate):
+        # Removes the queued dics for which predicate(dic) is True
+        queue = [entry for entry in self.queue if not predicate(entry[2])]
+        if len(queue) != len(self.queue):
+            heapq.heapify(queue)
+            self.queue = queue
+
     def restore_LED_state(self, LEDname, priority=None, fadeend=None,
                           color=None):
         """Restores an LED to whatever state it should be in below the passed
@@ -982,12 +1041,12 @@ class LEDcontroller(object):
                                    'blend': True,
                                    'priority': priority})
                 """
-                self.queue.append({'action_time': fadeend,
-                                   'LEDname': LEDname,
-                                   'blend': True,
-                                   'priority': priority,
-                                   'fadeend': restored_state[3],
-                                   'dest_color': restored_state[4]})
+                self._queue({'action_time': fadeend,
+                             'LEDname': LEDname,
+                             'blend': True,
+                             'priority': priority,
+                             'fadeend': restored_state[3],
+                             'dest_color': restored_state[4]})
 
         # otherwise our LED is not involved in a fade, so just restore
         # whatever we got immediately
@@ -1160,43 +1219,38 @@ class LEDcontroller(object):
         return color
 
     def _add_to_update_list(self, update):
-        # Adds an update to our update list, with intelligence that if the list
-        # already contains an update for this LEDname & priority combination,
-        # it deletes it first. This is done so if the game loop is running
-        # slower than our updates are coming in, we only keep the most recent
-        # entry.
-
-        for item in self.update_list:
-            if item['LEDname'] == update['LEDname'] and (item['priority'] ==
-                                                         update['priority']):
-                self.update_list.remove(item)
-        self.update_list.append(update)
+        # Adds an update to our update list, replacing any update already there
+        # for this LEDname & priority combination. This is done so if the game
+        # loop is running slower than our updates are coming in, we only keep
+        # the most recent entry.
+
+        self.update_list[(update['LEDname'], update['priority'])] = update
 
     def _do_update(self):
         # Updates the LEDs in the game with whatever's in the update_list.
 
-        # The update_list is a list of dictionaries w/the following k/v pairs:
-        #    color: 111111
+        # The update_list values are dictionaries w/the following k/v pairs:
+        #    color: list of colors or hex color
         #    priority: 9
         #    LEDname: laneP
-        #    fadecolor: list of colors or hex color
+        #    dest_color: list of colors or hex color
         #    fadeend: realtime fade end
         #    blend: True/False
 
-        # First sort the update_list so we only have one of each LEDname.
+        # First filter the update_list so we only have one of each LEDname.
         # If there are multiple entries for one LEDname, only keep the one with
         # the highest priority
 
-        filtered={}
-        for di in sorted(self.update_list, key=lambda d: d['priority']):
-            filtered[di['LEDname']] = di
-
-        self.update_list = filtered.values()
+        filtered = {}
+        for (LEDname, priority), di in self.update_list.iteritems():
+            if LEDname not in filtered or \
+                    priority > filtered[LEDname]['priority']:
+                filtered[LEDname] = di
 
-        # Make a copy of the update_list and then clear the original
+        # Take the filtered updates and clear the update_list
         # Why? In case any of these updates need to call their own updates
-        current_list = self.update_list
-        self.update_list = []
+        current_list = filtered.values()
+        self.update_list = {}
         for item in current_list:
             # Only perform the update if the priority is higher than whatever
             # touched that LED last.
@@ -1206,18 +1260,15 @@ class LEDcontroller(object):
 
                 # If we have an entry for color and it is not None
                 if ("color" in item) and item['color']:
+                    # shows and scripts parse their colors when they are
+                    # loaded, only hex colors passed to enable() are left
                     if type(item['color']) is not list:
-                        item['color'] = item['color'].zfill(6)
-                    if item.get('blend', False) and \
-                            (item['color'] == '000000' or\
-                             item['color'] == [0, 0, 0]):
+                        item['color'] = LEDcontroller.convert_hex_to_list(
+                            item['color'])
+                    if item.get('blend', False) and not any(item['color']):
                         self.restore_LED_state(item['LEDname'],
                                                item['priority'])
                     else:
-                        if type(item['color']) is not list:
-                            item['color'] = LEDcontroller.convert_hex_to_list(item\
-                                                                     ['color'])
-
                         # Uncomment the comment block below if you want to log
                         # every LED action. Warning this will be a crazy amount
                         # of logging
@@ -1234,18 +1285,13 @@ class LEDcontroller(object):
                 # Next, if we have a fade:
                 if "fadeend" in item and item.get('fadeend', None):
                     if type(item['dest_color']) is not list:
-                        item['dest_color'] = item['dest_color'].zfill(6)
-                    if item['blend'] and \
-                            (item['dest_color'] == '000000' or\
-                             item['dest_color'] == [0, 0, 0]):
+                        item['dest_color'] = LEDcontroller.convert_hex_to_list(
+                            item['dest_color'])
+                    if item['blend'] and not any(item['dest_color']):
                         self.restore_LED_state(item['LEDname'],
                                                item['priority'],
                                                item['fadeend'])
                     else:
-                        if type(item['dest_color']) is not list:
-                            item['dest_color'] = LEDcontroller.convert_hex_to_list(
-                                item['dest_color'])
-
                         # Calculate the fade duration:
                         fadems = (item['fadeend'] - self.current_time) * 1000
                         # Uncomment the comment block below if you want to log
@@ -1546,6 +1592,13 @@ class LEDcontroller(object):
         # now add our new command to the list
         self.manual_commands.append(params)
 
+        # The running shows only send the LEDs that changed, so a show at this
+        # priority would never take this LED back. Have them send all their
+        # LEDs again until they reach location 0.
+        for show in self.running_shows:
+            if show.priority == priority:
+                show.resync = True
+
         # Add this command to our update_list so it gets serviced along with
         # all the other updates
         if fade:  # if we have a fade
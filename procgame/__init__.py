@@ -13,6 +13,8 @@ __all__ = [
 	'tools',
 	'LEDs',
 	'assetmanager',
+	'switchlog',
+	'clock',
 	]
 
 from _version import __version_info__
@@ -1,5 +1,7 @@
 from procgame import dmd
+from procgame import config
 from procgame.dmd.sdl2_displaymanager import sdl2_DisplayManager
+from procgame.modes.rgbshow import read_rgbshow
 import sdl2
 import pinproc
 """
@@ -8,7 +10,11 @@ import os
 import sys
 import yaml
 import logging
+import time
 import timeit
+import collections
+import multiprocessing
+import multiprocessing.pool
 # logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 from procgame.yaml_helper import value_for_key
 
@@ -25,6 +31,113 @@ class DictWithDefault(dict):
             raise KeyError("***ASSET ERROR: An asset with key '%s' has not been loaded.  And default '%s' could not be found to be used instead!" % (key, self.miss_key))
         return self[self.miss_key]
 
+class LazyAssetDict(DictWithDefault):
+    """ A DictWithDefault in which an asset can be registered with a loader instead of a value;
+        the loader runs the first time the key is looked up.  Once owner is set, the time at
+        which each key is first looked up is kept in first_used and reported to the owner's
+        asset_used().
+    """
+    def __init__(self, default_miss_key, kind='assets'):
+        DictWithDefault.__init__(self, default_miss_key)
+        self.kind = kind
+        self.loaders = {} # key -> [loader, ...] for the keys not loaded yet
+        self.first_used = {}
+        self.owner = None
+
+    def register(self, key, loader):
+        self.loaders.setdefault(key, []).append(loader)
+
+    def load(self, key):
+        """ runs the loaders still pending for key, if any """
+        if(key in self.loaders):
+            for loader in self.loaders.pop(key):
+                loader()
+
+    def __getitem__(self, key):
+        if(self.owner is not None and key not in self.first_used):
+            self.first_used[key] = time.time()
+            self.owner.asset_used(self, key)
+        self.load(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.loaders.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        # a loader may fail to load its file, so only a key that really loaded is in the dict
+        try:
+            self.load(key)
+        except Exception:
+            logging.exception("***ASSET ERROR: %s '%s' could not be loaded" % (self.kind, key))
+        return dict.__contains__(self, key)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        if(key in self):
+            return self[key]
+        return default
+
+    def keys(self):
+        return dict.keys(self) + [k for k in self.loaders if not dict.__contains__(self, k)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return dict.__len__(self) + len([k for k in self.loaders if not dict.__contains__(self, k)])
+
+class AssetDecodeQueue(object):
+    """ Decodes asset files on a pool of worker threads, or processes, ahead of the main thread
+        which is left with turning the decoded data into textures and game objects.
+
+        Jobs are started in the order they were added, at most *window* at a time so decoded
+        data does not pile up in memory, and the main thread claims each result with take().
+        Nothing run by the workers may touch SDL.
+    """
+    def __init__(self, workers, use_processes=False, window=None):
+        super(AssetDecodeQueue, self).__init__()
+        if use_processes:
+            self.pool = multiprocessing.Pool(workers)
+        else:
+            self.pool = multiprocessing.pool.ThreadPool(workers)
+        self.window = window or workers * 4
+        self.keys = set()
+        self.waiting = collections.deque() # (key, fn, args) not started yet, in order
+        self.running = {} # key -> AsyncResult
+
+    def add(self, key, fn, *args):
+        """ queues fn(*args) under key; a key that was already added is ignored """
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        self.waiting.append((key, fn, args))
+        self.fill()
+
+    def fill(self):
+        while self.waiting and len(self.running) < self.window:
+            (key, fn, args) = self.waiting.popleft()
+            self.running[key] = self.pool.apply_async(fn, args)
+
+    def take(self, key):
+        """ returns the result of the job added under key, waiting for it if needed, and
+            re-raises the exception of a failed job.  Returns None if the job was not started,
+            in which case the caller has to do the work itself.
+        """
+        result = self.running.pop(key, None)
+        if result is None:
+            self.waiting = collections.deque([w for w in self.waiting if w[0] != key])
+            return None
+        self.fill()
+        return result.get()
+
+    def close(self):
+        self.waiting.clear()
+        self.running.clear()
+        self.pool.terminate()
+        self.pool.join()
+
 class AssetManager(object):
     """ The AssetManager class reads the asset_list.yaml file, loading from it Animations, Fonts, Lampshows, etc.
          the values data structure is loaded from :file:`./config/asset_list.yaml` when this submodule is loaded;
@@ -36,13 +149,17 @@ class AssetManager(object):
 
     loaded_map = {}
     loaded_assets_files = []
-    animations = DictWithDefault(default_miss_key='missing')
+    animations = LazyAssetDict(default_miss_key='missing', kind='animations')
     lengths = DictWithDefault(default_miss_key='missing')
-    fonts = DictWithDefault(default_miss_key='default')
+    fonts = LazyAssetDict(default_miss_key='default', kind='fonts')
     sounds = {}
     fontstyles = {}
     numLoaded = 0
     dmd_path =""
+    decode_queue = None
+    loading = False
+    lazy_loading = False
+    manifest_saved = False
     # screen = None
     # pygF = None
     total = ""
@@ -134,6 +251,10 @@ class AssetManager(object):
         if self.game.use_proc_dmd:
             self.rfont = dmd.font_named('Font07x5.dmd')
 
+        self.lazy_loading = config.value_for_key_path(keypath='asset_lazy_loading', default=False)
+        self.preload_seconds = config.value_for_key_path(keypath='asset_preload_seconds', default=60)
+        self.manifest_path = config.value_for_key_path(keypath='asset_preload_manifest', default=os.path.join(game.curr_file_path, 'config/asset_manifest.yaml'))
+
         self.load()
 
     def verify_alpha(self, color):
@@ -143,6 +264,9 @@ class AssetManager(object):
             return color
 
     def updateProgressBar(self, displayType, fname):
+        if(not self.loading):
+            return # an asset loaded on first use, once the game runs
+
         if(self.splash_image is not None):
             sdl2_DisplayManager.inst().roto_blit(self.splash_image, self.frame.pySurface, dest=None, area=None, angle=0, origin=None, flip=0)
         else:
@@ -175,6 +299,7 @@ class AssetManager(object):
             self.render_text(s, x=self.text_x, y=int(self.text_y+1.2*tx_h))
 
         sdl2_DisplayManager.inst().switch_target(bk)
+        self.frame.touch()
         if self.game.use_proc_dmd:
             self.game.dmd.proc_dmd_draw(self.frame)
 
@@ -204,7 +329,7 @@ class AssetManager(object):
             size = tx.size
         return size
 
-    def loadIntoCache(self,key,frametime=1,file=None,repeatAnim=False,holdLastFrame=False,  opaque = False, composite_op = None, x_loc =0, y_loc=0, streaming_load=False, streaming_png=False, png_stream_cache=False, custom_sequence=None, scale=None):
+    def loadIntoCache(self,key,frametime=1,file=None,repeatAnim=False,holdLastFrame=False,  opaque = False, composite_op = None, x_loc =0, y_loc=0, streaming_load=False, streaming_png=False, png_stream_cache=False, custom_sequence=None, scale=None, atlas=None):
         if(file==None):
             file=key + '.vga.dmd.zip'
 
@@ -216,7 +341,10 @@ class AssetManager(object):
             #print("quick loaded '%s'" % key)
         else:
             if(not streaming_load):
-                tmp = dmd.Animation().load(self.dmd_path + file , composite_op=composite_op, use_streaming_mode = streaming_png, png_stream_cache=png_stream_cache)
+                decoded_frames = None
+                if(self.decode_queue is not None and not streaming_png):
+                    decoded_frames = self.decode_queue.take(('animation', self.dmd_path + file))
+                tmp = dmd.Animation().load(self.dmd_path + file , composite_op=composite_op, use_streaming_mode = streaming_png, png_stream_cache=png_stream_cache, decoded_frames=decoded_frames, use_atlas=atlas)
             self.loaded_map[file] = key
 
         if(tmp is not None):
@@ -241,7 +369,57 @@ class AssetManager(object):
         #   self.animations[key].composite_op = composite_op
         self.numLoaded += 1
 
+    def create_decode_queue(self):
+        """ returns the AssetDecodeQueue configured by the asset_decode_workers and
+            asset_decode_processes keys of config.yaml, or None if decoding on the main thread
+        """
+        workers = config.value_for_key_path(keypath='asset_decode_workers', default=multiprocessing.cpu_count())
+        if(not workers):
+            return None
+        use_processes = config.value_for_key_path(keypath='asset_decode_processes', default=False)
+        return AssetDecodeQueue(int(workers), use_processes)
+
+    def queue_decodes(self, rgbshows, anims):
+        """ hands the rgbshow files and the animations that are not in the animation cache to
+            the decode queue, in loading order """
+        for l in rgbshows:
+            f = self.game.lampshow_path + value_for_key(l,'file')
+            self.decode_queue.add(('rgbshow', f), read_rgbshow, f)
+
+        animation_cache = dmd.AnimationCacheManager.shared_manager()
+        for anim in anims:
+            f  = value_for_key(anim,'file') or (value_for_key(anim,'key') + '.vga.dmd.zip')
+            streaming_load  = value_for_key(anim, 'streamingMovie', False)
+            streaming_png  = value_for_key(anim, 'streamingPNG', value_for_key(anim, 'streamingPNG_Cached', False))
+            if(streaming_load or streaming_png or self.loaded_map.has_key(f)):
+                continue
+            path = self.dmd_path + f
+            try:
+                if(dmd.loads_on_demand(path)):
+                    continue # mapped, never decoded ahead
+                if(animation_cache and animation_cache.has_animation(path, value_for_key(anim,'composite_op'), value_for_key(anim,'atlas'))):
+                    continue
+            except ValueError:
+                continue # no such file; Animation.load() reports it
+            self.decode_queue.add(('animation', path), dmd.decode_animation, path)
+
     def load(self):
+        self.loading = True
+        self.decode_queue = self.create_decode_queue()
+        try:
+            self.load_assets()
+        finally:
+            self.loading = False
+            if(self.decode_queue is not None):
+                self.decode_queue.close()
+                self.decode_queue = None
+
+        self.loaded_time = time.time()
+        if(self.lazy_loading):
+            for assets in (self.animations, self.fonts, self.sounds):
+                assets.owner = self
+
+    def load_assets(self):
         l = logging.getLogger("PIL.PngImagePlugin")
         l.setLevel(logging.WARNING)
         l = logging.getLogger("game.assets")
@@ -279,16 +457,32 @@ class AssetManager(object):
             effects += value_for_key(sounds,'Effects',{}) or list()
             voice += value_for_key(sounds,'Voice',{}) or list()
 
+        if(self.lazy_loading):
+            # register every animation, font and sound so it loads on first use,
+            # then load up front only those listed in the preload manifest
+            self.sounds = LazyAssetDict(default_miss_key=None, kind='sounds')
+            self.sounds.update(self.game.sound.sounds)
+            self.game.sound.sounds = self.sounds
+            manifest = self.read_manifest()
+            hfonts = self.register_lazy(self.fonts, hfonts, manifest, self.load_hdfont)
+            rfonts = self.register_lazy(self.fonts, rfonts, manifest, self.load_dmdfont)
+            anims = self.register_lazy(self.animations, anims, manifest, self.load_animation)
+            effects = self.register_lazy(self.sounds, effects, manifest, self.load_effect)
+            voice = self.register_lazy(self.sounds, voice, manifest, self.load_voice)
+
         self.total = len(lamps) + len(rgbshows) + len(hfonts) + len(rfonts) + len(anims) + len(music) + len(effects) + len(voice)
 
+        if(self.decode_queue is not None):
+            self.queue_decodes(rgbshows, anims)
+
         try:
-            current = ""
+            self.current = ""
             for l in lamps:
                 k  = value_for_key(l,'key')
                 fname = value_for_key(l,'file')
                 self.updateProgressBar("Lampshows", fname)
                 f = self.game.lampshow_path + fname
-                current = 'Lampshow: [%s]: %s, %s ' % (k, f, fname)
+                self.current = 'Lampshow: [%s]: %s, %s ' % (k, f, fname)
                 self.game.lampctrl.register_show(k, f)
 
                 # Validate the lampshow --as best as possible
@@ -306,33 +500,18 @@ class AssetManager(object):
                 fname = value_for_key(l,'file')
                 self.updateProgressBar("RGBShows", fname)
                 f = self.game.lampshow_path + fname
-                current = 'RGBshow: [%s]: %s, %s ' % (k, f, fname)
-                self.game.rgbshow_player.load(k, f)
+                self.current = 'RGBshow: [%s]: %s, %s ' % (k, f, fname)
+                compiled = None
+                if(self.decode_queue is not None):
+                    compiled = self.decode_queue.take(('rgbshow', f))
+                self.game.rgbshow_player.load(k, f, compiled)
                 self.numLoaded += 1
 
             for f in hfonts:
-                k  = value_for_key(f,'key')
-                sname = value_for_key(f,'systemName',k)
-                size  = value_for_key(f,'size')
-                file_path = value_for_key(f, 'file', None)
-                self.updateProgressBar("HD Fonts", sname)
-                current = 'HD font: [%s]: %s, %d ' % (k, sname, size)
-
-                if(file_path is not None):
-                    file_path = self.game.hdfont_path + file_path
-                    if(not os.path.isfile(file_path)):
-                        raise ValueError, "Could not load font as specified in yaml\n %s\n File [%s] does not exist." % (current, file_path)
-
-                self.fonts[k] = dmd.hdfont_named(sname,size, font_file_path=file_path)
-                self.numLoaded += 1
+                self.load_hdfont(f)
 
             for f in rfonts:
-                k  = value_for_key(f,'key')
-                fname = value_for_key(f,'file')
-                self.updateProgressBar("DMD Fonts", fname)
-                current = 'Font: [%s]: %s ' % (k, fname)
-                self.fonts[k] = dmd.font_named(fname)
-                self.numLoaded += 1
+                self.load_dmdfont(f)
 
             for f in fontstyles:
                 ic = value_for_key(f, 'interior_color')
@@ -344,32 +523,15 @@ class AssetManager(object):
                 # fontstyles load instantly, do not count fontstyles in number of loaded assets
 
             for anim in anims:
-                k  = value_for_key(anim,'key')
-                ft = value_for_key(anim,'frame_time',2)
-                f  = value_for_key(anim,'file')
-                r  = value_for_key(anim,'repeatAnim',False)
-                h  = value_for_key(anim,'holdLastFrame',False)
-                o  = value_for_key(anim,'opaque',False)
-                c  = value_for_key(anim,'composite_op')
-                x  = value_for_key(anim, 'x_loc', 0)
-                y  = value_for_key(anim, 'y_loc', 0)
-                streaming_load  = value_for_key(anim, 'streamingMovie', False)
-                png_stream_cache  = value_for_key(anim, 'streamingPNG_Cached', False)
-                streaming_png  = value_for_key(anim, 'streamingPNG', png_stream_cache)
-                custom_sequence  = value_for_key(anim, 'sequence', None)
-                scaling = value_for_key(anim, 'scale', None)
-                current = 'Animation: [%s]: %s' % (k, f)
-                # started = timeit.time.time()
-                started = timeit.time.time()
-                self.loadIntoCache(k,ft,f,r,h,o,c,x,y,streaming_load, streaming_png, png_stream_cache, custom_sequence, scaling)
-                time_taken = timeit.time.time() - started
-                self.logger.info("loading visual asset took %.3f seconds" % time_taken)
+                self.load_animation(anim)
         except:
-            self.logger.error("===ASSET MANAGER - ASSET FAILURE===")
-            self.logger.error(current)
-            self.logger.error("======")
+            self.report_failure()
             raise
 
+        animation_cache = dmd.AnimationCacheManager.shared_manager()
+        if animation_cache:
+            self.logger.info("animation cache: %d hits, %d misses" % (animation_cache.hits, animation_cache.misses))
+
         for s in music:
             k  = value_for_key(s,'key')
             fname = value_for_key(s,'file')
@@ -380,18 +542,152 @@ class AssetManager(object):
             self.numLoaded += 1
 
         for s in effects:
-            k  = value_for_key(s,'key')
-            fname = value_for_key(s,'file')
-            volume = value_for_key(s,'volume',.5)
-            is_voice = value_for_key(s, 'voice', False)
-            self.updateProgressBar("Audio SFX", fname)
-            self.game.sound.register_sound(k,self.game.sfx_path+fname, volume=volume, is_voice=is_voice)
-            self.numLoaded += 1
+            self.load_effect(s)
 
         for s in voice:
-            k  = value_for_key(s,'key')
-            fname = value_for_key(s,'file')
-            volume = value_for_key(s,'volume',.5)
-            self.updateProgressBar("Audio Voices", fname)
-            self.game.sound.register_sound(k,self.game.voice_path+fname, volume=volume, is_voice=True)
-            self.numLoaded += 1
+            self.load_voice(s)
+
+    def load_hdfont(self, f):
+        k  = value_for_key(f,'key')
+        sname = value_for_key(f,'systemName',k)
+        size  = value_for_key(f,'size')
+        file_path = value_for_key(f, 'file', None)
+        self.updateProgressBar("HD Fonts", sname)
+        self.current = 'HD font: [%s]: %s, %d ' % (k, sname, size)
+
+        if(file_path is not None):
+            file_path = self.game.hdfont_path + file_path
+            if(not os.path.isfile(file_path)):
+                raise ValueError, "Could not load font as specified in yaml\n %s\n File [%s] does not exist." % (self.current, file_path)
+
+        self.fonts[k] = dmd.hdfont_named(sname,size, font_file_path=file_path)
+        self.numLoaded += 1
+
+    def load_dmdfont(self, f):
+        k  = value_for_key(f,'key')
+        fname = value_for_key(f,'file')
+        self.updateProgressBar("DMD Fonts", fname)
+        self.current = 'Font: [%s]: %s ' % (k, fname)
+        self.fonts[k] = dmd.font_named(fname)
+        self.numLoaded += 1
+
+    def load_animation(self, anim):
+        k  = value_for_key(anim,'key')
+        ft = value_for_key(anim,'frame_time',2)
+        f  = value_for_key(anim,'file')
+        r  = value_for_key(anim,'repeatAnim',False)
+        h  = value_for_key(anim,'holdLastFrame',False)
+        o  = value_for_key(anim,'opaque',False)
+        c  = value_for_key(anim,'composite_op')
+        x  = value_for_key(anim, 'x_loc', 0)
+        y  = value_for_key(anim, 'y_loc', 0)
+        streaming_load  = value_for_key(anim, 'streamingMovie', False)
+        png_stream_cache  = value_for_key(anim, 'streamingPNG_Cached', False)
+        streaming_png  = value_for_key(anim, 'streamingPNG', png_stream_cache)
+        custom_sequence  = value_for_key(anim, 'sequence', None)
+        scaling = value_for_key(anim, 'scale', None)
+        atlas = value_for_key(anim, 'atlas', None)
+        self.current = 'Animation: [%s]: %s' % (k, f)
+        # started = timeit.time.time()
+        started = timeit.time.time()
+        self.loadIntoCache(k,ft,f,r,h,o,c,x,y,streaming_load, streaming_png, png_stream_cache, custom_sequence, scaling, atlas)
+        time_taken = timeit.time.time() - started
+        self.logger.info("loading visual asset took %.3f seconds" % time_taken)
+
+    def load_effect(self, s):
+        k  = value_for_key(s,'key')
+        fname = value_for_key(s,'file')
+        volume = value_for_key(s,'volume',.5)
+        is_voice = value_for_key(s, 'voice', False)
+        self.updateProgressBar("Audio SFX", fname)
+        self.game.sound.register_sound(k,self.game.sfx_path+fname, volume=volume, is_voice=is_voice)
+        self.numLoaded += 1
+
+    def load_voice(self, s):
+        k  = value_for_key(s,'key')
+        fname = value_for_key(s,'file')
+        volume = value_for_key(s,'volume',.5)
+        self.updateProgressBar("Audio Voices", fname)
+        self.game.sound.register_sound(k,self.game.voice_path+fname, volume=volume, is_voice=True)
+        self.numLoaded += 1
+
+    def report_failure(self):
+        self.logger.error("===ASSET MANAGER - ASSET FAILURE===")
+        self.logger.error(self.current)
+        self.logger.error("======")
+
+    def register_lazy(self, assets, entries, manifest, load_fn):
+        """ registers a loader in the LazyAssetDict assets for each of the asset list entries;
+            returns the entries listed in the manifest, which are to be loaded right away
+        """
+        preload = []
+        listed = set(manifest.get(assets.kind) or [])
+        for entry in entries:
+            k = value_for_key(entry,'key')
+            if(k in listed):
+                preload.append(entry)
+            else:
+                assets.register(k, self.lazy_loader(load_fn, entry))
+        return preload
+
+    def lazy_loader(self, load_fn, entry):
+        def load():
+            try:
+                load_fn(entry)
+            except:
+                self.report_failure()
+                raise
+        return load
+
+    def asset_used(self, assets, key):
+        """ called by the LazyAssetDicts the first time each key is looked up after loading """
+        if(self.manifest_saved or time.time() - self.loaded_time <= self.preload_seconds):
+            return
+        self.save_manifest()
+
+    def read_manifest(self):
+        """ returns the preload manifest saved by the previous session: a dict of lists of keys
+            by kind of asset, empty if there is none """
+        if(self.manifest_path is None or not os.path.exists(self.manifest_path)):
+            return {}
+        try:
+            manifest = yaml.load(open(self.manifest_path, 'r')) or {}
+        except Exception, e:
+            self.logger.warning("Could not read preload manifest %s: %s" % (self.manifest_path, e))
+            return {}
+        self.logger.info("Preload manifest %s lists %d assets" % (self.manifest_path, sum(len(v) for v in manifest.values())))
+        return manifest
+
+    def save_manifest(self):
+        """ saves the keys of the assets used in the first asset_preload_seconds
+            of this session as the preload manifest of the next one """
+        self.manifest_saved = True
+        if(self.manifest_path is None):
+            return
+        manifest = {}
+        for assets in (self.animations, self.fonts, self.sounds):
+            if(isinstance(assets, LazyAssetDict)):
+                manifest[assets.kind] = sorted(k for (k, t) in assets.first_used.items() if t - self.loaded_time <= self.preload_seconds)
+        try:
+            with open(self.manifest_path, 'w') as f:
+                yaml.dump(manifest, f, default_flow_style=False)
+        except Exception, e:
+            self.logger.warning("Could not save preload manifest %s: %s" % (self.manifest_path, e))
+
+    def session_over(self):
+        """ called when the game shuts down: saves the preload manifest if the game did not
+            run for asset_preload_seconds and logs the assets that were never used """
+        residency = dmd.animation.shared_texture_residency
+        if(residency):
+            for line in residency.report():
+                self.logger.info(line)
+        for line in sdl2_DisplayManager.inst().texture_pool.report():
+            self.logger.info(line)
+        if(not self.lazy_loading):
+            return
+        if(not self.manifest_saved):
+            self.save_manifest()
+        for assets in (self.animations, self.fonts, self.sounds):
+            unused = sorted(k for k in assets.keys() if k not in assets.first_used)
+            if(unused):
+                self.logger.warning("%d %s never used this session: %s" % (len(unused), assets.kind, ", ".join(str(k) for k in unused)))
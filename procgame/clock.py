@@ -0,0 +1,126 @@
+"""Clocks timing the game: mode delays, switch timers, shows, layer animations, DMD frames, etc.
+
+:class:`~procgame.game.GameController` creates its :attr:`~procgame.game.GameController.clock`
+from the ``clock_class`` config key (or takes the one of its P-ROC class, see
+:class:`~procgame.fakepinproc.FakePinPROCReplay`) and makes it the :data:`current` clock.
+Code with a game at hand reads ``self.game.clock.time()``; layers, drivers and the other
+objects that have no game read :func:`now`.  Both read the same clock.
+
+Durations that measure the program itself (loop utilization, event latency, load times) keep
+using :func:`time.time`: they are meaningful only in real time.
+
+The clocks:
+
+* :class:`RealClock` (the default): :func:`time.time`.
+* :class:`AcceleratedClock`: time runs ``clock_rate`` times faster than real time.
+* :class:`SteppedClock`: time only moves when the run loop waits; it jumps to the next deadline
+  instead of sleeping, so the game runs as fast as the CPU allows.  With
+  :class:`~procgame.fakepinproc.FakePinPROC` and the ``event_driven_loop`` this simulates hours
+  of play in minutes.
+"""
+import time
+import logging
+from procgame import config
+
+class RealClock(object):
+    """Wall clock time, :func:`time.time`."""
+
+    virtual = False
+    """True if the clock does not follow real time, so waiting for it must not sleep (see :meth:`wait`)."""
+
+    def time(self):
+        """Returns the current time in seconds, like :func:`time.time`."""
+        return time.time()
+
+    def sleep(self, seconds):
+        """Lets *seconds* of clock time pass."""
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, seconds, wait_fn=None):
+        """Lets up to *seconds* of clock time pass while the run loop has nothing to do.
+        *wait_fn(real seconds)*, if given, returns early when an event arrives."""
+        if seconds <= 0:
+            return
+        if wait_fn:
+            wait_fn(seconds)
+        else:
+            time.sleep(seconds)
+
+class AcceleratedClock(RealClock):
+    """Real time multiplied by *rate* (the ``clock_rate`` config key, 10 by default) since the
+    clock was created.  Waits sleep *rate* times less."""
+
+    def __init__(self, rate=None):
+        super(AcceleratedClock, self).__init__()
+        if rate is None:
+            rate = config.value_for_key_path('clock_rate', 10.0)
+        self.rate = float(rate)
+        self.real_start = time.time()
+        self.start = self.real_start
+
+    def time(self):
+        return self.start + (time.time() - self.real_start) * self.rate
+
+    def sleep(self, seconds):
+        super(AcceleratedClock, self).sleep(seconds / self.rate)
+
+    def wait(self, seconds, wait_fn=None):
+        super(AcceleratedClock, self).wait(seconds / self.rate, wait_fn)
+
+class SteppedClock(RealClock):
+    """A clock that only moves when told to: :meth:`sleep` and :meth:`wait` advance it at once.
+
+    A run loop cycle that has nothing to wait for (its next deadline already passed) advances the
+    clock by :attr:`min_step` (the ``clock_min_step`` config key) so a deadline that stays in the
+    past cannot stop the clock, but not past :attr:`horizon`, if set."""
+
+    virtual = True
+
+    min_step = 0.001
+
+    horizon = None
+    """Function returning a time the :attr:`min_step` must not step over, such as the time of the
+    next simulated switch event, or ``None``."""
+
+    def __init__(self, start=None):
+        super(SteppedClock, self).__init__()
+        self.now = time.time() if start is None else start
+        self.min_step = config.value_for_key_path('clock_min_step', self.min_step)
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, seconds, wait_fn=None):
+        if seconds > 0:
+            self.advance(seconds)
+            return
+        when = self.now + self.min_step
+        limit = self.horizon() if self.horizon else None
+        if limit is not None and limit > self.now:
+            when = min(when, limit)
+        self.advance_to(when)
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def advance_to(self, when):
+        if when > self.now:
+            self.now = when
+
+current = RealClock()
+"""The clock of the game, read by :func:`now`."""
+
+def now():
+    """Returns the time of the :data:`current` clock."""
+    return current.time()
+
+def use(clock):
+    """Makes *clock* the :data:`current` clock."""
+    global current
+    current = clock
+    logging.getLogger('game.clock').info("Using %s", type(clock).__name__)
@@ -17,6 +17,7 @@ __all__ = [
 from vgadmd import *
 from dmd import *
 from animation import *
+from atlas import *
 from font import *
 from layers import *
 from hdfont import *
@@ -2,7 +2,7 @@ import os
 import struct
 import yaml
 import sqlite3
-import bz2
+import zlib
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -15,11 +15,14 @@ if(not hasattr(Image.Image,"tobytes")):
 import dmd
 from dmd import Frame
 from sdl2_displaymanager import sdl2_DisplayManager
+import atlas
 from procgame import config
 import logging
 import re
 import colorsys
 import zipfile
+import mmap
+import collections
 
 # import pygame
 # from pygame import movie
@@ -33,15 +36,39 @@ except ImportError:
 # Global reference; use AnimationCacheManager.shared_manager() to create and reference.
 shared_cache_manager = None
 
+# Global reference; use TextureResidency.shared_residency() to create and reference.
+shared_texture_residency = None
+
 warned_cache_disabled = False
 
+# Masks the dots of the first frame of an 8-bit .dmd font to the 16 greyscale entries of the palette
+FONT_GREYSCALE_TABLE = ''.join(chr(i & 0xF) for i in range(256))
+
 class AnimationCacheManager(object):
-    def __init__(self, path):
+    """On-disk cache of decoded animation frames, so that images and .dmd files do not
+    have to be decoded again on every start.
+
+    Entries hold the RGB or RGBA data of every frame of an animation and are keyed by the
+    file path, its modification time and size, and the ``composite_op`` it was loaded with.
+    They are stored in an SQLite database in the ``dmd_cache_path`` directory, either raw or
+    compressed with zlib at level 1 (``dmd_cache_codec``: ``zlib`` or ``raw``).  When the
+    stored data grows past ``dmd_cache_size_mb`` megabytes the least recently used entries
+    are evicted.
+    """
+
+    DATABASE_VERSION = 2
+
+    def __init__(self, path, codec='zlib', size_budget=256*1024*1024):
         self.path = os.path.expanduser(path)
         if not os.path.exists(self.path):
             os.makedirs(self.path)
+        if codec not in ('zlib', 'raw'):
+            raise ValueError, "Unsupported DMD cache codec '%s'; use 'zlib' or 'raw'." % codec
+        self.codec = codec
+        self.size_budget = size_budget
+        self.hits = 0
+        self.misses = 0
         self.load()
-        # TODO: Check cache for deleted files?
 
     def __del__(self):
         self.conn.close()
@@ -54,7 +81,9 @@ class AnimationCacheManager(object):
         if not shared_cache_manager:
             path = config.value_for_key_path('dmd_cache_path')
             if path:
-                shared_cache_manager = AnimationCacheManager(path)
+                codec = config.value_for_key_path('dmd_cache_codec', 'zlib')
+                size_mb = config.value_for_key_path('dmd_cache_size_mb', 256)
+                shared_cache_manager = AnimationCacheManager(path, codec, int(size_mb*1024*1024))
             else:
                 shared_cache_manager = None
         return shared_cache_manager
@@ -64,9 +93,11 @@ class AnimationCacheManager(object):
         return os.path.join(self.path, 'cache.db')
 
     def load(self):
-        DATABASE_VERSION = 1
         CREATE_VERSION_TABLE = '''create table if not exists version (version integer)'''
-        CREATE_ENTRIES_TABLE = '''create table if not exists entries (path text, created integer, accessed integer, compression text, data blob)'''
+        CREATE_ENTRIES_TABLE = '''create table if not exists entries (path text, composite_op text, mtime real, size integer,
+                                  accessed real, codec text, bytes integer, data blob)'''
+        CREATE_PATH_INDEX = '''create index if not exists entries_path on entries (path)'''
+        CREATE_ACCESSED_INDEX = '''create index if not exists entries_accessed on entries (accessed)'''
         self.conn = sqlite3.connect(self.database_path())
         self.conn.execute(CREATE_VERSION_TABLE)
 
@@ -75,47 +106,145 @@ class AnimationCacheManager(object):
         c.execute('''select version from version limit 1''')
         result = c.fetchone()
         if not result:
-            c.execute('''insert into version values (?)''', (DATABASE_VERSION,))
+            c.execute('''insert into version values (?)''', (self.DATABASE_VERSION,))
         else:
             (version,) = result
-            if version == DATABASE_VERSION:
+            if version == self.DATABASE_VERSION:
                 pass # we are up to date
             else:
-                import pdb; pdb.set_trace()
-                logging.getLogger('game.dmdcache').warning('DMD cache database version (%d) is not current (%d).  Cache will be rebuilt.', version, DATABASE_VERSION)
-                del self.conn
+                logging.getLogger('game.dmdcache').warning('DMD cache database version (%d) is not current (%d).  Cache will be rebuilt.', version, self.DATABASE_VERSION)
+                self.conn.close()
                 os.remove(self.database_path())
                 return self.load()
 
         self.conn.execute(CREATE_ENTRIES_TABLE)
+        self.conn.execute(CREATE_PATH_INDEX)
+        self.conn.execute(CREATE_ACCESSED_INDEX)
         self.conn.commit()
 
+    def fingerprint(self, paths):
+        """Returns the (mtime, size) pair identifying the current contents of the files in *paths*."""
+        mtime = 0
+        size = 0
+        for path in paths:
+            st = os.stat(path)
+            mtime = max(mtime, st.st_mtime)
+            size += st.st_size
+        return (mtime, size)
+
     def invalidate_path(self, path):
         self.conn.execute('''delete from entries where path=?''', (path,))
+        self.conn.commit()
 
-    def get_at_path(self, path, compare_created_time = None):
-        """Attempt to retrieve data from the cache for *path*; returns ``None`` if not present.
-        If the created time on the cache entry is before *compare_created_time*, ``None`` will be returned."""
-        self.conn.execute('''update entries set accessed=?''', (int(time.time()),))
+    def has_animation(self, filename, composite_op, use_atlas=None):
+        """Returns True if loading *filename* with *composite_op* (and *use_atlas*, see
+        :meth:`Animation.load`) would be served from the cache.
+        Unlike :meth:`get_frames` this does not read the entry nor count as an access."""
+        if use_atlas is None:
+            use_atlas = config.value_for_key_path('dmd_atlas', False)
+        key = ('%s:atlas' % (composite_op)) if use_atlas else str(composite_op)
+        paths = animation_paths(filename)
+        key_path = paths[0]
+        paths = unzipped_paths(paths)
+        if len([path for path in paths if not os.path.exists(path)]) > 0:
+            return False
+        row = self.conn.execute('''select mtime, size from entries where path=? and composite_op=?''', (key_path, key)).fetchone()
+        return row is not None and tuple(row) == self.fingerprint(paths)
+
+    def get_frames(self, path, composite_op, fingerprint):
+        """Returns the frames cached for *path* as a list of (width, height, mode, bits) tuples,
+        or ``None`` if there is no entry matching *composite_op* and *fingerprint* (see :meth:`fingerprint`)."""
+        data = self.get_entry(path, str(composite_op), fingerprint)
+        if data is None:
+            return None
+        return self.unpack_frames(data)[0]
+
+    def get_atlas(self, path, composite_op, fingerprint):
+        """Returns the :class:`~procgame.dmd.atlas.AtlasLayout` and the RGBA data of the pages of the
+        atlas cached for *path*, or ``None``; see :meth:`get_frames`."""
+        data = self.get_entry(path, '%s:atlas' % (composite_op), fingerprint)
+        if data is None:
+            return None
+        (pages, offset) = self.unpack_frames(data)
+        return (atlas.unpack_layout(data[offset:]), [bits for (width, height, mode, bits) in pages])
+
+    def get_entry(self, path, key, fingerprint):
         c = self.conn.cursor()
-        c.execute('''select data, created from entries where path=?''', (path,))
+        c.execute('''select rowid, mtime, size, codec, data from entries where path=? and composite_op=?''', (path, key))
         result = c.fetchone()
         if not result:
+            self.misses += 1
             return None
-        (data, created) = result
-        if compare_created_time and compare_created_time > created:
+        (rowid, mtime, size, codec, data) = result
+        if (mtime, size) != fingerprint:
+            # The file changed since it was cached.
+            self.conn.execute('''delete from entries where rowid=?''', (rowid,))
+            self.conn.commit()
+            self.misses += 1
             return None
-        else:
-            return bz2.decompress(data)
-
-    def set_at_path(self, path, data):
-        """Save *data* for the given *path* in the cache."""
-        self.invalidate_path(path)
-        data = bz2.compress(data)
-        created = accessed = int(time.time())
-        self.conn.execute('''insert into entries values (?, ?, ?, ?, ?)''', (path, created, accessed, 'bzip2', sqlite3.Binary(data)))
+        self.conn.execute('''update entries set accessed=? where rowid=?''', (time.time(), rowid))
+        self.conn.commit()
+        data = str(data)
+        if codec == 'zlib':
+            data = zlib.decompress(data)
+        self.hits += 1
+        return data
+
+    def set_frames(self, path, composite_op, fingerprint, frames):
+        """Stores *frames*, a list of (width, height, mode, bits) tuples, as the entry for *path*
+        loaded with *composite_op*, then evicts old entries if the cache is over budget."""
+        self.set_entry(path, str(composite_op), fingerprint, self.pack_frames(frames))
+
+    def set_atlas(self, path, composite_op, fingerprint, layout, pages):
+        """Stores the atlas *layout* and the RGBA data of its *pages* as the entry for *path*; see :meth:`set_frames`."""
+        frames = [(w, h, 'RGBA', bits) for ((w, h), bits) in zip(layout.pages, pages)]
+        self.set_entry(path, '%s:atlas' % (composite_op), fingerprint, self.pack_frames(frames) + atlas.pack_layout(layout))
+
+    def set_entry(self, path, key, fingerprint, data):
+        if self.codec == 'zlib':
+            data = zlib.compress(data, 1)
+        if len(data) > self.size_budget:
+            return
+        (mtime, size) = fingerprint
+        self.conn.execute('''delete from entries where path=? and composite_op=?''', (path, key))
+        self.conn.execute('''insert into entries values (?, ?, ?, ?, ?, ?, ?, ?)''', (path, key, mtime, size, time.time(), self.codec, len(data), sqlite3.Binary(data)))
+        self.evict()
         self.conn.commit()
 
+    def evict(self):
+        """Deletes the least recently used entries until the stored data fits in the size budget."""
+        (total,) = self.conn.execute('''select total(bytes) from entries''').fetchone()
+        if total <= self.size_budget:
+            return
+        doomed = []
+        for (rowid, nbytes) in self.conn.execute('''select rowid, bytes from entries order by accessed''').fetchall():
+            if total <= self.size_budget:
+                break
+            doomed.append((rowid,))
+            total -= nbytes
+        self.conn.executemany('''delete from entries where rowid=?''', doomed)
+
+    def pack_frames(self, frames):
+        header = [struct.pack('<I', len(frames))]
+        for (width, height, mode, bits) in frames:
+            header.append(struct.pack('<II4s', width, height, mode))
+        return ''.join(header + [bits for (width, height, mode, bits) in frames])
+
+    def unpack_frames(self, data):
+        (count,) = struct.unpack_from('<I', data, 0)
+        offset = 4
+        headers = []
+        for i in range(count):
+            headers.append(struct.unpack_from('<II4s', data, offset))
+            offset += 12
+        frames = []
+        for (width, height, mode) in headers:
+            mode = mode.rstrip('\0')
+            length = width * height * len(mode)
+            frames.append((width, height, mode, data[offset:offset+length]))
+            offset += length
+        return (frames, offset)
+
 
 class Animation(object):
     """An ordered collection of :class:`~procgame.dmd.Frame` objects."""
@@ -127,13 +256,17 @@ class Animation(object):
     frames = []
     """Ordered collection of :class:`~procgame.dmd.Frame` objects."""
     font_loader = False
+    decoded = None
+    packing = False
+    atlas = None
+    """The :class:`~procgame.dmd.atlas.TextureAtlas` holding the frames, if :meth:`load` packed them."""
 
     def __init__(self):
         """Initializes the animation."""
         super(Animation, self).__init__()
         self.frames = []
 
-    def load(self, filename, allow_cache=True, composite_op=None, use_streaming_mode=False, png_stream_cache=False):
+    def load(self, filename, allow_cache=True, composite_op=None, use_streaming_mode=False, png_stream_cache=False, decoded_frames=None, use_atlas=None):
         """Loads *filename* from disk.  The native animation format is the
         :ref:`dmd-format`, which can be created using :ref:`tool-dmdconvert`, or
         `DMDAnimator <https://github.com/preble/DMDAnimator>`_.
@@ -143,118 +276,166 @@ class Animation(object):
         `Python Imaging Library <http://www.pythonware.com/products/pil/>`_.
         Note that loading such images can be time-consuming.  As such, a caching
         facility is provided.  To enable animation caching, provide a path using the
-        ``dmd_cache_path`` key in :ref:`config-yaml`.  Note that only non-native
-        images are cached (.dmd files are not cached).
+        ``dmd_cache_path`` key in :ref:`config-yaml`.  The decoded frames of every
+        format are then cached (see :class:`AnimationCacheManager`); fonts and
+        streamed animations are not.
 
         *filename* can be a string or a list.  If it is a list, the images pointed
         to will be appended to the animation.
-        """
 
-        # Allow the parameter to be a single filename, or a list of filenames.
-        paths = list()
-        if type(filename) != list:
-            if re.search("%[0-9]*d", filename):
-                frame_index = 0
-                while True:
-                    tmp_filename = filename % (frame_index)
-                    if os.path.exists(tmp_filename):
-                        paths += [tmp_filename]
-                        frame_index += 1
-                    else:
-                        break;
-            else:
-                paths += [filename]
+        With the ``dmd_on_demand`` config key set, .dmd files are memory mapped instead and
+        :attr:`frames` is a :class:`MappedFrameList`: see :func:`loads_on_demand`.
 
-        paths = map(os.path.abspath, paths)
+        With *use_atlas* (by default the ``dmd_atlas`` config key), the frames are packed
+        into the pages of a :class:`~procgame.dmd.atlas.TextureAtlas`, :attr:`atlas`, instead of
+        getting a texture each; the atlas is what gets cached then.
+
+        *decoded_frames* is the result of :func:`decode_animation` for *filename*
+        when the files were already decoded ahead of time, typically by a worker of
+        the :class:`~procgame.assetmanager.AssetManager`; only the textures are made here then.
+        """
+
+        paths = animation_paths(filename)
 
         # The path that is used as the key in the database
-        if(len(paths)==0):
-            raise ValueError, "Load FAILED: could not locate a file matching [%s]" % filename
         key_path = paths[0]
 
         self.frames = []
 
+        if(use_streaming_mode):
+            # do special stuff for png streaming
+            # back up the composite op
+            self.composite_op = composite_op
+            # 1. save the file name
+            self.filenames = paths
+
+            # 2. use an on demand frame list instead of a regular list.
+            self.frames = OnDemandFrameList(0,self.load_single_frame, png_stream_cache)
+            self.frames.set_count(len(self.filenames))
+
+            return self
+            # otherwise, proceed as usual
+
+        if loads_on_demand(paths) and not self.font_loader:
+            self.frames = MappedFrameList([MappedDmdFile(path) for path in unzipped_paths(paths)], composite_op)
+            (self.width, self.height) = (self.frames.files[0].width, self.frames.files[0].height)
+            return self
+
+        paths = unzipped_paths(paths)
+
         animation_cache = None
-        if allow_cache:
+        if allow_cache and not self.font_loader:
             animation_cache = AnimationCacheManager.shared_manager()
 
+        if use_atlas is None:
+            use_atlas = config.value_for_key_path('dmd_atlas', False)
+        use_atlas = use_atlas and not self.font_loader
+
         logger = logging.getLogger('game.dmdcache')
         t0 = time.time()
-        data = None
+        cached = None
 
         if animation_cache:
             # Check the cache for this data:
-            if os.path.exists(key_path):
-                data = animation_cache.get_at_path(key_path, os.path.getmtime(key_path))
+            if len([path for path in paths if not os.path.exists(path)]) == 0:
+                fingerprint = animation_cache.fingerprint(paths)
+                if use_atlas:
+                    cached = animation_cache.get_atlas(key_path, composite_op, fingerprint)
+                else:
+                    cached = animation_cache.get_frames(key_path, composite_op, fingerprint)
+            else:
+                animation_cache = None
 
         # If there was data in the cache:
-        if data:
-            # If it was in the cache, we know that it is in the dmd format:
-            self.populate_from_dmd_file(StringIO(data))
-            # print "Loaded", path, "from cache",
+        if cached is not None:
+            if use_atlas:
+                (layout, pages) = cached
+                self.set_atlas(atlas.TextureAtlas(layout, pages, composite_op))
+            else:
+                for (width, height, mode, bits) in cached:
+                    self.append_frame_from_bits(width, height, mode, bits, composite_op)
             logger.debug('Loaded "%s" from cache in %0.3fs', key_path, time.time()-t0)
-        else:
-            # Not in the cache, so we must load from disk:
-            logger.info('Loading %s...', key_path) # Log for images...
-
-            if(use_streaming_mode):
-                # do special stuff for png streaming
-                # back up the composite op
-                self.composite_op = composite_op
-                # 1. save the file name
-                self.filenames = paths
-
-                # 2. use an on demand frame list instead of a regular list.
-                self.frames = OnDemandFrameList(0,self.load_single_frame, png_stream_cache)
-                self.frames.set_count(len(self.filenames))
-
-                return self
-                # otherwise, proceed as usual
-
-            # Iterate over the provided paths:
-            for path in paths:
-                if (os.path.isfile(path.rstrip('.zip'))):
-                    #print("Using unzipped DMD for '" + path + "'")
-                    path = path.rstrip('.zip')
-                # Opening from disk.  It may be a DMD, or it may be another format.
-                # We keep track of the DMD data representation so we can save it to
-                # the cache.
-                ext = path[-4:].lower()
-                if ext =='.dmd':
-                    # Note: Right now we don't cache .dmd files.
-                    with open(path, 'rb') as f:
-                        self.populate_from_dmd_file(f, composite_op = composite_op)
-                elif ext =='.zip':
-                    z = zipfile.ZipFile(path, "r")
-                    data = z.read(z.namelist()[0])    #Read in the first image data
-                    self.populate_from_dmd_file(StringIO(data), composite_op = composite_op)
-                elif ext =='.mp4' or ext == '.avi':
-                    self.populate_from_mp4_file(path)
-                else:
-                    # logger.info('Loading %s...', path) # Log for images...
-                    global warned_cache_disabled
-                    if not animation_cache and not warned_cache_disabled and allow_cache:
-                        logger.warning('Loading image file with caching disabled; set dmd_cache_path in config to enable.')
-                        warned_cache_disabled = True
+            return self
+
+        # Not in the cache, so we must load from disk:
+        logger.info('Loading %s...', key_path) # Log for images...
+
+        # Keep the decoded data of every frame so it can be saved to the cache or packed.
+        if animation_cache or use_atlas:
+            self.decoded = []
+        self.packing = use_atlas
+        try:
+            if decoded_frames is not None:
+                for (width, height, mode, bits) in decoded_frames:
+                    self.append_frame_from_bits(width, height, mode, bits, composite_op)
+            else:
+                # Iterate over the provided paths:
+                for path in paths:
+                    # Opening from disk.  It may be a DMD, or it may be another format.
+                    ext = path[-4:].lower()
+                    if ext =='.dmd':
+                        with open(path, 'rb') as f:
+                            self.populate_from_dmd_file(f, composite_op = composite_op)
+                    elif ext =='.zip':
+                        z = zipfile.ZipFile(path, "r")
+                        data = z.read(z.namelist()[0])    #Read in the first image data
+                        self.populate_from_dmd_file(StringIO(data), composite_op = composite_op)
+                    elif ext =='.mp4' or ext == '.avi':
+                        self.populate_from_mp4_file(path)
+                    else:
+                        # logger.info('Loading %s...', path) # Log for images...
+                        global warned_cache_disabled
+                        if not animation_cache and not warned_cache_disabled and allow_cache:
+                            logger.warning('Loading image file with caching disabled; set dmd_cache_path in config to enable.')
+                            warned_cache_disabled = True
+
+                        with open(path, 'rb') as f:
+                            self.populate_from_image_file_sdl2(path, f, composite_op = composite_op)
+            decoded = self.decoded
+        finally:
+            self.decoded = None
+            self.packing = False
+
+        if use_atlas:
+            layout = atlas.AtlasLayout([(width, height) for (width, height, mode, bits) in decoded], config.value_for_key_path('dmd_atlas_size', 2048))
+            pages = atlas.pack_pages(layout, decoded)
+            self.set_atlas(atlas.TextureAtlas(layout, pages, composite_op, self.frames))
+            logger.debug('Packed %d frames of "%s" into %d atlas pages', len(self.frames), key_path, len(layout.pages))
+
+        # Finally store the data in the cache:
+        if animation_cache:
+            if use_atlas:
+                animation_cache.set_atlas(key_path, composite_op, fingerprint, layout, pages)
+            else:
+                animation_cache.set_frames(key_path, composite_op, fingerprint, decoded)
 
-                    # It is some other file format.  We will use PIL to open it
-                    # and then process it into a .dmd format.
-                    with open(path, 'rb') as f:
-                        self.populate_from_image_file_sdl2(path, f, composite_op = composite_op)
+        # print('Loaded "%s" from disk in %0.3fs', key_path, time.time()-t0)
 
-            # Now use our normal save routine to get the DMD format data:
-            # stringio = StringIO.StringIO()
-            # self.save_to_dmd_file(stringio)
-            # dmd_data = stringio.getvalue()
+        return self
 
-            # Finally store the data in the cache:
-            if animation_cache:
-                #print "Storing in the cache: ", key_path
-                animation_cache.set_at_path(key_path, dmd_data)
+    def append_frame_from_bits(self, width, height, mode, bits, composite_op = None):
+        """Appends a frame made from *bits*, the decoded *mode* ('RGB' or 'RGBA') data of a *width* x *height* image.
+        When :meth:`load` packs an atlas, the frame gets its texture from the atlas afterwards."""
+        if self.packing:
+            frame = Frame(width, height, from_surface=atlas.PENDING)
+        else:
+            surf = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=bits, width=width, height=height, mode=mode, composite_op=composite_op)
+            frame = Frame(width, height, from_surface=surf)
+        self.frames.append(frame)
+        self.record_decoded(width, height, mode, bits)
+        (self.width, self.height) = (width, height)
+        return frame
 
-            # print('Loaded "%s" from disk in %0.3fs', key_path, time.time()-t0)
+    def set_atlas(self, texture_atlas):
+        self.atlas = texture_atlas
+        self.frames = list(texture_atlas.frames)
+        if len(self.frames):
+            (self.width, self.height) = (self.frames[-1].width, self.frames[-1].height)
 
-        return self
+    def record_decoded(self, width, height, mode, bits):
+        """Keeps the decoded data of a frame that was just loaded, when :meth:`load` is filling the cache."""
+        if self.decoded is not None:
+            self.decoded.append((width, height, mode, bits))
 
     def save(self, filename):
         """Saves the animation as a .dmd file at the given location, `filename`."""
@@ -313,6 +494,11 @@ class Animation(object):
 
     def populate_from_image_file_sdl2(self, path, f, composite_op = None):
         # print("loading %s" % f)
+        if self.decoded is not None:
+            # Decode with PIL so the pixels can be cached.
+            (w, h, mode, bits) = decode_image_file(f)
+            self.append_frame_from_bits(w, h, mode, bits, composite_op)
+            return
         tx = sdl2_DisplayManager.inst().load_texture(path, composite_op)
         (self.width,self.height) = tx._size
         frame = Frame(self.width,self.height,tx)
@@ -351,47 +537,27 @@ class Animation(object):
 
 
     def populate_from_dmd_file(self, f, composite_op = None):
-        f.seek(0, os.SEEK_END) # Go to the end of the file to get its length
-        file_length = f.tell()
-
-        f.seek(0) # Skip back to the 4 byte DMD header.
-        dmd_version = struct.unpack("I", f.read(4))[0]
-        dmd_style = 0 # old
-        if(dmd_version == 0x00646D64):
-            # print("old dmd style")
-            pass
-        elif(dmd_version == 0x00DEFACE):
-            # print("full color dmd style")
-            dmd_style = 1
-
-        frame_count = struct.unpack("I", f.read(4))[0]
-        self.width = struct.unpack("I", f.read(4))[0]
-        self.height = struct.unpack("I", f.read(4))[0]
+        (dmd_style, frame_count, self.width, self.height) = read_dmd_header(f)
+
         if(dmd_style==0):
-            if file_length != 16 + self.width * self.height * frame_count:
-                logging.getLogger('game.dmdcache').warning(f)
-                logging.getLogger('game.dmdcache').warning("expected size = {%d} got {%d}", (16 + self.width * self.height * frame_count), (file_length))
-                raise ValueError, "File size inconsistent with original DMD format header information.  Old or incompatible file format?"
-        elif(dmd_style==1):
-            if file_length != 16 + self.width * self.height * frame_count * 3:
-                logging.getLogger('game.dmdcache').warning(f)
-                raise ValueError, "File size inconsistent with true-color DMD format header information. Old or incompatible file format?"
+            # decode all the frames at once
+            frame_size = self.width * self.height
+            data = f.read(frame_size * frame_count)
+            if self.font_loader:
+                # restrict raster font pixels to greyscale like on the P-ROC DMD
+                data = data[:frame_size].translate(FONT_GREYSCALE_TABLE) + data[frame_size:]
+            rgb = Frame.decode_8bit_dmd_string(data)
+            for frame_index in range(frame_count):
+                start = frame_index * frame_size
+                new_frame = self.append_frame_from_bits(self.width, self.height, 'RGB', rgb[start*3:(start+frame_size)*3], composite_op)
+                new_frame.font_dots = data[start:start+frame_size]
 
         for frame_index in range(frame_count):
-            new_frame = Frame(self.width, self.height)
-            if(dmd_style==0):
-                str_frame = f.read(self.width * self.height)
-                if self.font_loader and frame_index == 0:
-                    # restrict raster font pixels to greyscale like on the P-ROC DMD
-                    list_frame = [chr(ord(x) & 0xF) for x in str_frame]
-                    str_frame = ''.join(list_frame)
-                new_frame.build_surface_from_8bit_dmd_string(str_frame, composite_op)
-            elif(dmd_style==1):
+            if(dmd_style==1):
                 str_frame = f.read(self.width * self.height * 3)
-                new_frame.pySurface = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=str_frame, width=self.width, height=self.height, composite_op=composite_op)
+                new_frame = self.append_frame_from_bits(self.width, self.height, 'RGB', str_frame, composite_op)
                 if(frame_index==1):
                     new_frame.font_dots = str_frame[0:97]
-            self.frames.append(new_frame)
 
     def save_to_old_dmd_file(self, f):
         header = struct.pack("IIII", 0x00646D64, len(self.frames), self.width, self.height)
@@ -429,9 +595,7 @@ class Animation(object):
                 video_frame = cv2.cvtColor(video_frame,cv2.cv.CV_BGR2RGB)
                 the_frame = cv.fromarray(video_frame)
                 # surface = pygame.image.frombuffer(the_frame.tostring(), (self.movie.width, self.movie.height), 'RGB')
-                surf = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=the_frame.tostring(), width=self.width, height=self.height, mode='RGB', composite_op = None)
-                new_frame = Frame(self.width, self.height, from_surface=surf)
-                self.frames.append(new_frame)
+                self.append_frame_from_bits(self.width, self.height, 'RGB', the_frame.tostring())
 
         vc.release()
 
@@ -447,6 +611,112 @@ class Animation(object):
         return frame
 
 
+def animation_paths(filename):
+    """Returns the absolute paths of the files making up the animation *filename*,
+    expanding a ``%d`` pattern to the sequence of numbered files that exist."""
+    # Allow the parameter to be a single filename, or a list of filenames.
+    paths = list()
+    if type(filename) != list:
+        if re.search("%[0-9]*d", filename):
+            frame_index = 0
+            while True:
+                tmp_filename = filename % (frame_index)
+                if os.path.exists(tmp_filename):
+                    paths += [tmp_filename]
+                    frame_index += 1
+                else:
+                    break;
+        else:
+            paths += [filename]
+
+    paths = map(os.path.abspath, paths)
+
+    if(len(paths)==0):
+        raise ValueError, "Load FAILED: could not locate a file matching [%s]" % filename
+    return paths
+
+def unzipped_paths(paths):
+    """Substitutes the .dmd next to each .dmd.zip of *paths* when it was already unzipped."""
+    paths = list(paths)
+    for i in range(len(paths)):
+        if paths[i].endswith('.zip') and os.path.isfile(paths[i][:-4]):
+            #print("Using unzipped DMD for '" + path + "'")
+            paths[i] = paths[i][:-4]
+    return paths
+
+def read_dmd_header(f):
+    """Reads and checks the header of the .dmd file object *f*.
+    Returns (style, frame count, width, height) where style is 0 for the original
+    8-bit format and 1 for the true-color format; the frames follow."""
+    f.seek(0, os.SEEK_END) # Go to the end of the file to get its length
+    file_length = f.tell()
+
+    f.seek(0) # Skip back to the 4 byte DMD header.
+    return parse_dmd_header(f.read(16), file_length, f)
+
+def parse_dmd_header(header, file_length, name=None):
+    """Checks the 16 byte .dmd *header* against the *file_length*; see :func:`read_dmd_header`."""
+    (dmd_version, frame_count, width, height) = struct.unpack("IIII", header)
+    dmd_style = 0 # old
+    if(dmd_version == 0x00646D64):
+        # print("old dmd style")
+        pass
+    elif(dmd_version == 0x00DEFACE):
+        # print("full color dmd style")
+        dmd_style = 1
+
+    if(dmd_style==0):
+        if file_length != 16 + width * height * frame_count:
+            logging.getLogger('game.dmdcache').warning(name)
+            logging.getLogger('game.dmdcache').warning("expected size = {%d} got {%d}", (16 + width * height * frame_count), (file_length))
+            raise ValueError, "File size inconsistent with original DMD format header information.  Old or incompatible file format?"
+    elif(dmd_style==1):
+        if file_length != 16 + width * height * frame_count * 3:
+            logging.getLogger('game.dmdcache').warning(name)
+            raise ValueError, "File size inconsistent with true-color DMD format header information. Old or incompatible file format?"
+    return (dmd_style, frame_count, width, height)
+
+def decode_dmd_file(f):
+    """Returns the frames of the .dmd file object *f* as (width, height, mode, bits) tuples."""
+    (dmd_style, frame_count, width, height) = read_dmd_header(f)
+    frame_size = width * height * 3
+    if(dmd_style==0):
+        data = Frame.decode_8bit_dmd_string(f.read(width * height * frame_count))
+    else:
+        data = f.read(frame_size * frame_count)
+    return [(width, height, 'RGB', data[i*frame_size:(i+1)*frame_size]) for i in range(frame_count)]
+
+def decode_image_file(f):
+    """Returns the image file object *f* as a (width, height, mode, bits) tuple.
+    Like SDL_image, only the first frame of a GIF is used."""
+    src = Image.open(f).convert("RGBA")
+    (w, h) = src.size
+    return (w, h, "RGBA", src.tobytes())
+
+def decode_animation(filename):
+    """Decodes the files of the animation *filename* into a list of (width, height, mode, bits)
+    tuples, one per frame, to be passed to :meth:`Animation.load` as *decoded_frames*.
+
+    Nothing here touches SDL so this can run on a worker thread or process.  Returns ``None``
+    for movies, which :meth:`Animation.load` has to decode itself."""
+    frames = []
+    for path in unzipped_paths(animation_paths(filename)):
+        ext = path[-4:].lower()
+        if ext =='.dmd':
+            with open(path, 'rb') as f:
+                frames += decode_dmd_file(f)
+        elif ext =='.zip':
+            z = zipfile.ZipFile(path, "r")
+            data = z.read(z.namelist()[0])    #Read in the first image data
+            frames += decode_dmd_file(StringIO(data))
+        elif ext =='.mp4' or ext == '.avi':
+            return None
+        else:
+            with open(path, 'rb') as f:
+                frames.append(decode_image_file(f))
+    return frames
+
+
 class OnDemandFrameList(object):
     """ a list that knows when items are absent, but also knows how many it should have... """
     def __init__(self, count, function_on_miss, enable_caching=False):
@@ -469,3 +739,166 @@ class OnDemandFrameList(object):
 
     def __len__(self):
         return self.__size
+
+
+def loads_on_demand(filename):
+    """Returns ``True`` if :meth:`Animation.load` maps the files of the animation *filename*
+    into memory and makes their frames into textures only when they are shown: when the
+    ``dmd_on_demand`` config key is set and the files are all .dmd (or .dmd.zip) files.
+    *filename* can also be the list of paths returned by :func:`animation_paths`."""
+    if not config.value_for_key_path('dmd_on_demand', False):
+        return False
+    paths = filename if type(filename) == list else animation_paths(filename)
+    for path in unzipped_paths(paths):
+        if path[-4:].lower() not in ('.dmd', '.zip'):
+            return False
+    return True
+
+def map_file(path):
+    """Returns ``(data, offset, length)``: the contents of the file *path*, read-only memory
+    mapped, and the offset and length of the .dmd in it.  A .zip is mapped if its .dmd is
+    stored uncompressed; otherwise the .dmd is read into memory."""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if not path[-4:].lower() == '.zip':
+        return (data, 0, len(data))
+    z = zipfile.ZipFile(path, "r")
+    info = z.infolist()[0]
+    if info.compress_type != zipfile.ZIP_STORED:
+        data.close()
+        data = z.read(info)
+        return (data, 0, len(data))
+    # the local file header: 30 bytes, then the file name and the extra field
+    (name_length, extra_length) = struct.unpack("<HH", data[info.header_offset+26:info.header_offset+30])
+    return (data, info.header_offset + 30 + name_length + extra_length, info.file_size)
+
+class MappedDmdFile(object):
+    """The frames of the .dmd file (or .dmd.zip) *path*, decoded from a memory map when asked
+    for, so that only the frames in use are read from disk."""
+
+    def __init__(self, path):
+        super(MappedDmdFile, self).__init__()
+        self.path = path
+        (self.data, self.offset, length) = map_file(path)
+        (self.style, self.frame_count, self.width, self.height) = parse_dmd_header(self.data[self.offset:self.offset+16], length, path)
+        self.frame_size = self.width * self.height * (3 if self.style == 1 else 1)
+
+    def frame_bits(self, index):
+        """Returns the frame *index* as a (width, height, mode, bits) tuple."""
+        start = self.offset + 16 + index * self.frame_size
+        data = self.data[start:start+self.frame_size]
+        if self.style == 0:
+            data = Frame.decode_8bit_dmd_string(data)
+        return (self.width, self.height, 'RGB', data)
+
+class TextureResidency(object):
+    """Keeps the textures of the frames of :class:`MappedFrameList` objects within a budget of
+    *budget* bytes (4 bytes per dot), shared by every animation: when a new frame would go over
+    it, the frames shown least recently are let go and made again from the mapped file if shown
+    again.
+
+    :attr:`hits` and :attr:`misses` count the frames asked for that were or were not resident;
+    frames made ahead by :meth:`prefetch` are counted in :attr:`prefetched`."""
+
+    def __init__(self, budget):
+        super(TextureResidency, self).__init__()
+        self.budget = budget
+        self.frames = collections.OrderedDict() # (frame list, index) -> (frame, bytes)
+        self.resident = 0
+        """Bytes of the resident textures."""
+        self.peak = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+
+    def shared_residency():
+        """Returns a reference to the global, shared residency; its budget is the
+        ``dmd_texture_budget_mb`` (64) megabytes in :mod:`procgame.config`."""
+        global shared_texture_residency
+        if not shared_texture_residency:
+            size_mb = config.value_for_key_path('dmd_texture_budget_mb', 64)
+            shared_texture_residency = TextureResidency(int(size_mb*1024*1024))
+        return shared_texture_residency
+    shared_residency = staticmethod(shared_residency)
+
+    def frame(self, frame_list, index):
+        """Returns the frame *index* of *frame_list*, making it if it is not resident."""
+        key = (frame_list, index)
+        entry = self.frames.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = self.make(frame_list, index)
+        else:
+            self.hits += 1
+        self.frames[key] = entry
+        return entry[0]
+
+    def prefetch(self, frame_list, index):
+        """Makes the frame *index* of *frame_list* resident ahead of it being shown."""
+        key = (frame_list, index)
+        entry = self.frames.pop(key, None)
+        if entry is None:
+            self.prefetched += 1
+            entry = self.make(frame_list, index)
+        self.frames[key] = entry
+
+    def make(self, frame_list, index):
+        frame = frame_list.make_frame(index)
+        size = frame.width * frame.height * 4
+        self.resident += size
+        while self.resident > self.budget and len(self.frames) > 0:
+            (key, (evicted, evicted_size)) = self.frames.popitem(last=False)
+            self.resident -= evicted_size
+            self.evictions += 1
+        self.peak = max(self.peak, self.resident)
+        return (frame, size)
+
+    def release(self, frame_list):
+        """Lets go of the resident frames of *frame_list*."""
+        for key in [key for key in self.frames.keys() if key[0] is frame_list]:
+            (frame, size) = self.frames.pop(key)
+            self.resident -= size
+
+    def report(self):
+        """Returns the statistics as a list of lines."""
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return ["dmd textures: %d frames resident, %0.1f MB (peak %0.1f MB) of %0.1f MB" % (len(self.frames), self.resident / 1048576.0, self.peak / 1048576.0, self.budget / 1048576.0),
+                "dmd textures: %d hits, %d misses (%0.1f%% hit rate), %d prefetched, %d evicted" % (self.hits, self.misses, hit_rate, self.prefetched, self.evictions)]
+
+class MappedFrameList(object):
+    """The frames of the memory-mapped .dmd *files* (:class:`MappedDmdFile`), made into textures
+    with *composite_op* when they are read and kept within the budget of the shared
+    :class:`TextureResidency`.  Reads like the list of frames of an :class:`Animation`."""
+
+    def __init__(self, files, composite_op=None):
+        super(MappedFrameList, self).__init__()
+        self.files = files
+        self.composite_op = composite_op
+        self.index = [(f, i) for f in files for i in range(f.frame_count)]
+        self.residency = TextureResidency.shared_residency()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.index)))]
+        if index < 0:
+            index += len(self.index)
+        if index < 0 or index >= len(self.index):
+            raise IndexError, "frame index out of range"
+        return self.residency.frame(self, index)
+
+    def prefetch(self, indexes):
+        """Makes the frames *indexes* resident ahead of them being shown."""
+        for index in indexes:
+            if 0 <= index < len(self.index):
+                self.residency.prefetch(self, index)
+
+    def make_frame(self, index):
+        (f, i) = self.index[index]
+        (width, height, mode, bits) = f.frame_bits(i)
+        surf = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=bits, width=width, height=height, mode=mode, composite_op=self.composite_op)
+        return Frame(width, height, from_surface=surf)
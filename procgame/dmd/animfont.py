@@ -97,17 +97,6 @@ class AnimFont(Font):
     
         return font_data
 
-    def size(self, text):
-        """Returns a tuple of the width and height of this text as rendered with this font."""
-        x = 0
-        for ch in text:
-            char_offset = ord(ch) - ord(' ')
-            if char_offset < 0 or char_offset >= 96:
-                continue
-            width = self.char_widths[char_offset]
-            x += width + self.tracking
-        return (x, self.char_size)
-
     def save(self, filename):
         """Save the font to the given path."""
         out = Animation()
@@ -0,0 +1,136 @@
+import struct
+from dmd import Frame
+from sdl2_displaymanager import sdl2_DisplayManager
+from procgame import config
+
+PENDING = object()
+"""The texture of the frames that :meth:`~procgame.dmd.Animation.load` made while it decodes
+the frames of an atlas, until the :class:`TextureAtlas` gives them one."""
+
+class AtlasLayout(object):
+    """Where the frames of an animation go in the pages of a :class:`TextureAtlas`.
+
+    :attr:`pages` holds the (width, height) of each page and :attr:`regions` the
+    (page, x, y, width, height) of each frame, in frame order.  The frames are packed
+    in shelves, tallest first, at most *page_size* dots wide and high per page and
+    *padding* dots apart so that scaled blits do not pick up their neighbours.  A frame
+    larger than *page_size* gets a page of its own."""
+
+    def __init__(self, sizes, page_size=2048, padding=1):
+        super(AtlasLayout, self).__init__()
+        self.pages = []
+        self.regions = [None] * len(sizes)
+        order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+        page = None
+        for i in order:
+            (w, h) = sizes[i]
+            if w + padding > page_size or h + padding > page_size:
+                self.regions[i] = (len(self.pages), 0, 0, w, h)
+                self.pages.append((w, h))
+                continue
+            if page is None or not self.fits(page, w, h, page_size, padding):
+                page = self.new_page()
+            if page['x'] + w > page_size:
+                # next shelf
+                page['y'] += page['shelf'] + padding
+                page['x'] = 0
+                page['shelf'] = 0
+            self.regions[i] = (page['index'], page['x'], page['y'], w, h)
+            page['x'] += w + padding
+            page['shelf'] = max(page['shelf'], h)
+            self.pages[page['index']] = (max(self.pages[page['index']][0], page['x'] - padding),
+                                         max(self.pages[page['index']][1], page['y'] + page['shelf']))
+
+    def new_page(self):
+        self.pages.append((0, 0))
+        return {'index': len(self.pages) - 1, 'x': 0, 'y': 0, 'shelf': 0}
+
+    def fits(self, page, w, h, page_size, padding):
+        if page['x'] + w <= page_size:
+            return page['y'] + max(page['shelf'], h) <= page_size
+        return page['y'] + page['shelf'] + padding + h <= page_size
+
+class TextureAtlas(object):
+    """A few large textures, the :attr:`pages`, holding the frames of an animation side by side.
+
+    Each frame of :attr:`frames` draws from a region of a page (see :attr:`Frame.atlas`), so an
+    animation of many small frames uses a handful of textures instead of one per frame.
+    :meth:`Frame.copy_rect` and the other methods reading a frame honour the region; the
+    methods drawing into a frame first give it a texture of its own (see :meth:`Frame.detach`).
+
+    Made by :meth:`~procgame.dmd.Animation.load` when the ``dmd_atlas`` config key (or the
+    ``atlas`` key of an animation in the asset list) is set, from the decoded frames: see
+    :func:`pack_atlas`.  The ``dmd_atlas_size`` config key bounds the size of the pages (2048)."""
+
+    def __init__(self, layout, pages, composite_op=None, frames=None):
+        """Makes the textures of *pages*, a list of RGBA strings laid out by *layout*, an :class:`AtlasLayout`,
+        and the frames drawing from them, or points the existing *frames* at them."""
+        super(TextureAtlas, self).__init__()
+        self.layout = layout
+        self.pages = []
+        for ((w, h), bits) in zip(layout.pages, pages):
+            self.pages.append(sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=bits, width=w, height=h, mode='RGBA', composite_op=composite_op))
+        self.frames = []
+        for (i, (page, x, y, w, h)) in enumerate(layout.regions):
+            if frames is None:
+                frame = Frame(w, h, from_surface=self.pages[page])
+            else:
+                frame = frames[i]
+                frame.pySurface = self.pages[page]
+            frame.atlas = self
+            (frame.atlas_x, frame.atlas_y) = (x, y)
+            self.frames.append(frame)
+
+    def texture_bytes(self):
+        """Returns the texture memory of the pages, 4 bytes per dot."""
+        return sum(w * h * 4 for (w, h) in self.layout.pages)
+
+def rgba_bits(width, height, mode, bits):
+    """Returns *bits*, the decoded *mode* ('RGB' or 'RGBA') data of a frame, as RGBA."""
+    if mode == 'RGBA':
+        return bits
+    d = bytearray('\xff' * (width * height * 4))
+    d[0::4] = bits[0::3]
+    d[1::4] = bits[1::3]
+    d[2::4] = bits[2::3]
+    return str(d)
+
+def pack_pages(layout, frames):
+    """Returns the RGBA data of the pages of *layout* holding *frames*, a list of
+    (width, height, mode, bits) tuples.  Does not touch SDL."""
+    pages = [bytearray(w * h * 4) for (w, h) in layout.pages]
+    for ((page, x, y, w, h), (width, height, mode, bits)) in zip(layout.regions, frames):
+        bits = rgba_bits(width, height, mode, bits)
+        page_width = layout.pages[page][0]
+        row = w * 4
+        for line in range(h):
+            start = ((y + line) * page_width + x) * 4
+            pages[page][start:start+row] = bits[line*row:(line+1)*row]
+    return [str(page) for page in pages]
+
+def pack_atlas(frames, composite_op=None, page_size=None):
+    """Returns a :class:`TextureAtlas` of *frames*, a list of (width, height, mode, bits) tuples."""
+    if page_size is None:
+        page_size = config.value_for_key_path('dmd_atlas_size', 2048)
+    layout = AtlasLayout([(width, height) for (width, height, mode, bits) in frames], page_size)
+    return TextureAtlas(layout, pack_pages(layout, frames), composite_op)
+
+def pack_layout(layout):
+    """Returns *layout* as a string, the reverse of :func:`unpack_layout`."""
+    data = [struct.pack('<II', len(layout.pages), len(layout.regions))]
+    data += [struct.pack('<II', w, h) for (w, h) in layout.pages]
+    data += [struct.pack('<IIIII', *region) for region in layout.regions]
+    return ''.join(data)
+
+def unpack_layout(data):
+    """Returns the :class:`AtlasLayout` packed in *data* by :func:`pack_layout`."""
+    layout = AtlasLayout([])
+    (page_count, region_count) = struct.unpack_from('<II', data, 0)
+    offset = 8
+    for i in range(page_count):
+        layout.pages.append(struct.unpack_from('<II', data, offset))
+        offset += 8
+    for i in range(region_count):
+        layout.regions.append(struct.unpack_from('<IIIII', data, offset))
+        offset += 20
+    return layout
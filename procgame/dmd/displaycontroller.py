@@ -1,7 +1,68 @@
 from pinproc import DMDBuffer
+from procgame import config
 from dmd import *
 from layers import *
 from sdl2_displaymanager import sdl2_DisplayManager
+import audioop
+import ctypes
+import sys
+
+class ShadeConverter(object):
+    """Converts the RGBA data read back from a frame to the 16 shades of the P-ROC DMD, one byte per dot.
+
+    The shade of a dot is its average brightness (R+G+B)/3 divided by 16.  A *gamma* other than 1.0
+    applies a gamma curve to the brightness first, and *dither* replaces the truncation with a
+    4x4 ordered (Bayer) dither, which shows more levels on the panel.
+
+    The arithmetic runs in C: each channel is widened to 16-bit samples so :mod:`audioop` can sum
+    the channels and divide by 3, then the brightness goes through a translation table.
+    See tools/procdmdbench.py."""
+
+    BAYER = (0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5)
+
+    def __init__(self, width, height, gamma=1.0, dither=False):
+        self.width = width
+        self.height = height
+        self.dither = dither
+        if dither:
+            self.tables = [self.shade_table(gamma, (b + 0.5) / 16) for b in self.BAYER]
+        else:
+            self.tables = [self.shade_table(gamma, 0)]
+        # the low byte of each 16-bit sample
+        self.low = 0 if sys.byteorder == 'little' else 1
+        self.red = bytearray(width * height * 2)
+        self.green = bytearray(width * height * 2)
+        self.blue = bytearray(width * height * 2)
+
+    def shade_table(gamma, threshold):
+        """Returns the translation table from brightness (0-255) to shade (0-15)."""
+        table = []
+        for v in range(256):
+            if gamma != 1.0:
+                v = ((v / 255.0) ** gamma) * 255.0
+            table.append(chr(min(15, max(0, int(v / 16.0 + threshold)))))
+        return ''.join(table)
+    shade_table = staticmethod(shade_table)
+
+    def convert(self, rgba):
+        """Returns the shades of *rgba*, a string of width*height RGBA dots, as a string."""
+        low = self.low
+        self.red[low::2] = rgba[0::4]
+        self.green[low::2] = rgba[1::4]
+        self.blue[low::2] = rgba[2::4]
+        total = audioop.add(audioop.add(str(self.red), str(self.green), 2), str(self.blue), 2)
+        # the small bias keeps multiples of 3 from rounding down
+        brightness = audioop.mul(total, 2, 1 / 3.0 + 1e-9)[low::2]
+        if not self.dither:
+            return brightness.translate(self.tables[0])
+        shades = bytearray(len(brightness))
+        width = self.width
+        for y in range(self.height):
+            row = y * width
+            for x in range(4):
+                table = self.tables[(y % 4) * 4 + x]
+                shades[row+x:row+width:4] = brightness[row+x:row+width:4].translate(table)
+        return str(shades)
 
 class DisplayController(object):
     """Manages the process of obtaining DMD frames from active modes and compositing them together for
@@ -30,12 +91,33 @@ class DisplayController(object):
 
     This list is initialized to contain only ``self.game.proc.dmd_draw``."""
 
+    blits_saved = 0
+    """Number of layer copies the :class:`~procgame.dmd.Compositor` skipped while building the last frame,
+    including those skipped inside :class:`~procgame.dmd.GroupedLayer` instances."""
+
+    total_blits_saved = 0
+    """Sum of :attr:`blits_saved` over all the frames built so far."""
+
+    proc_dmd_sent = 0
+    """Number of frames :meth:`proc_dmd_draw` sent to the P-ROC."""
+
+    proc_dmd_skipped = 0
+    """Number of frames :meth:`proc_dmd_draw` did not send because nothing changed."""
+
+    proc_dmd_frame = None
+    proc_dmd_revision = None
+    proc_dmd_dots = None
+
     def __init__(self, game, width=192, height=96, message_font=None):
         self.game = game
         self.message_layer = None
         self.width = width
         self.height = height
         self.frame = Frame(self.width, self.height)
+        self.compositor = Compositor()
+        Compositor.enabled = config.value_for_key_path(keypath='dmd_damage_tracking', default=True)
+        if game.profiler:
+            game.profiler.reports.append(sdl2_DisplayManager.inst().texture_pool.report)
         if message_font != None:
             self.message_layer = TextLayer(width/2, height-2*7, message_font, "center")
         # Do two updates to get the pump primed:
@@ -44,8 +126,11 @@ class DisplayController(object):
 
         if game.use_proc_dmd:
             print("using physical monochrome DMD controlled by the P-ROC")
-            self.dmd_bytes = bytearray(self.width * self.height)
             self.dmd_buffer = DMDBuffer(self.width, self.height)
+            self.readback_buffer = ctypes.create_string_buffer(self.width * self.height * 4)
+            self.shade_converter = ShadeConverter(self.width, self.height,
+                gamma=config.value_for_key_path(keypath='proc_dmd_gamma', default=1.0),
+                dither=config.value_for_key_path(keypath='proc_dmd_dither', default=False))
         else:
             print("Using a virtual DMD ONLY - no physical DMD output will be sent")
 
@@ -61,8 +146,15 @@ class DisplayController(object):
         If the mode has a layer attribute, that layer's :meth:`~procgame.dmd.Layer.composite_next` method is called
         to apply that layer's next frame to the frame in progress.
 
-        The resulting frame is sent to the :attr:`frame_handlers` and then returned from this method."""
+        The resulting frame is sent to the :attr:`frame_handlers` and then returned from this method.
+        When nothing changed since the previous frame the :attr:`frame_handlers` are not called."""
+        profiler = self.game.profiler
+        self.compositor.profiler = profiler
+        if profiler:
+            return profiler.call('DisplayController.update', self.__update)
+        return self.__update()
 
+    def __update(self):
         #lets increment a counter on how many dmd updates we have done
         self.game.dmd_updates+=1
         layers = []
@@ -72,30 +164,38 @@ class DisplayController(object):
                 if mode.layer.opaque:
                     break # if we have an opaque layer we don't render any lower layers
 
-        #frame = Frame(self.width, self.height)
-        self.frame.clear((0,0,0,255))
-        for layer in layers[::-1]: # We reverse the list here so that the top layer gets the last say.
-            if layer.enabled:
-                layer.composite_next(self.frame)
-
+        layers.reverse() # We reverse the list here so that the top layer gets the last say.
         if self.message_layer != None:
-            self.message_layer.composite_next(self.frame)
+            layers.append(self.message_layer)
+
+        saved_before = Compositor.total_blits_saved
+        self.compositor.composite(self.frame, layers, (0,0,0,255))
+        self.blits_saved = Compositor.total_blits_saved - saved_before
+        self.total_blits_saved += self.blits_saved
 
-        if self.frame != None:
+        if self.compositor.changed:
             for handler in self.frame_handlers:
                 handler(self.frame)
 
         return self.frame
 
     def proc_dmd_draw(self, frame):
-        """Convert a frame into a DMDBuffer and send the buffer to the P-ROC to display on the physical DMD"""
-        bits = sdl2_DisplayManager.inst().make_bits_from_texture(frame.pySurface.texture, self.width, self.height)
-
-        for b in range(self.height * self.width):
-            b0 = b * 4
-            self.dmd_bytes[b] = (bits[b0] + bits[b0+1] + bits[b0+2]) // (3 * 16) 
-
-        del bits
-        dmd_data = self.dmd_bytes.decode(encoding='ascii')
-        self.dmd_buffer.set_data(dmd_data)
+        """Convert a frame into a DMDBuffer and send the buffer to the P-ROC to display on the physical DMD.
+        Nothing is sent if the frame is the one sent last time and its :attr:`~procgame.dmd.Frame.revision`
+        did not change, or if it converts to the same shades."""
+        if frame is self.proc_dmd_frame and frame.revision == self.proc_dmd_revision:
+            self.proc_dmd_skipped += 1
+            return
+        self.proc_dmd_frame = frame
+        self.proc_dmd_revision = frame.revision
+
+        sdl2_DisplayManager.inst().make_bits_from_texture(frame.pySurface.texture, self.width, self.height, bucket=self.readback_buffer)
+        dots = self.shade_converter.convert(self.readback_buffer.raw)
+        if dots == self.proc_dmd_dots:
+            self.proc_dmd_skipped += 1
+            return
+        self.proc_dmd_dots = dots
+
+        self.dmd_buffer.set_data(dots)
         self.game.proc.dmd_draw(self.dmd_buffer)
+        self.proc_dmd_sent += 1
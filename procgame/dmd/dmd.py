@@ -20,6 +20,24 @@ class Frame(object):
     pySurface = None
     """ the pygame surface that backs the frame """
 
+    revision = 0
+    """Incremented every time the contents of the frame are modified through its methods
+    (see :meth:`touch`).  Used by :class:`Compositor` to tell whether a frame changed."""
+
+    eight_bit_palette = None
+    """Per color channel translation tables of the palette of 8-bit .dmd files, built on first use."""
+
+    atlas = None
+    """The :class:`~procgame.dmd.atlas.TextureAtlas` the frame is a region of, at (:attr:`atlas_x`,
+    :attr:`atlas_y`) in :attr:`pySurface`, one of its pages; ``None`` when the frame has a texture of its own."""
+    atlas_x = 0
+    atlas_y = 0
+
+    pooled = False
+    """``True`` when :attr:`pySurface` came from the texture pool and belongs to this frame only, so that
+    :meth:`release` can give it back (see :meth:`~procgame.dmd.sdl2_displaymanager.sdl2_DisplayManager.acquire_texture`).
+    Frames made ``from_surface`` a texture do not own it."""
+
     def __init__(self, width, height, from_surface=None):
         """Initializes the frame to the given `width` and `height`."""
         # super(Frame, self).__init__(width, height)
@@ -28,8 +46,9 @@ class Frame(object):
         self.width = width
         self.height = height
         if(from_surface is None):
-            self.pySurface = sdl2_DisplayManager.inst().new_texture(width, height) #pygame.surface.Surface((width, height))
-            #self.clear() -- don't need this, the new_texture function does this for us.
+            self.pySurface = sdl2_DisplayManager.inst().acquire_texture(width, height) #pygame.surface.Surface((width, height))
+            self.pooled = True
+            #self.clear() -- don't need this, the acquire_texture function does this for us.
         else:
             self.pySurface = from_surface
 
@@ -37,6 +56,28 @@ class Frame(object):
         self.y_offset = self.width*4 # every y_offset Bytes is the next line
         self.font_dots = []
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def release(self):
+        """Gives the texture of the frame back to the texture pool, to be reused by the next frame of that
+        size, rather than leaving it to the garbage collector.  The frame must not be used afterwards, so
+        only release a frame nothing else holds, never one handed out by a layer's :meth:`~Layer.next_frame`.
+        Frames used as a context manager are released when the ``with`` block ends::
+
+            with Frame(w, h) as tmp:
+                font.draw(tmp, text, 0, 0)
+                Frame.copy_rect(dst=target, dst_x=x, dst_y=y, src=tmp, src_x=0, src_y=0, width=w, height=h)
+        """
+        if(self.pooled):
+            sdl2_DisplayManager.inst().release_texture(self.pySurface, self.width, self.height)
+            self.pooled = False
+        self.pySurface = None
+
     def copy_rect(dst, dst_x, dst_y, src, src_x, src_y, width, height, op="copy", blendmode=None, alpha=None, dest_rect=None):
         """Static method which performs some type checking before calling :meth:`pinproc.DMDBuffer.copy_to_rect`."""
 
@@ -45,7 +86,13 @@ class Frame(object):
         # src_rect = pygame.Rect(int(src_x),int(src_y),int(width),int(height))
         # dst_rect = pygame.Rect(int(dst_x),int(dst_y),int(width),int(height))
 
-        src_rect = (int(src_x),int(src_y),int(width),int(height))
+        if(src.atlas is not None):
+            # stay inside the region of the atlas page
+            width = min(int(width), src.width - int(src_x))
+            height = min(int(height), src.height - int(src_y))
+        src_rect = (int(src_x)+src.atlas_x,int(src_y)+src.atlas_y,int(width),int(height))
+        if(dst.atlas is not None):
+            dst.detach()
         # if(width > src.width):
         #     width = src.width
         # if(height > src.height):
@@ -97,6 +144,7 @@ class Frame(object):
 
         #HD_copy_texture(src.pySurface, dst.pySurface, src_rect, dst_rect)
         sdl2_DisplayManager.inst().blit(source_tx=src.pySurface, dest_tx=dst.pySurface, dest=dest_rect, area=src_rect, special_flags = 0, blendmode=blendmode, alpha=alpha)
+        dst.touch()
 
 
         # dst.pySurface.blit(src.pySurface, dst_rect, src_rect, special_flags = special_flags)
@@ -105,6 +153,28 @@ class Frame(object):
 
     copy_rect = staticmethod(copy_rect)
 
+    def region(self):
+        """Returns the (x, y, width, height) rectangle of :attr:`pySurface` holding the frame."""
+        return (self.atlas_x, self.atlas_y, self.width, self.height)
+
+    def detach(self):
+        """Gives a frame that is a region of an atlas a texture of its own, holding a copy of the
+        region.  Called before drawing into the frame, so the other frames of the atlas are left alone."""
+        if(self.atlas is None):
+            return
+        tx = sdl2_DisplayManager.inst().acquire_texture(self.width, self.height)
+        sdl2_DisplayManager.inst().blit(source_tx=self.pySurface, dest_tx=tx, dest=(0,0,self.width,self.height), area=self.region())
+        self.pySurface = tx
+        self.pooled = True
+        self.atlas = None
+        self.atlas_x = 0
+        self.atlas_y = 0
+
+    def touch(self):
+        """Marks the frame as modified.  Code that draws into :attr:`pySurface` directly
+        (rather than through the methods of this class) should call this afterwards."""
+        self.revision += 1
+
     # def color_replacement(self, old_color, new_color):
     #   dst = self.pySurface.copy()
     #   dst.fill(new_color)
@@ -126,18 +196,18 @@ class Frame(object):
         #frame.pySurface.blit(self.pySurface, (0,0,self.width,self.height), (0,0,self.width,self.height), special_flags = 0)
 
         frame = Frame(self.width, self.height)
-        sdl2_DisplayManager.inst().blit(source_tx=self.pySurface, dest_tx=frame.pySurface, dest=(0,0,self.width,self.height), area=(0,0,self.width,self.height), special_flags = 0)
+        sdl2_DisplayManager.inst().blit(source_tx=self.pySurface, dest_tx=frame.pySurface, dest=(0,0,self.width,self.height), area=self.region(), special_flags = 0)
 
         #frame.set_data(self.get_data())
         return frame
 
     def tint(self, r,g,b):
         """ returns a copy of a Frame, tinted with the set R, G, B amounts.  Useful for cheap effects """
-        frame = Frame(self.width, self.height)
         dframe = self.copy()
-        frame.fill_rect(0,0,self.width,self.height,(r,g,b))
-        # sdl2_DisplayManager.inst().blit(source_tx=self.pySurface, dest_tx=frame.pySurface, dest=(0,0,self.width,self.height), area=(0,0,self.width,self.height), special_flags = 0,blendmode='MOD')
-        sdl2_DisplayManager.inst().blit(source_tx=frame.pySurface, dest_tx=dframe.pySurface, dest=(0,0,self.width,self.height), area=(0,0,self.width,self.height), special_flags = 0,blendmode='MOD')
+        with Frame(self.width, self.height) as frame:
+            frame.fill_rect(0,0,self.width,self.height,(r,g,b))
+            # sdl2_DisplayManager.inst().blit(source_tx=self.pySurface, dest_tx=frame.pySurface, dest=(0,0,self.width,self.height), area=(0,0,self.width,self.height), special_flags = 0,blendmode='MOD')
+            sdl2_DisplayManager.inst().blit(source_tx=frame.pySurface, dest_tx=dframe.pySurface, dest=(0,0,self.width,self.height), area=(0,0,self.width,self.height), special_flags = 0,blendmode='MOD')
 
         #frame.set_data(self.get_data())
         return dframe
@@ -152,16 +222,22 @@ class Frame(object):
             new_h = max(int(percentage * self.height),1)
 
         dstrect = (0, 0, int(new_w), int(new_h))
-        self.width = new_w
-        self.height = new_h
+        area = self.region() if self.atlas else None
 
         F = Frame(new_w, new_h)
 
-        sdl2_DisplayManager.inst().roto_blit(self.pySurface, F.pySurface, dstrect, None)
+        sdl2_DisplayManager.inst().roto_blit(self.pySurface, F.pySurface, dstrect, area)
+        self.atlas = None
+        self.atlas_x = 0
+        self.atlas_y = 0
 
-        del self.pySurface
+        self.release()
 
+        self.width = F.width
+        self.height = F.height
         self.pySurface = F.pySurface
+        self.pooled = True
+        self.touch()
 
         # #print(new_w, new_h)
         # self.width = new_w
@@ -184,7 +260,7 @@ class Frame(object):
 
         F = Frame(self.width, self.height)
 
-        sdl2_DisplayManager.inst().roto_blit(self.pySurface, F.pySurface, dstrect, None, angle=rotation, origin=origin, flip=flip)
+        sdl2_DisplayManager.inst().roto_blit(self.pySurface, F.pySurface, dstrect, self.region() if self.atlas else None, angle=rotation, origin=origin, flip=flip)
 
         return F
         # del self.pySurface
@@ -267,10 +343,12 @@ class Frame(object):
     def fill_rect(self, x,y,w,h,c):
         if(len(c)==3):
             c = (c[0],c[1],c[2],255)
+        self.detach()
         old = sdl2_DisplayManager.inst().switch_target(self.pySurface)
         sdl2_DisplayManager.inst().fill((int(x),int(y),int(w),int(h)), c)
 
         sdl2_DisplayManager.inst().switch_target(old)
+        self.touch()
 
         # r = pygame.Rect(int(x),int(y),int(w),int(h))
         # self.pySurface.fill(c,r)
@@ -279,10 +357,14 @@ class Frame(object):
         print "SETTING ALPHA VALUE TO : " + str(value)
         #self.pySurface.convert_alpha()
         #self.pySurface.set_alpha(value)
-        sdl2.SDL_SetTextureAlphaMod(self.pySurface.texture,value)
+        self.detach()
+        sdl2_DisplayManager.inst().set_texture_alpha(self.pySurface,value)
+        self.touch()
 
     def clear(self, color=(0,0,0,0)):
+        self.detach()
         sdl2_DisplayManager.inst().texture_clear(self.pySurface, color)
+        self.touch()
         #self.pySurface.fill((0,0,0))
 
     def set_surface(self, surf):
@@ -294,35 +376,32 @@ class Frame(object):
 
 
     def build_surface_from_8bit_dmd_string(self, str_data, composite_op=None):
-
-        self.eight_to_RGB_map = VgaDMD.get_palette_ch()
+        """Replaces the texture of this frame with the given 8-bit .dmd frame data and returns
+        the decoded RGB data, 3 bytes per dot."""
         self.font_dots = str_data
-        x = 0
-        y = 0
-        d = ""
-        for dot in str_data:
-            # get the Byte from the frame data
-            dot = ord(dot)
-            # convert it to the correct RGB pallette color
-            (r,g,b) = self.eight_to_RGB_map[dot]
-
-            d +=r + g + b
-            # # write out the color into the target buffer array
-            # index = y*self.y_offset + x*self.x_offset
-
-            # #self.pySurface[index:(index+bytes_per_pixel)] = (b,g,r,0)
-            # buffer_interface[index:(index+4)] = (b,g,r,0)
-
-            # #move to the next dot
-            # x += 1
-            # if x == self.width:
-            #   x = 0
-            #   y += 1
-        #self.pySurface = pygame.image.fromstring(d,(self.width,self.height),'RGB').convert()
-
-        # surf = HD_load_file(path)
+        d = Frame.decode_8bit_dmd_string(str_data)
+        self.release()
         self.pySurface = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=d, width=self.width, height=self.height, mode='RGB', composite_op=composite_op)
-
+        self.touch()
+        return d
+
+    def decode_8bit_dmd_string(str_data):
+        """Returns the RGB data, 3 bytes per dot, of the given 8-bit .dmd data, which may hold
+        any number of frames.  Does not touch SDL, so it is safe to call from an asset decoding worker.
+
+        Each color channel is looked up in the palette with a single ``str.translate``; see
+        tools/dmddecodebench.py."""
+        if Frame.eight_bit_palette is None:
+            palette = VgaDMD.get_palette_ch()
+            Frame.eight_bit_palette = tuple(''.join(color[channel] for color in palette) for channel in range(3))
+        (red, green, blue) = Frame.eight_bit_palette
+
+        d = bytearray(len(str_data) * 3)
+        d[0::3] = str_data.translate(red)
+        d[1::3] = str_data.translate(green)
+        d[2::3] = str_data.translate(blue)
+        return str(d)
+    decode_8bit_dmd_string = staticmethod(decode_8bit_dmd_string)
 
     def get_surface_string(self):
         # convert every pixel to 8 bit mapping
@@ -363,6 +442,9 @@ class Layer(object):
     The ``Layer`` class is the basis for the pyprocgame display architecture.
     Subclasses override :meth:`next_frame` to provide a frame for the current moment in time.
     Handles compositing of provided frames and applying transitions within a :class:`DisplayController` context.
+
+    A layer whose class sets :attr:`tracks_damage` must call :meth:`Frame.touch` on its frame after
+    drawing into :attr:`Frame.pySurface` directly, or the change will not be shown.
     """
 
     opaque = False
@@ -389,6 +471,16 @@ class Layer(object):
     """The blendmode operation to apply - default is 'BLEND', options are ADD, BLEND, MOD and NONE """
     alpha = None
     """The alpha transparency of this entire layer (0 to 255) as invisible to visible - None means fully visible."""
+    tracks_damage = False
+    """``True`` if the frames returned by :meth:`next_frame` are only ever modified through the methods of
+    :class:`Frame`, so that comparing the frame and its :attr:`~Frame.revision` with the previous one tells
+    whether the output of this layer changed.  Layers that leave this ``False`` are redrawn on every frame
+    by the :class:`Compositor`.
+
+    The flag is not inherited: only a class that sets it in its own body is tracked, so a subclass of a
+    tracked layer is redrawn on every frame until it sets ``tracks_damage = True`` itself.  By doing so
+    the subclass promises that whenever it draws into a frame's :attr:`~Frame.pySurface` directly it calls
+    :meth:`Frame.touch` afterwards; otherwise the display keeps showing the previous contents."""
 
     def __init__(self, opaque=False):
         """Initialize a new Layer object."""
@@ -466,13 +558,209 @@ class Layer(object):
         if src != None:
             if self.transition != None:
                 src = self.transition.next_frame(from_frame=target, to_frame=src)
+            self.composite_frame(target, src)
+        return src
 
-            if(self.hw_scale is None):
-                Frame.copy_rect(dst=target, dst_x=self.target_x+self.target_x_offset, dst_y=self.target_y+self.target_y_offset, src=src, src_x=0, src_y=0, width=src.width, height=src.height, op=self.composite_op, blendmode=self.blendmode, alpha=self.alpha)
+    def composite_frame(self, target, src, clip=None):
+        """Copies *src*, a frame previously returned by :meth:`next_frame`, onto *target* at this layer's position.
+        If *clip* is given as an (x, y, width, height) rectangle in *target* coordinates, only the part of
+        *src* that falls inside it is copied.  Clipping is not supported when :attr:`hw_scale` is set."""
+        if(self.hw_scale is None):
+            (x, y, width, height) = self.composite_rect(src)
+            (src_x, src_y) = (0, 0)
+            if clip is not None:
+                (clip_x, clip_y, width, height) = clip
+                (src_x, src_y) = (clip_x - x, clip_y - y)
+                (x, y) = (clip_x, clip_y)
+            Frame.copy_rect(dst=target, dst_x=x, dst_y=y, src=src, src_x=src_x, src_y=src_y, width=width, height=height, op=self.composite_op, blendmode=self.blendmode, alpha=self.alpha)
+        else:
+            if clip is not None:
+                raise ValueError, "Cannot clip a layer that uses hw_scale."
+            dst_rect = [self.target_x+self.target_x_offset, self.target_y+self.target_y_offset, int(src.width*self.hw_scale), int(src.height*self.hw_scale)]
+            Frame.copy_rect(dst=target, dst_x=0, dst_y=0, src=src, src_x=0, src_y=0, width=src.width, height=src.height, op=self.composite_op, blendmode=self.blendmode, alpha=self.alpha, dest_rect=dst_rect)
+
+    def composite_rect(self, frame):
+        """Returns the (x, y, width, height) rectangle covered by *frame* when composited by this layer."""
+        x = int(self.target_x+self.target_x_offset)
+        y = int(self.target_y+self.target_y_offset)
+        if(self.hw_scale is None):
+            return (x, y, int(frame.width), int(frame.height))
+        return (x, y, int(frame.width*self.hw_scale), int(frame.height*self.hw_scale))
+
+    def damage_key(self, frame):
+        """Returns a value describing how *frame*, the result of :meth:`next_frame`, will be composited.
+        Two equal keys mean the layer produces the same output, so the :class:`Compositor` can skip it.
+        Returns ``None`` when this cannot be known: the layer's own class does not set :attr:`tracks_damage`
+        or the layer has a :attr:`transition`."""
+        if not type(self).__dict__.get('tracks_damage', False) or self.transition != None:
+            return None
+        if frame is None:
+            return ()
+        return (frame, frame.revision, self.composite_rect(frame), self.composite_op, self.blendmode, self.alpha)
+
+
+class Compositor(object):
+    """Composites a list of layers onto a target frame, redrawing only what changed since the previous call.
+
+    Used by :class:`~procgame.dmd.DisplayController` for the whole display and by
+    :class:`~procgame.dmd.GroupedLayer` for its buffer.  Every layer's :meth:`~Layer.next_frame`
+    is still called on each frame so animations keep advancing, but when all the
+    :meth:`~Layer.damage_key` values match the previous ones the target is left untouched.
+    When only some layers changed, the union of their old and new rectangles is cleared and
+    only the layers overlapping it are copied again, clipped to it.
+    """
+
+    enabled = True
+    """Set to ``False`` to composite every layer on every frame, as before damage tracking.
+    Set from the ``dmd_damage_tracking`` configuration key by :class:`~procgame.dmd.DisplayController`."""
+
+    total_blits_saved = 0
+    """Number of layer copies skipped by all compositors since startup."""
+
+    profiler = None
+    """:class:`~procgame.game.profiler.RunLoopProfiler` timing each layer's :meth:`~Layer.next_frame`, or ``None``.
+    Set by :class:`~procgame.dmd.DisplayController` from :attr:`GameController.profiler`."""
+
+    def __init__(self):
+        super(Compositor, self).__init__()
+        self.last_target = None
+        self.last_revision = None
+        self.last_keys = None
+        self.last_rects = None
+        self.changed = True
+        """``True`` if the last call to :meth:`composite` modified the target."""
+        self.blits_saved = 0
+        """Number of layer copies skipped by the last call to :meth:`composite`."""
+
+    def invalidate(self):
+        """Forces the next call to :meth:`composite` to redraw everything."""
+        self.last_keys = None
+        self.last_rects = None
+
+    def composite(self, target, layers, clear_color=(0,0,0,0)):
+        """Composites *layers*, ordered from bottom to top, onto *target* after clearing it to *clear_color*.
+        Returns the number of layers that provided a frame."""
+        count = self.__composite(target, layers, clear_color)
+        self.last_target = target
+        self.last_revision = target.revision
+        return count
+
+    def __composite(self, target, layers, clear_color):
+        self.blits_saved = 0
+        self.changed = True
+
+        if not Compositor.enabled or [layer for layer in layers if layer.transition != None]:
+            # Transitions composite from what is already on the target, so draw the old way.
+            self.invalidate()
+            target.clear(clear_color)
+            count = 0
+            sdl2_DisplayManager.inst().begin_batch(target.pySurface)
+            try:
+                for layer in layers:
+                    if self.profiler:
+                        frame = self.profiler.call('composite_next ' + type(layer).__name__, layer.composite_next, target)
+                    else:
+                        frame = layer.composite_next(target)
+                    if frame != None:
+                        count += 1
+            finally:
+                sdl2_DisplayManager.inst().end_batch()
+            return count
+
+        if self.profiler:
+            frames = [self.profiler.call('next_frame ' + type(layer).__name__, layer.next_frame) for layer in layers]
+        else:
+            frames = [layer.next_frame() for layer in layers]
+        keys = [layer.damage_key(frame) for (layer, frame) in zip(layers, frames)]
+        bounds = (0, 0, target.width, target.height)
+        rects = []
+        for (layer, frame) in zip(layers, frames):
+            if frame is None:
+                rects.append(None)
             else:
-                dst_rect = [self.target_x+self.target_x_offset, self.target_y+self.target_y_offset, int(src.width*self.hw_scale), int(src.height*self.hw_scale)]
-                Frame.copy_rect(dst=target, dst_x=0, dst_y=0, src=src, src_x=0, src_y=0, width=src.width, height=src.height, op=self.composite_op, blendmode=self.blendmode, alpha=self.alpha, dest_rect=dst_rect)
-        return src
+                rects.append(Compositor.intersect(layer.composite_rect(frame), bounds))
+        count = len([frame for frame in frames if frame is not None])
+
+        (last_keys, last_rects) = (self.last_keys, self.last_rects)
+        if target is not self.last_target or target.revision != self.last_revision:
+            # the target was replaced or drawn on by someone else since the last call
+            last_keys = None
+        if None in keys:
+            self.invalidate()
+        else:
+            (self.last_keys, self.last_rects) = (keys, rects)
+
+        dirty = bounds
+        if last_keys is not None and len(last_keys) == len(keys):
+            dirty = None
+            for (key, last_key, rect, last_rect) in zip(keys, last_keys, rects, last_rects):
+                if key != last_key:
+                    dirty = Compositor.union(dirty, Compositor.union(rect, last_rect))
+            if dirty is None:
+                self.changed = False
+                self.blits_saved = count
+                Compositor.total_blits_saved += count
+                return count
+            for (layer, rect) in zip(layers, rects):
+                if layer.hw_scale is not None and Compositor.intersect(rect, dirty) is not None:
+                    dirty = bounds
+                    break
+
+        if dirty == bounds:
+            target.clear(clear_color)
+            sdl2_DisplayManager.inst().begin_batch(target.pySurface)
+            try:
+                for (layer, frame) in zip(layers, frames):
+                    if frame is not None:
+                        layer.composite_frame(target, frame)
+            finally:
+                sdl2_DisplayManager.inst().end_batch()
+            return count
+
+        clear_color = tuple(clear_color)
+        if len(clear_color) == 3:
+            clear_color = clear_color + (255,)
+        target.fill_rect(dirty[0], dirty[1], dirty[2], dirty[3], clear_color)
+        sdl2_DisplayManager.inst().begin_batch(target.pySurface)
+        try:
+            for (layer, frame, rect) in zip(layers, frames, rects):
+                if frame is None:
+                    continue
+                clip = Compositor.intersect(rect, dirty)
+                if clip is None:
+                    self.blits_saved += 1
+                else:
+                    layer.composite_frame(target, frame, clip)
+        finally:
+            sdl2_DisplayManager.inst().end_batch()
+        Compositor.total_blits_saved += self.blits_saved
+        return count
+
+    def intersect(a, b):
+        """Returns the intersection of the (x, y, width, height) rectangles *a* and *b*, or ``None`` if they do not overlap."""
+        if a is None or b is None:
+            return None
+        x0 = max(a[0], b[0])
+        y0 = max(a[1], b[1])
+        x1 = min(a[0] + a[2], b[0] + b[2])
+        y1 = min(a[1] + a[3], b[1] + b[3])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1 - x0, y1 - y0)
+    intersect = staticmethod(intersect)
+
+    def union(a, b):
+        """Returns the bounding rectangle of the (x, y, width, height) rectangles *a* and *b*, either of which may be ``None``."""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        x0 = min(a[0], b[0])
+        y0 = min(a[1], b[1])
+        x1 = max(a[0] + a[2], b[0] + b[2])
+        y1 = max(a[1] + a[3], b[1] + b[3])
+        return (x0, y0, x1 - x0, y1 - y0)
+    union = staticmethod(union)
 
 
 def main():
@@ -32,6 +32,9 @@ class Font(object):
     
     composite_op = 'copy'
     """Composite operation used by :meth:`draw` when calling :meth:`~pinproc.DMDBuffer.copy_rect`."""
+
+    __advances = None
+    __advances_for = None
     
     def __init__(self, filename=None, char_widths=None):
         super(Font, self).__init__()
@@ -122,16 +125,35 @@ class Font(object):
             x += width + self.tracking
         return x
     
+    def advances(self):
+        """Returns a dictionary of the horizontal advance (width plus :attr:`tracking`) of every
+        character of the font.  It is built again when :attr:`char_widths` or :attr:`tracking` change."""
+        if self.__advances is None or self.__advances_for != (self.tracking, self.char_widths):
+            char_widths = list(self.char_widths or [])
+            self.__advances = dict([(chr(i + ord(' ')), width + self.tracking) for (i, width) in enumerate(char_widths[:96])])
+            self.__advances_for = (self.tracking, char_widths)
+        return self.__advances
+
     def size(self, text):
         """Returns a tuple of the width and height of this text as rendered with this font."""
+        advances = self.advances()
+        return (sum([advances.get(ch, 0) for ch in text]), self.char_size)
+
+    def sizes(self, texts):
+        """Returns the list of the sizes (see :meth:`size`) of every string in *texts*."""
+        advances = self.advances()
+        return [(sum([advances.get(ch, 0) for ch in text]), self.char_size) for text in texts]
+
+    def prefix_widths(self, text):
+        """Returns the list of the widths of every prefix of *text*, from the empty string to *text* itself,
+        so that ``prefix_widths(text)[j] - prefix_widths(text)[i]`` is the width of ``text[i:j]``."""
+        advances = self.advances()
+        widths = [0]
         x = 0
         for ch in text:
-            char_offset = ord(ch) - ord(' ')
-            if char_offset < 0 or char_offset >= 96:
-                continue
-            width = self.char_widths[char_offset]
-            x += width + self.tracking
-        return (x, self.char_size)
+            x += advances.get(ch, 0)
+            widths.append(x)
+        return widths
     
     def draw_in_rect(self, frame, text, rect=(0,0,128,32), anchor=AnchorCenter):
         """Draw *text* on *frame* within the given *rect*, aligned in accordance with *anchor*.
@@ -264,17 +286,6 @@ class AnimFont(Font):
     
         return font_data
 
-    def size(self, text):
-        """Returns a tuple of the width and height of this text as rendered with this font."""
-        x = 0
-        for ch in text:
-            char_offset = ord(ch) - ord(' ')
-            if char_offset < 0 or char_offset >= 96:
-                continue
-            width = self.char_widths[char_offset]
-            x += width + self.tracking
-        return (x, self.char_size)
-
     def save(self, filename):
         """Save the font to the given path."""
         out = Animation()
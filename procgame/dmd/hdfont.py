@@ -1,10 +1,14 @@
 import os
+import collections
 import animation, dmd
 from dmd import Frame
 from procgame import config
 from procgame import util
 from pygame.font import match_font
 from sdl2_displaymanager import sdl2_DisplayManager
+import sdl2
+import sdl2.sdlttf as sdlttf
+from ctypes import byref, c_int
 # import pygame
 
 # Anchor values are used by Font.draw_in_rect():
@@ -27,6 +31,167 @@ class HDFontStyle(object):
         self.fill_color=fill_color
 
 
+class RenderCache(object):
+    """Bounded cache keeping the *max_entries* most recently used entries, used to hold
+    rendered and measured text so that strings drawn again are not rendered again.
+
+    :attr:`hits` and :attr:`misses` count the lookups made through :meth:`get`.
+    A *max_entries* of 0 disables the cache."""
+
+    def __init__(self, max_entries):
+        super(RenderCache, self).__init__()
+        self.max_entries = int(max_entries)
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the entry stored under *key*, or ``None``, and marks it most recently used."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Stores *entry* under *key*, evicting the least recently used entries if the cache is full."""
+        if self.max_entries <= 0:
+            return entry
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+
+def color_key(color):
+    """Returns *color* in a form usable in a cache key; colors read from yaml are lists."""
+    if color is None:
+        return None
+    return tuple(color)
+
+
+class GlyphAtlas(object):
+    """The printable ASCII characters of a font rendered once, in one style, into a single texture.
+
+    :meth:`draw` copies the glyphs of a string out of the atlas, placed with the glyph metrics
+    and kerning of the font the way SDL_ttf places them when it renders the whole string.
+    Bordered text takes two passes, the outline then the interior, as in
+    :meth:`~sdl2_DisplayManager.font_render_bordered_text_Faster`.  Glyph metrics and
+    kerning pairs are looked up once and kept."""
+
+    chars = [chr(i) for i in range(32, 127)]
+    max_width = 2048
+    """Width of the atlas texture; glyphs that do not fit start a new row."""
+
+    def __init__(self, font_alias, size, color, border_width=0, border_color=None):
+        super(GlyphAtlas, self).__init__()
+        self.font = sdl2_DisplayManager.inst().font_manager.get_font_pointer(font_alias, size)
+        self.use_kerning = bool(sdlttf.TTF_GetFontKerning(self.font))
+        self.kerning = {}
+        self.passes = []
+        if(border_color is not None and border_width > 0):
+            self.passes.append(self.build_pass(border_color, border_width, 0))
+            self.passes.append(self.build_pass(color, 0, border_width))
+        else:
+            self.passes.append(self.build_pass(color, 0, 0))
+        sdlttf.TTF_SetFontOutline(self.font, 0)
+        self.supported = set(self.chars)
+        for (atlas, glyphs, offset) in self.passes:
+            self.supported.intersection_update(glyphs.keys())
+
+    def build_pass(self, color, outline, offset):
+        """Renders every character with the given *outline* width into a new atlas texture and
+        returns (atlas, glyphs, offset) where glyphs maps each character to (area in the atlas,
+        horizontal bearing, advance)."""
+        dm = sdl2_DisplayManager.inst()
+        sdlttf.TTF_SetFontOutline(self.font, outline)
+        c = sdl2.ext.convert_to_color(color)
+        sdl_color = sdl2.pixels.SDL_Color(c.r, c.g, c.b, c.a)
+
+        rendered = []
+        (x, y, row_height, atlas_width) = (0, 0, 0, 1)
+        for ch in self.chars:
+            (minx, maxx, miny, maxy, advance) = (c_int(), c_int(), c_int(), c_int(), c_int())
+            if sdlttf.TTF_GlyphMetrics(self.font, ord(ch), byref(minx), byref(maxx), byref(miny), byref(maxy), byref(advance)) == -1:
+                continue
+            sf = sdlttf.TTF_RenderUTF8_Blended(self.font, ch, sdl_color)
+            if not sf:
+                continue
+            sf = sf.contents
+            (w, h) = (int(sf.w), int(sf.h))
+            if(x > 0 and x + w > self.max_width):
+                (x, y, row_height) = (0, y + row_height, 0)
+            # a glyph starting left of the origin is moved right in its own surface
+            rendered.append((ch, sf, (x, y, w, h), min(minx.value, 0), advance.value))
+            x += w
+            row_height = max(row_height, h)
+            atlas_width = max(atlas_width, x)
+
+        atlas = dm.new_texture(atlas_width, max(y + row_height, 1))
+        glyphs = {}
+        dm.begin_batch(atlas)
+        for (ch, sf, rect, bearing, advance) in rendered:
+            tx = dm.texture_from_surface(sf)
+            dm.set_texture_blendmode(tx, None) # copy the glyph as is, alpha included
+            dm.blit(tx, atlas, rect)
+            sdl2.surface.SDL_FreeSurface(sf)
+            glyphs[ch] = (rect, bearing, advance)
+        dm.end_batch()
+
+        if(len(color)==4):
+            dm.set_texture_alpha(atlas, color[3])
+        return (atlas, glyphs, offset)
+
+    def kern(self, prev, ch):
+        if(prev is None or not self.use_kerning):
+            return 0
+        k = self.kerning.get((prev, ch))
+        if k is None:
+            if hasattr(sdlttf, 'TTF_GetFontKerningSizeGlyphs'):
+                k = sdlttf.TTF_GetFontKerningSizeGlyphs(self.font, ord(prev), ord(ch))
+            else:
+                k = sdlttf.TTF_GetFontKerningSize(self.font, sdlttf.TTF_GlyphIsProvided(self.font, ord(prev)), sdlttf.TTF_GlyphIsProvided(self.font, ord(ch)))
+            self.kerning[(prev, ch)] = k
+        return k
+
+    def can_draw(self, text):
+        for ch in text:
+            if ch not in self.supported:
+                return False
+        return True
+
+    def draw(self, frame, text, x, y):
+        """Draws *text* with its upper left corner at (*x*, *y*) and returns its width.
+        Every character must be in the atlas, see :meth:`can_draw`."""
+        dm = sdl2_DisplayManager.inst()
+        (x, y) = (int(x), int(y))
+        width = 0
+        dm.begin_batch(frame.pySurface)
+        for (atlas, glyphs, offset) in self.passes:
+            pen = -glyphs[text[0]][1]
+            prev = None
+            for ch in text:
+                ((gx, gy, gw, gh), bearing, advance) = glyphs[ch]
+                pen += self.kern(prev, ch)
+                left = offset + pen + bearing
+                dm.blit(atlas, frame.pySurface, (x + left, y + offset, gw, gh), area=(gx, gy, gw, gh))
+                width = max(width, left + gw)
+                pen += advance
+                prev = ch
+        dm.end_batch()
+        frame.touch()
+        return width
+
+
 class HDFont(object):
     """Object wrapper for a PyGame font.
     
@@ -46,6 +211,20 @@ class HDFont(object):
     
     pygFont = None
 
+    rendered_text = None
+    """:class:`RenderCache` of the strings last drawn by :meth:`draw` and :meth:`drawHD`, shared by every HDFont.
+    Its size is the ``hdfont_text_cache_size`` config value."""
+
+    glyph_atlases = None
+    """:class:`RenderCache` of the :class:`GlyphAtlas` built for each font, size and style."""
+
+    measure_cache_size = 256
+    """Number of strings whose size is remembered by each font (``hdfont_measure_cache_size`` config value)."""
+
+    use_glyph_atlas = False
+    """If True (``hdfont_glyph_atlas`` config value) strings without a background color are drawn from
+    a :class:`GlyphAtlas` instead of being rendered by SDL_ttf.  Off by default: placing glyphs one by
+    one can put some of them a dot away from where SDL_ttf puts them in the whole string."""
 
     def __init__(self, fontname, size, bold = False, font_file_path = None):
         super(HDFont, self).__init__()
@@ -73,6 +252,7 @@ class HDFont(object):
             self.char_widths += [size]
             #self.char_widths += [ self.pygFont.size(str(chr(i+32)))[0] ]
         self.char_size = size #self.pygFont.get_height()
+        self.measured = RenderCache(self.measure_cache_size)
         (self.font_width, self.font_height) = sdl2_DisplayManager.inst().font_get_size("Z", self.name, self.font_size)
 
 
@@ -128,8 +308,19 @@ class HDFont(object):
         x = int(x)
         y = int(y)
 
-        w = sdl2_DisplayManager.inst().font_render_bordered_text_Faster(frame.pySurface, {'x':x, 'y':y},text, font_alias=self.name, size=font_size, width=None, color=interior_color, bg_color=fill_color, border_color=line_color, border_width=line_width)
-            
+        atlas = self.glyph_atlas(font_size, interior_color, line_width, line_color)
+        if(atlas is not None and atlas.can_draw(text)):
+            return x+atlas.draw(frame, text, x, y)
+
+        key = ('bordered', self.name, font_size, text, color_key(interior_color), color_key(fill_color), color_key(line_color), line_width)
+        rendered = self.rendered_text.get(key)
+        if rendered is None:
+            rendered = sdl2_DisplayManager.inst().font_render_bordered_textures(text, font_alias=self.name, size=font_size, width=None, color=interior_color, bg_color=fill_color, border_color=line_color, border_width=line_width)
+            self.rendered_text.put(key, rendered)
+
+        w = sdl2_DisplayManager.inst().blit_bordered_text(frame.pySurface, {'x':x, 'y':y}, rendered, line_width)
+        frame.touch()
+
         return x+w
 
 
@@ -148,12 +339,22 @@ class HDFont(object):
         if(font_size is None):
             font_size = self.font_size
             
-        surf = sdl2_DisplayManager.inst().font_render_text(text, font_alias=self.name, size=font_size, width=None, color=color, bg_color=bg_color)
-        (w,h) = surf.size
+        if(bg_color is None):
+            atlas = self.glyph_atlas(font_size, color)
+            if(atlas is not None and atlas.can_draw(text)):
+                return x+atlas.draw(frame, text, x, y)
 
-        tmp = Frame(w,h, from_surface=surf)
+        key = ('plain', self.name, font_size, text, color_key(color), color_key(bg_color))
+        tmp = self.rendered_text.get(key)
+        if tmp is None:
+            surf = sdl2_DisplayManager.inst().font_render_text(text, font_alias=self.name, size=font_size, width=None, color=color, bg_color=bg_color)
+            (w,h) = surf.size
 
-        tmp.composite_op = "blacksrc"
+            tmp = Frame(w,h, from_surface=surf)
+
+            tmp.composite_op = "blacksrc"
+            self.rendered_text.put(key, tmp)
+        (w,h) = (tmp.width, tmp.height)
 
         # w = min(w, frame.width)
         # h = min(h, frame.height)        
@@ -162,10 +363,31 @@ class HDFont(object):
             
         return x+w
     
+    def glyph_atlas(self, font_size, color, border_width=0, border_color=None):
+        """Returns the :class:`GlyphAtlas` of this font in the given style, building it on first use,
+        or ``None`` if :attr:`use_glyph_atlas` is off."""
+        if not self.use_glyph_atlas:
+            return None
+        if(border_color is None or border_width == 0):
+            (border_width, border_color) = (0, None)
+        key = (self.name, font_size, color_key(color), border_width, color_key(border_color))
+        atlas = self.glyph_atlases.get(key)
+        if atlas is None:
+            atlas = self.glyph_atlases.put(key, GlyphAtlas(self.name, font_size, color, border_width, border_color))
+        return atlas
+
     def size(self, text):
-        """Returns a tuple of the width and height of this text as rendered with this font."""
+        """Returns a tuple of the width and height of this text as rendered with this font.
+        The :attr:`measure_cache_size` strings measured last are remembered."""
         #raise ValueError, "Size is not supported in HDText (yet)"
-        return sdl2_DisplayManager.inst().font_get_size( text, self.name, self.font_size)
+        size = self.measured.get(text)
+        if size is None:
+            size = self.measured.put(text, sdl2_DisplayManager.inst().font_get_size( text, self.name, self.font_size))
+        return size
+
+    def sizes(self, texts):
+        """Returns the list of the sizes (see :meth:`size`) of every string in *texts*."""
+        return [self.size(text) for text in texts]
     
     def draw_in_rect(self, frame, text, rect=(0,0,128,32), anchor=AnchorCenter, font_size=None):
         """Draw *text* on *frame* within the given *rect*, aligned in accordance with *anchor*.
@@ -247,6 +469,14 @@ def init_hdfont_path():
 
 init_hdfont_path()
 
+def init_hdfont_caches():
+    HDFont.rendered_text = RenderCache(config.value_for_key_path('hdfont_text_cache_size', 128))
+    HDFont.glyph_atlases = RenderCache(32)
+    HDFont.measure_cache_size = config.value_for_key_path('hdfont_measure_cache_size', 256)
+    HDFont.use_glyph_atlas = bool(config.value_for_key_path('hdfont_glyph_atlas', False))
+
+init_hdfont_caches()
+
 
 __hdfont_cache = {}
 def hdfont_named(name, size, bold=False, font_file_path=None):
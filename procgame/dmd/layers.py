@@ -1,14 +1,16 @@
 from dmd import *
 from procgame import config
+from procgame import clock
 from random import randrange
 import hdfont
 import logging
+import ctypes
+import weakref
 try:
     import cv2
     import cv2 as cv
-    from movie import capPropId, getColorProp
     OpenCV_avail = True
-    from movie import Movie
+    from movie import Movie, MovieDecoder
 except ImportError:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     logging.error("OpenCV is not available on your system.  The MovieLayer (mp4) support is unavailable")
@@ -17,6 +19,7 @@ except ImportError:
 class FrameLayer(Layer):
     """Displays a single frame."""
 
+    tracks_damage = True
     blink_frames = None # Number of frame times to turn frame on/off
     blink_frames_counter = 0
     frame_old = None
@@ -56,8 +59,9 @@ class ScaledLayer(Layer):
         self.nframe = None
 
     def next_frame(self):
-        if(self.nframe is not None):
-            del self.nframe
+        # the scaled copy made last frame may still be held by whoever was handed it,
+        # so it is left to the garbage collector rather than released
+        self.nframe = None
 
         t = self.content_layer.next_frame()
 
@@ -69,6 +73,7 @@ class ScaledLayer(Layer):
         return self.nframe
 
 class SolidLayer(Layer):
+    tracks_damage = True
     def __init__(self, width, height, color, opaque=True):
         super(SolidLayer, self).__init__(opaque)
         self.frame = Frame(width,height)
@@ -81,6 +86,8 @@ class SolidLayer(Layer):
 class AnimatedLayer(Layer):
     """Collection of frames displayed sequentially, as an animation.  Optionally holds the last frame on-screen."""
 
+    tracks_damage = True
+
     hold = True
     """``True`` if the last frame of the animation should be held on-screen indefinitely."""
 
@@ -93,6 +100,10 @@ class AnimatedLayer(Layer):
     frame_pointer = 0
     """Index of the next frame to display.  Incremented by :meth:`next_frame`."""
 
+    prefetch_frames = 0
+    """Number of frames made resident ahead of the frame pointer when :attr:`frames` is loaded on
+    demand (see :class:`~procgame.dmd.MappedFrameList`); the ``dmd_prefetch_frames`` config key."""
+
     def __init__(self, opaque=False, hold=True, repeat=False, frame_time=1, frames=None):
         super(AnimatedLayer, self).__init__(opaque)
         self.hold = hold
@@ -102,6 +113,8 @@ class AnimatedLayer(Layer):
             self.frames = list()
         else:
             self.frames = frames
+        if hasattr(self.frames, 'prefetch'):
+            self.prefetch_frames = config.value_for_key_path('dmd_prefetch_frames', 2)
 
         self.frame_time = frame_time # Number of frames each frame should be displayed for before moving to the next.
         self.frame_time_counter = self.frame_time
@@ -209,14 +222,76 @@ class AnimatedLayer(Layer):
 
         if self.frame_time_counter == 0:
             self.frame_time_counter = self.frame_time
+            if self.prefetch_frames:
+                self.prefetch()
 
         return frame
 
+    def prefetch(self):
+        """Has :attr:`frames` make the next :attr:`prefetch_frames` frames to be shown resident."""
+        if self.frame_sequence:
+            (sequence, pointer) = (self.frame_sequence, self.frame_sequence_pointer)
+        else:
+            (sequence, pointer) = (None, self.frame_pointer)
+        count = len(sequence) if sequence else len(self.frames)
+        indexes = []
+        for i in range(pointer, pointer + self.prefetch_frames):
+            if i >= count:
+                if not self.repeat:
+                    break
+                i %= count
+            indexes.append(sequence[i] if sequence else i)
+        self.frames.prefetch(indexes)
+
+
+class MovieResources(object):
+    """The decoder of a :class:`MovieLayer` and, when the layer opened the movie itself, its OpenCV
+    capture.  The decoder is closed by :meth:`MovieLayer.close`; both are closed once the layer is
+    garbage collected, through a weak reference rather than ``__del__`` so that a layer caught in
+    a reference cycle (a mode and its layer referring to each other) is still collected."""
+
+    live = set()
+    """Weak references to the layers whose resources are still open."""
+
+    def __init__(self, layer, movie, owns_movie):
+        super(MovieResources, self).__init__()
+        self.movie = movie
+        self.owns_movie = owns_movie
+        self.decoder = None
+        MovieResources.live.add(weakref.ref(layer, self.collected))
+
+    def close_decoder(self):
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+
+    def collected(self, ref):
+        MovieResources.live.discard(ref)
+        if self.decoder is not None:
+            # the worker thread may be reading the capture, it releases it when it stops
+            self.decoder.release_capture = self.owns_movie
+            self.decoder.close()
+            self.decoder = None
+        elif self.owns_movie and self.movie.vc is not None:
+            self.movie.vc.release()
+            self.movie.vc = None
 
 class MovieLayer(Layer):
     """This will pull the next frame from an mp4 (or other supported video format
     and converts it to a frame/surface)
- Optionally holds the last frame on-screen."""
+ Optionally holds the last frame on-screen.
+
+    The frames are decoded ahead on a worker thread (see :class:`~procgame.dmd.movie.MovieDecoder`,
+    the ``movie_buffer_frames`` config key sets how many, 4 by default) and uploaded into the
+    one streaming texture of :attr:`frame`.  A frame not decoded yet when it is due is counted
+    in :attr:`late_frames` and shown as soon as it is, if it is still due; frames skipped
+    to catch up are counted in :attr:`dropped_frames`.
+
+    Call :meth:`close` when the movie is not shown for a while (from the mode's
+    :meth:`~procgame.game.Mode.mode_stopped`, say) to stop the worker thread; the movie starts
+    over from the first frame when the layer is :meth:`reset` or shown again.  Otherwise it stops once the layer is garbage collected."""
+
+    tracks_damage = True
 
     hold = True
     """``True`` if the last frame of the animation should be held on-screen indefinitely."""
@@ -241,6 +316,11 @@ class MovieLayer(Layer):
 
     duration = None
 
+    decoder = None
+
+    late_frames = 0
+    """Number of frames that were not decoded yet when they were due."""
+
     def __init__(self, opaque=False, hold=True, repeat=False, frame_time=1, movie=None, movie_file_path=None, transparency_op=None):
         if(cv2 is None):
             raise ValueError, "MP4 is unavailable as OpenCV is not installed"
@@ -250,6 +330,7 @@ class MovieLayer(Layer):
         self.hold = hold
         self.repeat = repeat
 
+        owns_movie = movie is None
         if(movie is None and movie_file_path is None):
             raise ValueError, "MovieLayer requires either a movie_file_path argument -or- an instantiated movie object"
         elif(movie_file_path is not None):
@@ -271,10 +352,32 @@ class MovieLayer(Layer):
 
         self.composite_op = transparency_op
 
-        self.frame = Frame(self.movie.width, self.movie.height)
+        self.resources = MovieResources(self, self.movie, owns_movie)
+        self.closed_dropped = 0
+        self.open()
+        texture = sdl2_DisplayManager.inst().new_streaming_texture(self.movie.width, self.movie.height, self.decoder.mode)
+        blank = ctypes.create_string_buffer(self.decoder.pitch * self.movie.height)
+        sdl2_DisplayManager.inst().update_texture(texture, blank, self.decoder.pitch)
+        self.frame = Frame(self.movie.width, self.movie.height, from_surface=texture)
         self.fps = config.value_for_key_path('dmd_framerate', None)
         self.reset()
 
+    def open(self):
+        """Starts the worker thread decoding the movie from the first frame, if it is not running."""
+        if self.decoder is not None:
+            return
+        buffers = config.value_for_key_path('movie_buffer_frames', 4)
+        self.decoder = self.resources.decoder = MovieDecoder(self.movie, buffers=buffers, composite_op=self.composite_op, loop=self.repeat)
+
+    def close(self):
+        """Stops the worker thread, once it is done with the frame it is decoding, and frees its
+        buffers; the layer keeps showing its last frame."""
+        if self.decoder is None:
+            return
+        self.closed_dropped += self.decoder.dropped
+        self.resources.close_decoder()
+        self.decoder = None
+
     def duration(self):
         """Returns the duration of the animation, as played once through."""
         if(self.movie.vc is not None):
@@ -284,8 +387,22 @@ class MovieLayer(Layer):
     def reset(self):
         """Resets the animation back to the first frame."""
         self.frame_pointer = 0
-        # and reset the video capture position to 0
-        self.movie.vc.set(capPropId("POS_FRAMES"),0)
+        self.frame_time_counter = self.frame_time
+        # frames are numbered from the restart of the decoder
+        self.frames_due = 0
+        self.frames_shown = 0
+        self.late = False
+        if self.decoder is None:
+            self.open()
+        else:
+            self.decoder.restart()
+
+    def dropped_frames(self):
+        """Returns the number of decoded frames skipped because a later frame was already due."""
+        if self.decoder is None:
+            return self.closed_dropped
+        return self.closed_dropped + self.decoder.dropped
+    dropped_frames = property(dropped_frames)
 
     def add_frame_listener(self, frame_index, listener):
         """Registers a method (``listener``) to be called when a specific
@@ -301,14 +418,15 @@ class MovieLayer(Layer):
             (index, listener) = frame_listener
             if index >= 0 and self.frame_pointer == index:
                 listener()
-            elif self.frame_pointer == (len(self.frames) + index):
+            elif self.frame_pointer == (self.movie.frame_count + index):
                 listener()
 
 
     def next_frame(self):
         """Returns the frame to be shown, or None if there is no frame."""
-        #lets check if we are at end of video and if not, grab next frame
-        #and convert to a surface and shove into frame
+        #lets check if we are at end of video and if not, show the next decoded frame
+        if self.decoder is None:
+            self.reset() # closed, start over
 
         # Important: Notify the frame listeners before frame_pointer has been advanced.
         # Only notify the listeners if this is the first time this frame has been shown
@@ -318,12 +436,14 @@ class MovieLayer(Layer):
 
         self.frame_time_counter -= 1
 
-        rval = None
-        #now we grab the next frame
+        self.decoder.loop = self.repeat
+        if self.decoder.frame_count < self.movie.frame_count:
+            self.movie.frame_count = self.decoder.frame_count
+
         if (self.frame_pointer >= self.movie.frame_count) and self.frame_time_counter == 0:
             if self.repeat:
+                # the decoder already went on with the first frame
                 self.frame_pointer = 0
-                self.movie.vc.set(capPropId("POS_FRAMES"),0)
             elif self.hold:
                 self.frame_time_counter = self.frame_time
                 return self.frame
@@ -331,29 +451,35 @@ class MovieLayer(Layer):
                 self.frame_time_counter = 0
                 return None
 
-        video_frame = None
         if self.frame_time_counter == 0:
-            rval, video_frame = self.movie.vc.read()
             self.frame_pointer += 1
+            self.frames_due += 1
             self.frame_time_counter = self.frame_time
+            self.late = False
 
-            if rval is True and video_frame is not None:
-                # self.logger.info("pulling frame %d / %d" % (self.frame_pointer, self.movie.frame_count))
-                video_frame = cv2.cvtColor(video_frame,getColorProp())
-                the_frame = video_frame #tODO: OpenCV3 fix cv.fromarray(video_frame)
-                # surface = pygame.image.frombuffer(the_frame.tostring(), (self.movie.width, self.movie.height), 'RGB')
-                surf = sdl2_DisplayManager.inst().make_texture_from_imagebits(bits=the_frame.tostring(), width=self.movie.width, height=self.movie.height, mode='RGB', composite_op = self.composite_op)
-
-                self.frame.pySurface = surf
-            else:
-                # self.logger.info("ERROR OCCURED [%s] [%s]" % (rval, video_frame))
-                # end movie prematurely
-                self.movie.frame_count = self.frame_pointer - 1
-
-
+        # a late frame is still shown on the following calls, until the next one is due
+        if self.frames_shown < self.frames_due:
+            self.show_decoded_frame(self.frames_due - 1)
 
         return self.frame
 
+    def show_decoded_frame(self, number):
+        item = self.decoder.next(number)
+        if item is None:
+            if not self.late:
+                self.late = True
+                self.late_frames += 1
+            return
+        (index, buf) = item
+        self.frames_shown = number + 1
+        if buf is None:
+            # end movie prematurely
+            self.movie.frame_count = index
+            return
+        sdl2_DisplayManager.inst().update_texture(self.frame.pySurface, buf.ctypes.data_as(ctypes.c_void_p), self.decoder.pitch)
+        self.decoder.release(buf)
+        self.frame.touch()
+
 
 
 
@@ -395,6 +521,7 @@ class FrameQueueLayer(Layer):
 class TextLayer(Layer):
     """Layer that displays text."""
 
+    tracks_damage = True
     fill_color = None
     text = None
     """Dot value to fill the frame with.  Requres that ``width`` and ``height`` be set.  If ``None`` only the font characters will be drawn."""
@@ -437,7 +564,7 @@ class TextLayer(Layer):
             elif self.justify == 'center':
                 (x, y) = (-w/2,0)
 
-            (wOfText, hOfText) = self.font.size(text)
+            (wOfText, hOfText) = (w, h)
             self.text_width = wOfText
             self.text_height = hOfText
 
@@ -456,7 +583,6 @@ class TextLayer(Layer):
 
             else:
                 self.set_target_position(self.x, self.y)
-                (w, h) = self.font.size(text)
                 (w,h) = (max(w,1),max(h,1))
                 self.frame = Frame(w, h)
                 self.frame.fill_rect(0, 0, w, h, (0,0,0,0)) # but taking this away shouldn't break it should it??
@@ -514,8 +640,8 @@ class TextLayer(Layer):
 
     def next_frame(self):
         if self.started_at == None:
-            self.started_at = time.time()
-        if (self.seconds != None) and ((self.started_at + self.seconds) < time.time()):
+            self.started_at = clock.now()
+        if (self.seconds != None) and ((self.started_at + self.seconds) < clock.now()):
             self.frame = None
         elif self.blink_frames > 0:
             if self.blink_frames_counter == 0:
@@ -535,6 +661,8 @@ class TextLayer(Layer):
 
 class AnimatedTextLayer(TextLayer):
 
+    tracks_damage = True
+
     def __init__(self, x, y, font, justify="left", opaque=False, width=192, height=96, fill_color=None, frame_time = 1):
         super(AnimatedTextLayer, self).__init__( x, y, font, justify, opaque, width, height, fill_color)
 
@@ -543,8 +671,8 @@ class AnimatedTextLayer(TextLayer):
 
     def next_frame(self):
         if self.started_at == None:
-            self.started_at = time.time()
-        if (self.seconds != None) and ((self.started_at + self.seconds) < time.time()):
+            self.started_at = clock.now()
+        if (self.seconds != None) and ((self.started_at + self.seconds) < clock.now()):
             self.frame = None
         # elif self.blink_frames > 0:
         #     if self.blink_frames_counter == 0:
@@ -592,7 +720,6 @@ class AnimatedTextLayer(TextLayer):
                 self.font.draw(self.frame, text, self.x + x, self.y + y)
             else:
                 self.set_target_position(self.x, self.y)
-                (w, h) = self.font.size(text)
                 (w,h) = (max(w,1),max(h,1))
                 self.frame = Frame(w, h)
                 self.frame.fill_rect(0, 0, w, h, (0,0,0,0)) # but taking this away shouldn't break it should it??
@@ -636,12 +763,12 @@ class ScriptedLayer(Layer):
         # This assumes looping.  TODO: Add code to not loop!
         holding=False
         if self.frame_start_time == None:
-            self.frame_start_time = time.time()
+            self.frame_start_time = clock.now()
 
         #print "index and script length  "+ str(self.script_index) + "   " +  str(len(self.script))
         script_item = self.script[self.script_index]
 
-        time_on_frame = time.time() - self.frame_start_time
+        time_on_frame = clock.now() - self.frame_start_time
 
         # If we are being forced to the next frame, or if the current script item has expired:
         if self.force_direction != None or time_on_frame > script_item['seconds']:
@@ -683,7 +810,7 @@ class ScriptedLayer(Layer):
             # Assign the new script item:
             if not holding:
                 script_item = self.script[self.script_index]
-                self.frame_start_time = time.time()
+                self.frame_start_time = clock.now()
 
                 layer = script_item['layer']
                 if layer:
@@ -893,7 +1020,12 @@ class GroupedLayer(Layer):
 
     Layers are composited first to last using each layer's
     :meth:`~procgame.dmd.Layer.composite_next` method.  Compositing is ended after a layer that returns
-    non-``None`` from :meth:`~Layer.composite_next` is :attr:`~Layer.opaque`."""
+    non-``None`` from :meth:`~Layer.composite_next` is :attr:`~Layer.opaque`.
+
+    A :class:`~procgame.dmd.Compositor` keeps the buffer between frames, so when none of the
+    layers changed the buffer is returned as is instead of being redrawn."""
+
+    tracks_damage = True
 
     def __init__(self, width=None, height=None, layers=None, fill_color=None, opaque=False):
         """ size is auto-detected from layers if omitted """
@@ -907,6 +1039,7 @@ class GroupedLayer(Layer):
 
         super(GroupedLayer, self).__init__(opaque)
         self.buffer = Frame(width, height)
+        self.compositor = Compositor()
         self.fill_color = fill_color
         if layers == None:
             self.layers = list()
@@ -937,24 +1070,20 @@ class GroupedLayer(Layer):
         # if not blacksrc'd but truly this is 'wrong' so programmers are recommended
         # to change their implementations, instead.
 
+        layers = [layer for layer in layers[::-1] if layer.enabled]
         if(self.fill_color is None):
-            self.buffer.clear()
+            composited_count = self.compositor.composite(self.buffer, layers)
         else:
-            self.buffer.clear(self.fill_color)
-
-        composited_count = 0
-        for layer in layers[::-1]:
-            frame = None
-            if layer.enabled:
-                frame = layer.composite_next(self.buffer)
-            if frame != None:
-                composited_count += 1
+            composited_count = self.compositor.composite(self.buffer, layers, self.fill_color)
         if composited_count == 0:
             return None
         return self.buffer
 
 class RandomizedLayer(GroupedLayer):
     """ Layer that contains other layers and shows one at random when requested """
+
+    tracks_damage = False
+
     def __init__(self, layers):
         if(layers is None):
             raise ValueError, "Cannot initialize a RandomizedLayer with no content layers!"
@@ -1169,8 +1298,6 @@ class ZoomingLayer(Layer):
         if(self.total_zoomed > self.total_zooms and self.hold is False):
             return None
 
-        if(self.nframe is not None):
-            del self.nframe
         self.nframe = self.source_layer.next_frame().copy()
 
         if(self.nframe is None):
@@ -1211,6 +1338,15 @@ class HDTextLayer(TextLayer):
     line_width = 0
     text = None
     style = None
+    tracks_damage = True
+
+    rendered_frames = hdfont.RenderCache(config.value_for_key_path('hdfont_text_cache_size', 128))
+    """Frames recently rendered by :meth:`set_text`, shared by every HDTextLayer, so that showing a
+    string again (a score going back and forth, a layer built again) does not render it again.
+    The cached frames are never handed out: :meth:`set_text` gives each layer a copy, so a hit
+    still allocates one texture (:meth:`Frame.copy`), a texture to texture copy instead of
+    rendering the text again.  The layer cannot draw into the frame it already has instead:
+    game code may still hold that frame (a FrameLayer built from it, say)."""
 
     # def __init__(self, x, y, font, justify="left", opaque=False, width=192, height=96, fill_color=None):
 
@@ -1290,17 +1426,15 @@ class HDTextLayer(TextLayer):
         if text == None or text=="":
             self.frame = None
         else:
-            (w, h) = self.font.size(text)
-            x, y = 0, 0
-            if self.justify == 'left':
-                (x, y) = (0,0)
-            elif self.justify == 'right':
-                (x, y) = (-w,0)
-            elif self.justify == 'center':
-                (x, y) = (-w/2,0)
-
-            (wOfText, hOfText) = self.font.size(text)
-            (wOfText , hOfText) = (wOfText+(2*line_width), hOfText+(2*line_width))
+            # the use of fill_color is intentional...
+            filled = fill_color != None
+            key = self.cache_key(text, fill_color, line_color, line_width, interior_color)
+            rendered = self.rendered_frames.get(key)
+            if rendered is None:
+                (wOfText, hOfText) = self.font.size(text)
+                (wOfText , hOfText) = (wOfText+(2*line_width), hOfText+(2*line_width))
+            else:
+                (frame, wOfText, hOfText) = rendered
             self.text_width = wOfText
             self.text_height = hOfText
             x, y = 0, 0
@@ -1318,34 +1452,49 @@ class HDTextLayer(TextLayer):
                 y_offset = -1
             elif self.Vjustify == 'center':
                 y_offset = -0.5
-            # the use of fill_color is intentional...
-            if fill_color != None:
+            if filled:
                 (x,y) = (self.width*x_offset, self.height*y_offset)
                 self.set_target_position(x, y)
 
-                self.frame = Frame(width=self.width, height=self.height)
-                self.frame.fill_rect(0, 0, self.width, self.height, fill_color)
+                if rendered is None:
+                    frame = Frame(width=self.width, height=self.height)
+                    frame.fill_rect(0, 0, self.width, self.height, fill_color)
 
-                (x, y) = ((wOfText-self.width)*x_offset, (hOfText-self.height)*y_offset)
+                    (x, y) = ((wOfText-self.width)*x_offset, (hOfText-self.height)*y_offset)
 
-                self.font.drawHD(self.frame, text, x, y, line_color, line_width, interior_color, None)
-                # self.font.draw(self.frame, text, x, y, interior_color)
+                    self.font.drawHD(frame, text, x, y, line_color, line_width, interior_color, None)
+                    # self.font.draw(frame, text, x, y, interior_color)
 
                 (self.target_x_offset, self.target_y_offset) = (self.x,self.y)
             else:
                 (x, y) = (wOfText*x_offset, hOfText*y_offset)
                 self.set_target_position(self.x, self.y)
-                self.frame = Frame(wOfText, hOfText)
-                # I think this fixes it??
-                self.frame.fill_rect(0, 0, wOfText, hOfText, (0,0,0,0)) # but taking this away shouldn't break it should it??
+                if rendered is None:
+                    frame = Frame(wOfText, hOfText)
+                    # I think this fixes it??
+                    frame.fill_rect(0, 0, wOfText, hOfText, (0,0,0,0)) # but taking this away shouldn't break it should it??
 
-                self.font.drawHD(self.frame, text, 0, 0, line_color, line_width, interior_color, fill_color)
-                # self.font.draw(self.frame, text, 0,0, interior_color)
+                    self.font.drawHD(frame, text, 0, 0, line_color, line_width, interior_color, fill_color)
+                    # self.font.draw(frame, text, 0,0, interior_color)
                 (self.target_x_offset, self.target_y_offset) = (x,y)
 
+            if rendered is None:
+                self.rendered_frames.put(key, (frame, wOfText, hOfText))
+            # the cached frame is shared with every other layer showing this text; the layer gets
+            # a copy of its own, which Layer.scale(), Frame.fill_rect() etc. may change in place
+            self.frame = frame.copy()
+
         return self
 
 
+    def cache_key(self, text, fill_color, line_color, line_width, interior_color):
+        """Returns the key of the text in :attr:`rendered_frames`.  A filled frame is as large as
+        the layer, with the text placed in it, so the layer's size and justification are part of it."""
+        key = (self.font, text, hdfont.color_key(fill_color), hdfont.color_key(line_color), line_width, hdfont.color_key(interior_color))
+        if fill_color != None:
+            key += (self.width, self.height, self.justify, self.Vjustify)
+        return key
+
     def set_textTL(self, text, seconds=None, blink_frames=None, style=None):
         """Displays the given message for the given number of seconds."""
         if(self.text is not None and self.text == text):
@@ -1493,9 +1642,9 @@ class AnimatedHDTextLayer(Layer):
             return None
 
         if self.started_at == None:
-            self.started_at = time.time()
+            self.started_at = clock.now()
 
-        if (self.seconds != None) and ((self.started_at + self.seconds) < time.time()):
+        if (self.seconds != None) and ((self.started_at + self.seconds) < clock.now()):
             return None
 
         if self.blink_frames > 0:
@@ -95,9 +95,10 @@ class MarkupFrameGenerator:
             # Need to do word-wrapping!
             line = ''
             w = 0
-            for ch in text:
+            char_widths = [size[0] for size in font.sizes(text)]
+            for (ch, cw) in zip(text, char_widths):
                 line += ch
-                w += font.size(ch)[0]
+                w += cw
                 if w > self.width:
                     # Too much! We need to back-track for the last space, if possible..
                     idx = line.rfind(' ')
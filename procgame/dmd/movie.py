@@ -14,11 +14,14 @@ import re
 import colorsys
 import pygame
 import zipfile
+import threading
+import Queue
 
 try:
     import cv2
     from pkg_resources import parse_version
     OPCV3 = parse_version(cv2.__version__) >= parse_version('3')
+    import numpy
 except Exception, e:
     logging.error("OpenCV is not available on your system.  The Movie (mp4) support is unavailable")
 
@@ -30,6 +33,12 @@ def capPropId(prop):
 def getColorProp():
   return cv2.cv.CV_BGR2RGB if not OPCV3 else cv2.COLOR_BGR2RGB
 
+def getAlphaColorProp():
+  return cv2.cv.CV_BGR2RGBA if not OPCV3 else cv2.COLOR_BGR2RGBA
+
+transparent_colors = {'blacksrc': (0,0,0), 'greensrc': (0,255,0), 'magentasrc': (255,0,255)}
+"""The color each transparency op turns transparent."""
+
 class Movie(object):
     """An ordered collection of :class:`~procgame.dmd.Frame` objects."""
     
@@ -65,5 +74,173 @@ class Movie(object):
     def __del__(self):
         if self.vc != None:
             self.vc.release()
-        
 
+class MovieDecoder(object):
+    """Reads and converts the frames of a :class:`Movie` on a worker thread, ahead of the
+    game thread showing them.
+
+    The frames are decoded into a ring of *buffers* preallocated arrays: the worker takes a
+    free buffer, fills it with the next frame (RGB, or RGBA with the color of *composite_op*
+    made transparent) and queues it; the game thread takes it with :meth:`next` and gives it
+    back with :meth:`release` once it is uploaded.  When every buffer is waiting to be shown
+    the worker waits, so at most *buffers* frames are decoded ahead.
+
+    Frames are numbered from 0 from the last :meth:`restart`.  With :attr:`loop` the worker
+    goes back to the first frame of the movie after the last one and the numbers keep
+    growing; otherwise it queues an end marker and waits for a restart.
+
+    The decoder owns :attr:`Movie.vc` once created: nothing else may read, seek or release it
+    until :meth:`close` returns ``True``.
+    """
+
+    def __init__(self, movie, buffers=4, composite_op=None, loop=False):
+        super(MovieDecoder, self).__init__()
+        self.movie = movie
+        self.loop = loop
+        """``True`` to go on with the first frame after the last one."""
+        self.key_color = transparent_colors.get(composite_op)
+        if composite_op not in (None, "None") and self.key_color is None:
+            raise ValueError, "Composite_op '%s' not recognized/supported." % composite_op
+        self.mode = 'RGB' if self.key_color is None else 'RGBA'
+        """The byte order of the pixels in the buffers, ``RGB`` or ``RGBA``."""
+        self.pitch = movie.width * len(self.mode)
+        self.frame_count = movie.frame_count
+        """The number of frames of the movie, lowered if reading the movie stops before."""
+        self.dropped = 0
+        """Number of decoded frames :meth:`next` skipped because a later frame was due."""
+
+        self.free = Queue.Queue()
+        for i in range(buffers):
+            self.free.put(numpy.empty((movie.height, movie.width, len(self.mode)), numpy.uint8))
+        self.decoded = Queue.Queue()
+        self.pending = None
+        self.generation = 0
+        self.taken = 0
+
+        self.condition = threading.Condition()
+        self.seek_to = 0
+        self.running = True
+        self.release_capture = False
+        """``True`` to release :attr:`Movie.vc` when the worker thread stops."""
+        self.thread = threading.Thread(target=self.run, name='MovieDecoder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def restart(self):
+        """Starts decoding again from the first frame, numbered 0.  Frames decoded before are discarded."""
+        if self.taken == 0 and self.pending is None:
+            return # nothing was shown since the last restart: the frames queued are the right ones
+        with self.condition:
+            self.generation += 1
+            self.seek_to = 0
+            self.condition.notify()
+        self.taken = 0
+        self.pending = None
+        self.discard()
+
+    def discard(self):
+        while True:
+            try:
+                (generation, number, index, buf) = self.decoded.get_nowait()
+            except Queue.Empty:
+                return
+            self.release(buf)
+
+    def next(self, number):
+        """Returns ``(index in the movie, buffer)`` of the frame *number*, or ``None`` if it is not
+        decoded yet.  Earlier frames still queued are dropped.  After the last frame of a movie
+        that does not :attr:`loop` the buffer is ``None``.  Called on the game thread."""
+        while True:
+            item = self.pending
+            self.pending = None
+            if item is None:
+                try:
+                    item = self.decoded.get_nowait()
+                except Queue.Empty:
+                    return None
+            (generation, item_number, index, buf) = item
+            if generation != self.generation:
+                self.release(buf)
+            elif item_number < number:
+                if buf is not None:
+                    self.dropped += 1
+                self.taken += 1
+                self.release(buf)
+            elif item_number > number:
+                self.pending = item
+                return None
+            else:
+                self.taken += 1
+                return (index, buf)
+
+    def release(self, buf):
+        """Gives the buffer returned by :meth:`next` back to the worker."""
+        if buf is not None:
+            self.free.put(buf)
+
+    def close(self, timeout=None):
+        """Stops the worker thread and waits up to *timeout* seconds (for good if ``None``) for it
+        to finish the frame it is decoding.  Returns ``True`` once the thread is done with
+        :attr:`Movie.vc`, ``False`` if it is still running (or if called on the worker thread
+        itself, by the garbage collector say)."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.free.put(None)
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def run(self):
+        vc = self.movie.vc
+        generation = 0
+        index = 0
+        number = 0
+        try:
+            while True:
+                buf = self.free.get()
+                with self.condition:
+                    while self.running and self.seek_to is None and index is None:
+                        self.condition.wait() # the movie ended, wait for a restart
+                    if not self.running or buf is None:
+                        return
+                    if self.seek_to is not None:
+                        vc.set(capPropId("POS_FRAMES"), self.seek_to)
+                        index = self.seek_to
+                        self.seek_to = None
+                        number = 0
+                        generation = self.generation
+
+                (index, number) = self.decode(vc, buf, generation, index, number)
+        finally:
+            if self.release_capture:
+                vc.release()
+                self.movie.vc = None
+
+    def decode(self, vc, buf, generation, index, number):
+        if index >= self.frame_count and self.loop and index > 0:
+            vc.set(capPropId("POS_FRAMES"), 0)
+            index = 0
+        rval = False
+        if index < self.frame_count:
+            (rval, image) = vc.read()
+            if not rval or image is None:
+                # end movie prematurely
+                self.frame_count = index
+                if self.loop and index > 0:
+                    vc.set(capPropId("POS_FRAMES"), 0)
+                    index = 0
+                    (rval, image) = vc.read()
+        if not rval or image is None:
+            self.free.put(buf)
+            self.decoded.put((generation, number, self.frame_count, None))
+            return (None, number)
+
+        if self.key_color is None:
+            cv2.cvtColor(image, getColorProp(), buf)
+        else:
+            cv2.cvtColor(image, getAlphaColorProp(), buf)
+            transparent = (buf[:,:,:3] == self.key_color).all(axis=2)
+            buf[:,:,3][transparent] = 0
+        self.decoded.put((generation, number, index, buf))
+        return (index + 1, number + 1)
@@ -2,7 +2,179 @@ import sys, random, os
 from dmd import Layer, Frame
 import sdl2
 from sdl2_displaymanager import sdl2_DisplayManager
-import time
+from procgame import clock
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PyVector(list):
+    """List with the element-wise arithmetic and comparisons the particle update kernels use,
+    so that the kernels run unchanged without NumPy.  Operands are vectors of the same
+    length or scalars."""
+
+    def __binary(self, other, op):
+        if isinstance(other, list):
+            return PyVector([op(u, v) for (u, v) in zip(self, other)])
+        return PyVector([op(u, other) for u in self])
+
+    def __add__(self, other): return self.__binary(other, lambda u, v: u + v)
+    def __radd__(self, other): return self.__binary(other, lambda u, v: v + u)
+    def __sub__(self, other): return self.__binary(other, lambda u, v: u - v)
+    def __rsub__(self, other): return self.__binary(other, lambda u, v: v - u)
+    def __mul__(self, other): return self.__binary(other, lambda u, v: u * v)
+    def __rmul__(self, other): return self.__binary(other, lambda u, v: v * u)
+    def __div__(self, other): return self.__binary(other, lambda u, v: u / v)
+    def __truediv__(self, other): return self.__binary(other, lambda u, v: u / v)
+    def __lt__(self, other): return self.__binary(other, lambda u, v: u < v)
+    def __le__(self, other): return self.__binary(other, lambda u, v: u <= v)
+    def __gt__(self, other): return self.__binary(other, lambda u, v: u > v)
+    def __ge__(self, other): return self.__binary(other, lambda u, v: u >= v)
+
+
+class PythonArrays(object):
+    """Array operations of the particle update kernels on :class:`PyVector` lists."""
+
+    name = 'python'
+
+    def full(self, n, value):
+        return PyVector([value] * n)
+
+    def randint(self, low, high, n):
+        """*n* random integers between *low* and *high* inclusive, like :func:`random.randint`."""
+        return PyVector([random.randint(low, high) for i in xrange(n)])
+
+    def where(self, cond, a, b):
+        n = len(cond)
+        if not isinstance(a, list):
+            a = [a] * n
+        if not isinstance(b, list):
+            b = [b] * n
+        return PyVector([u if c else v for (c, u, v) in zip(cond, a, b)])
+
+    def trunc(self, v):
+        """Truncates every element to an int, like :func:`int`."""
+        return PyVector([int(u) for u in v])
+
+    def concatenate(self, a, b):
+        return PyVector(list.__add__(a, b))
+
+    def tolist(self, v):
+        return v
+
+    def compact(self, store):
+        # swap-remove every dead particle: the last particle takes its place
+        columns = [getattr(store, field) for field in store.fields]
+        life = store.life
+        (i, n) = (0, store.n)
+        while i < n:
+            if life[i] <= 0:
+                n -= 1
+                for column in columns:
+                    column[i] = column[n]
+            else:
+                i += 1
+        for column in columns:
+            del column[n:]
+        store.n = n
+
+
+class NumpyArrays(object):
+    """Array operations of the particle update kernels on NumPy arrays."""
+
+    name = 'numpy'
+
+    def full(self, n, value):
+        return numpy.full(n, value)
+
+    def randint(self, low, high, n):
+        """*n* random integers between *low* and *high* inclusive, like :func:`random.randint`."""
+        return numpy.random.randint(low, high + 1, n)
+
+    def where(self, cond, a, b):
+        return numpy.where(cond, a, b)
+
+    def trunc(self, v):
+        """Truncates every element to an int, like :func:`int`."""
+        return numpy.trunc(v).astype(int)
+
+    def concatenate(self, a, b):
+        return numpy.concatenate((a, b))
+
+    def tolist(self, v):
+        return v.tolist()
+
+    def compact(self, store):
+        alive = store.life > 0
+        n = int(numpy.count_nonzero(alive))
+        if n == store.n:
+            return
+        for field in store.fields:
+            setattr(store, field, getattr(store, field)[alive])
+        store.n = n
+
+
+python_arrays = PythonArrays()
+numpy_arrays = NumpyArrays() if numpy is not None else None
+
+
+class ParticleStore(object):
+    """Particles of an emitter kept as a structure of arrays, one array per field,
+    updated a whole array at a time by the ``*_block`` kernels of the particle classes.
+
+    *xp* is the array implementation, :data:`numpy_arrays` or :data:`python_arrays`."""
+
+    fields = ('x', 'y', 'dx', 'dy', 'life', 'r', 'g', 'b', 'a')
+
+    def __init__(self, xp, n=0, x=0, y=0):
+        super(ParticleStore, self).__init__()
+        self.xp = xp
+        self.n = n
+        for field in self.fields:
+            setattr(self, field, xp.full(n, 0))
+        self.x = xp.full(n, x)
+        self.y = xp.full(n, y)
+
+    def __len__(self):
+        return self.n
+
+    def extend(self, other):
+        for field in self.fields:
+            setattr(self, field, self.xp.concatenate(getattr(self, field), getattr(other, field)))
+        self.n += other.n
+
+    def compact(self):
+        """Removes the particles whose life is over."""
+        self.xp.compact(self)
+
+    def clear(self):
+        self.__init__(self.xp)
+
+    def rows(self):
+        """Returns a list of (x, y, life, r, g, b, a) tuples, one per particle."""
+        tolist = self.xp.tolist
+        return zip(tolist(self.x), tolist(self.y), tolist(self.life), tolist(self.r), tolist(self.g), tolist(self.b), tolist(self.a))
+
+
+def defining_class(cls, name):
+    for c in cls.__mro__:
+        if name in c.__dict__:
+            return c
+    return None
+
+def has_block_kernels(particle_class):
+    """Returns True if every per-particle method of *particle_class* has its ``*_block`` kernel
+    defined by the same class or a subclass, i.e. if the kernels describe the particle
+    behaviour faithfully.  A subclass that only overrides, say, ``update_location()``
+    must be run as :class:`Particle` objects."""
+    for (method, kernel) in [('__init__', 'init_block'), ('update', 'update_block'),
+                             ('update_location', 'update_location_block'), ('update_appearance', 'update_appearance_block')]:
+        kernel_owner = defining_class(particle_class, kernel)
+        if kernel_owner is None or not issubclass(kernel_owner, defining_class(particle_class, method)):
+            return False
+    return True
+
 
 class Particle(object):
     def __init__(self, x, y, emitter):
@@ -82,6 +254,41 @@ class Particle(object):
         self.a = ((self.life/float(self.parent.max_life)) * 255)
         #print("Life=%d, Alpha=%d" % (self.life, self.a))
 
+    # The *_block class methods are the methods above applied to a whole ParticleStore *p*
+    # at once; ParticleEmitter uses them instead of Particle objects.
+
+    @classmethod
+    def init_block(cls, p, emitter):
+        xp = p.xp
+        p.life = xp.randint(int(emitter.max_life*0.80), emitter.max_life, p.n)
+        p.dx = xp.randint(-5, 5, p.n)
+        p.dy = xp.randint(-5, 5, p.n)
+        p.r = xp.full(p.n, 255)
+        p.g = xp.full(p.n, 255)
+        p.b = xp.full(p.n, 255)
+        p.a = xp.full(p.n, 255)
+
+    @classmethod
+    def update_block(cls, p, emitter):
+        p.life = p.life - 1
+
+        cls.update_location_block(p, emitter)
+        cls.update_appearance_block(p, emitter)
+
+    @classmethod
+    def update_location_block(cls, p, emitter):
+        p.x = p.xp.trunc(p.x + p.dx)
+        p.y = p.xp.trunc(p.y + p.dy)
+
+    @classmethod
+    def update_appearance_block(cls, p, emitter):
+        xp = p.xp
+        fading = p.life < .8 * emitter.max_life
+        p.b = xp.where(fading, 0, p.b)
+        p.g = xp.where(fading, xp.trunc(p.life/float(emitter.max_life) * 220) + 35, p.g)
+
+        p.a = ((p.life/float(emitter.max_life)) * 255)
+
 class SnowParticle(Particle):
     def __init__(self, x, y, emitter):
         self.x = x + random.randint(-450,450)
@@ -105,6 +312,24 @@ class SnowParticle(Particle):
         # self.a = ((self.life/float(self.parent.max_life)) * 255)
         #print("Life=%d, Alpha=%d" % (self.life, self.a))
 
+    @classmethod
+    def init_block(cls, p, emitter):
+        p.x = p.x + p.xp.randint(-450, 450, p.n)
+        super(SnowParticle, cls).init_block(p, emitter)
+        p.r = p.xp.full(p.n, 225)
+        p.g = p.xp.full(p.n, 225)
+        p.b = p.xp.full(p.n, 255)
+
+    @classmethod
+    def update_location_block(cls, p, emitter):
+        p.dx = p.xp.randint(-20, 20, p.n)
+        p.dy = p.xp.randint(0, 20, p.n)
+        super(SnowParticle, cls).update_location_block(p, emitter)
+
+    @classmethod
+    def update_appearance_block(cls, p, emitter):
+        pass
+
 
 class FireParticle(Particle):
     def __init__(self, x, y, emitter):
@@ -117,6 +342,18 @@ class FireParticle(Particle):
         self.dy = random.randint(-5,1)
         super(FireParticle, self).update_location()
 
+    @classmethod
+    def init_block(cls, p, emitter):
+        super(FireParticle, cls).init_block(p, emitter)
+        p.dx = p.xp.randint(-5, 5, p.n)
+        p.dy = p.xp.randint(-4, 4, p.n)
+
+    @classmethod
+    def update_location_block(cls, p, emitter):
+        p.dx = p.xp.randint(-3, 3, p.n)
+        p.dy = p.xp.randint(-5, 1, p.n)
+        super(FireParticle, cls).update_location_block(p, emitter)
+
 class FireworkParticle(Particle):
     def __init__(self, x, y, emitter):
         super(FireworkParticle, self).__init__(x,y,emitter)
@@ -136,8 +373,37 @@ class FireworkParticle(Particle):
             self.b = int(self.life/float(self.parent.max_life) * 220) + 35
             self.r = self.b
 
+    @classmethod
+    def init_block(cls, p, emitter):
+        super(FireworkParticle, cls).init_block(p, emitter)
+        p.dy = p.xp.randint(-5, 3, p.n)
+        p.dx = p.xp.randint(-10, 10, p.n)
+        p.a = p.xp.full(p.n, 192)
+
+    @classmethod
+    def update_location_block(cls, p, emitter):
+        falling = p.life < .75 * emitter.max_life
+        p.dy = p.xp.where(falling, 3, p.dy)
+        p.dx = p.xp.where(falling, 0, p.dx)
+        super(FireworkParticle, cls).update_location_block(p, emitter)
+
+    @classmethod
+    def update_appearance_block(cls, p, emitter):
+        xp = p.xp
+        fading = p.life < .8 * emitter.max_life
+        p.g = xp.where(fading, 0, p.g)
+        p.b = xp.where(fading, xp.trunc(p.life/float(emitter.max_life) * 220) + 35, p.b)
+        p.r = xp.where(fading, p.b, p.r)
+
 class ParticleEmitter(object):
-    def __init__(self, x, y, max_life=60, max_particles=200, particles_per_update=5, total_creations=None, particle_class=Particle, random_next=False, dx=0, dy=0):
+    """Creates, moves and draws particles of the given *particle_class*.
+
+    The particles are kept in a :class:`ParticleStore` and updated by the ``*_block`` kernels of
+    *particle_class*, with NumPy when it is installed.  *engine* forces ``'numpy'``, ``'python'``
+    (the same kernels on lists) or ``'objects'`` (one :class:`Particle` instance per particle, the
+    only choice for particle classes without kernels, see :func:`has_block_kernels`)."""
+
+    def __init__(self, x, y, max_life=60, max_particles=200, particles_per_update=5, total_creations=None, particle_class=Particle, random_next=False, dx=0, dy=0, engine=None):
         self.x = x
         self.y = y
         self.orig_x = x
@@ -149,7 +415,21 @@ class ParticleEmitter(object):
         self.particle_class = particle_class
         self.random_next = random_next
 
-        self.particles = list()
+        if(engine is None):
+            if not has_block_kernels(particle_class):
+                engine = 'objects'
+            elif numpy_arrays is not None:
+                engine = 'numpy'
+            else:
+                engine = 'python'
+        if(engine == 'numpy' and numpy_arrays is None):
+            raise ValueError, "The numpy particle engine needs NumPy, which is not installed."
+        if(engine != 'objects' and not has_block_kernels(particle_class)):
+            raise ValueError, "%s has no block kernels for its particle behaviour; use the 'objects' engine." % (particle_class.__name__)
+        self.engine = engine
+        self.xp = {'numpy':numpy_arrays, 'python':python_arrays}.get(engine)
+
+        self.particles = self.new_particles()
         self.particles_per_update = particles_per_update
         self.max_particles = max_particles
         self.max_life = max_life
@@ -157,16 +437,20 @@ class ParticleEmitter(object):
         self.creations_remaining = total_creations
         self.stopped = False
 
-        for i in range(0,particles_per_update):
-            p = self.particle_class(x,y, emitter=self)
-            p.update()
-            self.particles.append(p)
+        self.create_particles(x, y, particles_per_update)
         
         if(self.total_creations is not None):
             self.creations_remaining = self.creations_remaining - particles_per_update
         else:
             self.creations_remaining = self.max_particles
 
+        self.txImg8 = None
+        self.txImg16 = None
+
+    def load_textures(self):
+        if(self.txImg8 is not None):
+            return
+
         cwd = os.path.dirname(__file__)
         sprImg8 = sdl2_DisplayManager.inst().load_surface(os.path.join(cwd,"exp8.png"))
         sprImg16 = sdl2_DisplayManager.inst().load_surface(os.path.join(cwd,"exp16.png"))
@@ -177,12 +461,32 @@ class ParticleEmitter(object):
         (self.p8_w,self.p8_h) = self.txImg8.size
         (self.p16_w,self.p16_h) = self.txImg16.size
 
-        sdl2.SDL_SetTextureBlendMode(self.txImg8.texture, sdl2.SDL_BLENDMODE_BLEND)
-        sdl2.SDL_SetTextureBlendMode(self.txImg16.texture, sdl2.SDL_BLENDMODE_BLEND)
+        sdl2_DisplayManager.inst().set_texture_blendmode(self.txImg8, 'BLEND')
+        sdl2_DisplayManager.inst().set_texture_blendmode(self.txImg16, 'BLEND')
 
         del sprImg8
         del sprImg16
 
+    def new_particles(self):
+        if(self.xp is None):
+            return list()
+        return ParticleStore(self.xp)
+
+    def create_particles(self, x, y, count):
+        """Adds *count* new particles at (*x*, *y*), each updated once, as :class:`Particle` used to on creation."""
+        if(count <= 0):
+            return
+        if(self.xp is None):
+            for i in range(0,count):
+                p = self.particle_class(x,y, emitter=self)
+                p.update()
+                self.particles.append(p)
+        else:
+            block = ParticleStore(self.xp, count, x, y)
+            self.particle_class.init_block(block, self)
+            self.particle_class.update_block(block, self)
+            self.particles.extend(block)
+
     def reset(self, new_x=None, new_y=None):
         self.stopped = False
         if(new_x is not None):
@@ -195,24 +499,20 @@ class ParticleEmitter(object):
         else:
             self.y = self.orig_y
 
-        for x in xrange(len(self.particles)-1,0,-1):
-            p = self.particles[x]
-            self.particles.remove(p)
-            del p
+        self.particles = self.new_particles()
         self.creations_remaining = self.total_creations
 
     def update(self):
         if(self.total_creations is None) and (not self.stopped):
             self.creations_remaining = self.max_particles
 
-        for p in self.particles:
-            p.update()
-
-        for x in xrange(len(self.particles)-1,-1,-1):
-            p = self.particles[x]
-            if(p.life <= 0):
-                self.particles.remove(p)
-                del p
+        if(self.xp is None):
+            for p in self.particles:
+                p.update()
+            self.particles = [p for p in self.particles if p.life > 0]
+        else:
+            self.particle_class.update_block(self.particles, self)
+            self.particles.compact()
 
         if(self.stopped):
             return
@@ -223,11 +523,9 @@ class ParticleEmitter(object):
                     self.reset(new_x = random.randint(0,200), new_y = random.randint(0,200))
             return
             
-        for r in range(0,min(self.particles_per_update, self.max_particles-len(self.particles), self.creations_remaining)):
-            p = self.particle_class(self.x, self.y, emitter=self)
-            p.update()
-            self.particles.append(p)
-            self.creations_remaining = self.creations_remaining - 1
+        count = min(self.particles_per_update, self.max_particles-len(self.particles), self.creations_remaining)
+        self.create_particles(self.x, self.y, count)
+        self.creations_remaining = self.creations_remaining - max(count, 0)
 
         self.x = self.x + self.dx
         self.y = self.y + self.dy
@@ -236,37 +534,41 @@ class ParticleEmitter(object):
         self.creations_remaining = 0
         self.stopped = True
         if(immediate_stop):
-            for x in xrange(len(self.particles)-1,-1,-1):
-                p = self.particles[x]
-                self.particles.remove(p)
-                del p
+            self.particles = self.new_particles()
 
+    def rows(self):
+        """Returns a list of (x, y, life, r, g, b, a) tuples, one per particle."""
+        if(self.xp is None):
+            return [(p.x, p.y, p.life, p.r, p.g, p.b, p.a) for p in self.particles]
+        return self.particles.rows()
 
     def draw(self, destination_texture = None):
-        # for p in self.particles:
-        for x in xrange(0,len(self.particles)): #xrange(len(self.particles)-1,0,-1):
-            p = self.particles[x]
-            tx = None
-            if(p.life > self.max_life * 0.55):
-                tx = self.txImg16
-                (self.p_w, self.p_h) = (self.p16_w,self.p16_h)
-            else:
-                tx = self.txImg8
-                (self.p_w, self.p_h) = (self.p8_w,self.p8_h)
-
-            if(p.color_changed):
-                sdl2.SDL_SetTextureColorMod(tx.texture, p.r,p.g,p.b)
-                p.color_changed = False
-
-            # sdl2.SDL_SetTextureAlphaMod(tx.texture, 192) #int(p.a))
-            if(p.alpha_changed):
-                sdl2.SDL_SetTextureAlphaMod(tx.texture, int(p.a))
-                p.alpha_changed = False
-
-            if(destination_texture is None):
-                sdl2_DisplayManager.inst().screen_blit(tx, x=p.x, y=p.y, expand_to_fill=False)
-            else:
-                sdl2_DisplayManager.inst().blit(source_tx = tx, dest_tx=destination_texture, dest=(p.x,p.y,self.p_w, self.p_h))                
+        """Draws the particles in two passes, one per texture, so that drawing to *destination_texture*
+        is a single batch (see :meth:`sdl2_DisplayManager.begin_batch`) per texture."""
+        self.load_textures()
+        dm = sdl2_DisplayManager.inst()
+        rows = self.rows()
+        young = self.max_life * 0.55
+        passes = [(self.txImg16, self.p16_w, self.p16_h, [row for row in rows if row[2] > young]),
+                  (self.txImg8, self.p8_w, self.p8_h, [row for row in rows if row[2] <= young])]
+        for (tx, w, h, tx_rows) in passes:
+            if(len(tx_rows) == 0):
+                continue
+            if(destination_texture is not None):
+                dm.begin_batch(destination_texture)
+            color = getattr(tx, 'colormod', None)
+            for (x, y, life, r, g, b, a) in tx_rows:
+                if((r, g, b) != color):
+                    color = (r, g, b)
+                    sdl2.SDL_SetTextureColorMod(tx.texture, int(r), int(g), int(b))
+                dm.set_texture_alpha(tx, a)
+                if(destination_texture is None):
+                    dm.screen_blit(tx, x=x, y=y, expand_to_fill=False)
+                else:
+                    dm.blit(source_tx = tx, dest_tx=destination_texture, dest=(int(x),int(y),w, h))
+            tx.colormod = color
+            if(destination_texture is not None):
+                dm.end_batch()
 
 class ParticleSystem(object):
     def __init__(self, emitters=None, destination_texture=None):
@@ -311,8 +613,8 @@ class ParticleLayer(Layer):
     def next_frame(self):
         # Assign the new script item:
         if(self.start_time is None):
-            self.start_time = time.time()
-        elif(self.duration is not None and (self.start_time + self.duration > time.time())):
+            self.start_time = clock.now()
+        elif(self.duration is not None and (self.start_time + self.duration > clock.now())):
             return None
         self.stalls = self.stalls - 1
         if(self.stalls <= 0):
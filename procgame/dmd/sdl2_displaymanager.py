@@ -31,18 +31,100 @@ except ImportError:
 
 import ctypes
 import random 
+import weakref
 from sdl2 import endian, hints
 import time
+from procgame import config
 
 from ctypes import byref, cast, POINTER, c_int, c_float, sizeof, c_uint32, c_double
 
 
+class TexturePool(object):
+    """Render target textures given back with :meth:`release`, by size, for :meth:`acquire`
+    to hand out again instead of creating a new texture, one of the most expensive SDL calls.
+
+    At most *per_size* free textures of each size are kept (the ``texture_pool_size``
+    config key, 8); the others are left to the garbage collector.  The pool also counts
+    every texture made by the display manager that is still alive, pooled or not, and
+    their bytes (4 per dot): see :meth:`report`.  A count that keeps growing during a
+    session is a leak.
+
+    The pool is opt-in: it only reuses textures that someone gives back, through
+    :meth:`~procgame.dmd.Frame.release` or :meth:`sdl2_DisplayManager.release_texture`.
+    Today that happens in three places: the temporary frame of
+    :meth:`~procgame.dmd.Frame.tint`, and the old texture replaced by
+    :meth:`~procgame.dmd.Frame.scale` or by
+    :meth:`~procgame.dmd.Frame.build_surface_from_8bit_dmd_string`.  The frames made by
+    ``TextLayer.set_text``, :meth:`~procgame.dmd.Frame.copy`, ``MarkupFrameGenerator``
+    and most other code are handed out, so they are never released.  Their textures are
+    left to the garbage collector and are not reused."""
+
+    def __init__(self, per_size=8):
+        super(TexturePool, self).__init__()
+        self.per_size = per_size
+        self.free = {}
+        """Free textures, by (width, height)."""
+        self.live = {}
+        self.live_bytes = 0
+        self.peak_bytes = 0
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+        self.dropped = 0
+
+    def acquire(self, width, height):
+        """Returns a free texture of the given size, or ``None``."""
+        textures = self.free.get((width, height))
+        if not textures:
+            return None
+        self.reused += 1
+        return textures.pop()
+
+    def release(self, tx, width, height):
+        """Takes back *tx*, a render target texture of the given size no longer drawn or drawn into."""
+        self.released += 1
+        textures = self.free.setdefault((width, height), [])
+        if len(textures) >= self.per_size:
+            self.dropped += 1
+            return
+        textures.append(tx)
+
+    def track(self, tx, width, height):
+        """Counts *tx* among the live textures until it is garbage collected."""
+        size = width * height * 4
+        key = id(tx)
+        def gone(ref, key=key, size=size):
+            if self.live.pop(key, None) is not None:
+                self.live_bytes -= size
+        self.live[key] = weakref.ref(tx, gone)
+        self.live_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.live_bytes)
+        self.created += 1
+
+    def free_count(self):
+        return sum(len(textures) for textures in self.free.values())
+
+    def free_bytes(self):
+        return sum(w * h * 4 * len(textures) for ((w, h), textures) in self.free.items())
+
+    def report(self):
+        """Returns the statistics as a list of lines."""
+        return ["sdl textures: %d live, %0.1f MB (peak %0.1f MB), %d created" % (len(self.live), self.live_bytes / 1048576.0, self.peak_bytes / 1048576.0, self.created),
+                "sdl textures: %d pooled, %0.1f MB, %d reused, %d released, %d dropped" % (self.free_count(), self.free_bytes() / 1048576.0, self.reused, self.released, self.dropped)]
+
+
 # An SDL2 Display Helper ; Somewhat PyGame like 
 
 # class DisplayObject(sdl2.ext.TextureSprite):
 
 SDL2_DM = None
 
+BLENDMODES = {
+    'ADD': sdl2.SDL_BLENDMODE_ADD,
+    'MOD': sdl2.SDL_BLENDMODE_MOD,
+    'BLEND': sdl2.SDL_BLENDMODE_BLEND,
+}
+
 class FontManagerExtended(sdl2.ext.FontManager):
     """ this clas serves to add a few useful features to the default (py)SDL2 FontManager """
 
@@ -125,6 +207,10 @@ class FontManagerExtended(sdl2.ext.FontManager):
             self.close()
 
 class sdl2_DisplayManager(object):
+
+    batching = True
+    """ if False, begin_batch() and end_batch() do nothing and every blit() switches the render target itself """
+
     def __init__(self, dots_w, dots_h, scale=1, title="PyProcGameHD", screen_position_x=0,screen_position_y=0, flags=None, blur="0"):
         self.dots_w = dots_w
         self.dots_h = dots_h
@@ -157,6 +243,11 @@ class sdl2_DisplayManager(object):
         self.factory = sdl2.ext.SpriteFactory(renderer=self.texture_renderer)  
         self.font_manager = None
 
+        self.batch_target = None # texture the renderer is already pointed at, see begin_batch()
+        self.batch_stack = []
+
+        self.texture_pool = TexturePool(config.value_for_key_path('texture_pool_size', 8))
+
     def show_window(self, show=True):
         if(show):
             self.window.show()
@@ -240,9 +331,7 @@ class sdl2_DisplayManager(object):
 
         self.blit(txA, t, (0,0,width,height))
 
-        ret = sdl2.SDL_SetTextureBlendMode(txB.texture, sdl2.SDL_BLENDMODE_MOD) # apply mod to 'source'
-        if ret == -1:
-            raise sdl2.ext.SDLError()
+        self.set_texture_blendmode(txB, 'MOD') # apply mod to 'source'
 
         # SDL_BLENDMODE_MOD a/k/a color modulate
         # dstRGB = srcRGB * dstRGB
@@ -253,7 +342,7 @@ class sdl2_DisplayManager(object):
 
         self.blit(txB, t, (0,0,width,height)) # draw B on t
 
-        sdl2.SDL_SetTextureBlendMode(txB.texture, sdl2.SDL_BLENDMODE_BLEND)
+        self.set_texture_blendmode(txB, 'BLEND')
 
         return t
 
@@ -269,9 +358,7 @@ class sdl2_DisplayManager(object):
 
         self.blit(txB, t, (0,0,width,height)) # blits B into t
 
-        ret = sdl2.SDL_SetTextureBlendMode(txC.texture, sdl2.SDL_BLENDMODE_MOD) # apply mod to 'source'
-        if ret == -1:
-            raise sdl2.ext.SDLError()
+        self.set_texture_blendmode(txC, 'MOD') # apply mod to 'source'
 
         self.blit(txC, t, (0,0,width,height)) # draw C on t
 
@@ -287,38 +374,47 @@ class sdl2_DisplayManager(object):
         return t
 
     def font_render_bordered_text_Faster(self, txtarget, dst_loc, msg, font_alias=None, size=None, width=None, color=None, bg_color=None, border_width=1, border_color=None):
+        rendered = self.font_render_bordered_textures(msg, font_alias=font_alias, size=size, width=width, color=color, bg_color=bg_color, border_width=border_width, border_color=border_color)
+        return self.blit_bordered_text(txtarget, dst_loc, rendered, border_width)
+
+    def font_render_bordered_textures(self, msg, font_alias=None, size=None, width=None, color=None, bg_color=None, border_width=1, border_color=None):
+        """ renders msg with a border and returns (outline texture, interior texture, outline size, interior size),
+            ready to be drawn by blit_bordered_text() as many times as needed
+        """
         # create outline, interior
         (srf_outline, srf_interior) = self.font_manager.render_border(msg, alias=font_alias, size=size, width=width, color=color, bg_color=bg_color, border_width=border_width, border_color=border_color)
         tx_outline = self.texture_from_surface(srf_outline)  # make outline texture
         tx_interior = self.texture_from_surface(srf_interior) # make interior texture
 
         if(len(border_color)==4):
-            ret = sdl2.SDL_SetTextureAlphaMod(tx_outline.texture, int(border_color[3]))            
-            if ret == -1:
-                raise sdl2.ext.SDLError()
+            self.set_texture_alpha(tx_outline, border_color[3])
 
         if(len(color)==4):
-            ret = sdl2.SDL_SetTextureAlphaMod(tx_interior.texture, int(color[3]))            
-            if ret == -1:
-                raise sdl2.ext.SDLError()
+            self.set_texture_alpha(tx_interior, color[3])
 
-        # blit the outline, then the interior
-        # blit(source_tx, dest_tx, dest_loc)
-        self.blit(tx_outline, txtarget, (dst_loc['x'] + 0, dst_loc['y'] + 0, srf_outline.w, srf_outline.h))
-        self.blit(tx_interior, txtarget, (dst_loc['x'] +border_width, dst_loc['y'] +border_width, srf_interior.w, srf_interior.h))
+        rendered = (tx_outline, tx_interior, (int(srf_outline.w), int(srf_outline.h)), (int(srf_interior.w), int(srf_interior.h)))
 
         sdl2.surface.SDL_FreeSurface(srf_interior)
         sdl2.surface.SDL_FreeSurface(srf_outline)
 
-        w = int(srf_outline.w)
-
         del srf_interior
         del srf_outline
-        del tx_interior
-        del tx_outline
 
-        return w
-    
+        return rendered
+
+    def blit_bordered_text(self, txtarget, dst_loc, rendered, border_width):
+        """ draws text returned by font_render_bordered_textures() on txtarget and returns its width """
+        (tx_outline, tx_interior, (ow, oh), (iw, ih)) = rendered
+
+        # blit the outline, then the interior
+        # blit(source_tx, dest_tx, dest_loc)
+        self.begin_batch(txtarget)
+        self.blit(tx_outline, txtarget, (dst_loc['x'] + 0, dst_loc['y'] + 0, ow, oh))
+        self.blit(tx_interior, txtarget, (dst_loc['x'] +border_width, dst_loc['y'] +border_width, iw, ih))
+        self.end_batch()
+
+        return ow
+
     def Init(dots_w, dots_h, scale=1, title="ppgHD", x=0, y=0, flags=None, blur="0"):
         global SDL2_DM 
         SDL2_DM = sdl2_DisplayManager(dots_w, dots_h, scale, title, x, y, flags, blur)
@@ -343,9 +439,11 @@ class sdl2_DisplayManager(object):
         (The size of the destination rectangle does not effect the blit).
         An optional area rectangle can be passed as well. This represents a smaller portion of the source_tx Surface to draw.    
         """
-        # 1) backup the renderer's destination 
-        bk = sdl2.SDL_GetRenderTarget(self.texture_renderer.renderer)
-        sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, dest_tx.texture)
+        # 1) backup the renderer's destination, unless a batch already points the renderer at it
+        batched = dest_tx is self.batch_target
+        if not batched:
+            bk = sdl2.SDL_GetRenderTarget(self.texture_renderer.renderer)
+            sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, dest_tx.texture)
 
         # 2) copmpute locations:
         ###(sw, sh) = source_tx.size
@@ -359,27 +457,65 @@ class sdl2_DisplayManager(object):
         dstrect = dest ###(dest[0], dest[1], sw, sh)
 
         if(blendmode is not None):
-            if(blendmode == 'ADD'):
-                ret = sdl2.SDL_SetTextureBlendMode(source_tx.texture, sdl2.SDL_BLENDMODE_ADD) 
-            elif(blendmode == 'MOD'):
-                ret = sdl2.SDL_SetTextureBlendMode(source_tx.texture, sdl2.SDL_BLENDMODE_MOD) 
-            elif(blendmode == 'BLEND'):
-                ret = sdl2.SDL_SetTextureBlendMode(source_tx.texture, sdl2.SDL_BLENDMODE_BLEND) 
-            else:
-                ret = sdl2.SDL_SetTextureBlendMode(source_tx.texture, sdl2.SDL_BLENDMODE_NONE) 
-            if ret == -1:
-                raise sdl2.ext.SDLError()
+            self.set_texture_blendmode(source_tx, blendmode)
 
         if(alpha is not None):
-            ret = sdl2.SDL_SetTextureAlphaMod(source_tx.texture, int(alpha))            
-            if ret == -1:
-                raise sdl2.ext.SDLError()
+            self.set_texture_alpha(source_tx, alpha)
         #3) Draw!
         self.texture_renderer.copy(source_tx, srcrect=area, dstrect=dstrect)
 
         #4) Restore renderer's texture target
+        if not batched:
+            sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, bk) # revert back
+
+    def begin_batch(self, dest_tx):
+        """ points the renderer at dest_tx until the matching end_batch(), so that
+            every blit() to dest_tx in between skips saving, switching and restoring
+            the render target.  Blits to other textures (and anything else that
+            switches the target) still work and put dest_tx back when done.
+            Batches nest; each end_batch() returns to the enclosing batch's target.
+        """
+        if not self.batching:
+            self.batch_stack.append(None)
+            return
+        bk = sdl2.SDL_GetRenderTarget(self.texture_renderer.renderer)
+        self.batch_stack.append((bk, self.batch_target))
+        sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, dest_tx.texture)
+        self.batch_target = dest_tx
+
+    def end_batch(self):
+        """ ends the innermost batch started by begin_batch() and restores the previous render target """
+        entry = self.batch_stack.pop()
+        if entry is None:
+            return
+        (bk, self.batch_target) = entry
         sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, bk) # revert back
 
+    def set_texture_blendmode(self, tx, blendmode):
+        """ sets the blend mode ('ADD', 'MOD', 'BLEND' or anything else for NONE) used when tx is the source of a copy.
+            The mode last set through this method is remembered on tx and the SDL call is skipped when it would not
+            change anything, so SDL_SetTextureBlendMode should not be called directly on textures drawn with blit().
+        """
+        mode = BLENDMODES.get(blendmode, sdl2.SDL_BLENDMODE_NONE)
+        if getattr(tx, 'blendmode', None) == mode:
+            return
+        ret = sdl2.SDL_SetTextureBlendMode(tx.texture, mode)
+        if ret == -1:
+            raise sdl2.ext.SDLError()
+        tx.blendmode = mode
+
+    def set_texture_alpha(self, tx, alpha):
+        """ sets the alpha modulation (0-255) used when tx is the source of a copy, skipping the SDL call when
+            the value is already in effect -- see set_texture_blendmode()
+        """
+        alpha = int(alpha)
+        if getattr(tx, 'alphamod', None) == alpha:
+            return
+        ret = sdl2.SDL_SetTextureAlphaMod(tx.texture, alpha)
+        if ret == -1:
+            raise sdl2.ext.SDLError()
+        tx.alphamod = alpha
+
     def roto_blit(self, source_tx, dest_tx, dest, area=None, angle=0, origin = None, flip=0):
         """ a blit function, backed by RenderCopy, that emulates PyGame 1.9.2 style blitting 
         def blit(source_tx, dest_tx, area=None, special_flags = 0) 
@@ -557,6 +693,7 @@ class sdl2_DisplayManager(object):
         if not texture:
             raise sdl2.ext.SDLError()
         t = sdl2.ext.TextureSprite(texture.contents)
+        self.texture_pool.track(t, *t.size)
 
         if(tsurface):
             sdl2.surface.SDL_FreeSurface(tsurface)
@@ -640,7 +777,10 @@ class sdl2_DisplayManager(object):
         del tsurface
         return tx
 
-    def make_bits_from_texture(self, texture, width, height, mode="RGBA"):
+    def make_bits_from_texture(self, texture, width, height, mode="RGBA", bucket=None):
+        """Reads back the pixels of *texture* in *mode* and returns a pointer to them.  They are
+        read into *bucket*, a ctypes string buffer of at least height*width*bytes per pixel, if given
+        so a caller doing this every frame can reuse the same buffer."""
         bk = sdl2.SDL_GetRenderTarget(self.texture_renderer.renderer)
         sdl2.SDL_SetRenderTarget(self.texture_renderer.renderer, texture)
 
@@ -684,7 +824,8 @@ class sdl2_DisplayManager(object):
             raise ValueError, "Format not supported"
 
         clip_r = sdl2.rect.SDL_Rect(0,0,width,height)
-        bucket = ctypes.create_string_buffer(height*pitch*chr(128))
+        if bucket is None:
+            bucket = ctypes.create_string_buffer(height*pitch*chr(128))
         pxbuf = ctypes.cast(bucket, ctypes.POINTER(ctypes.c_uint8))
 
         ret = sdl2.render.SDL_RenderReadPixels(
@@ -759,7 +900,56 @@ class sdl2_DisplayManager(object):
 
         self.texture_clear(t, color)
         #print("New texture created: %s " % t.contents)
-        return sdl2.ext.TextureSprite(t.contents)
+        tx = sdl2.ext.TextureSprite(t.contents)
+        tx.blendmode = sdl2.SDL_BLENDMODE_BLEND
+        self.texture_pool.track(tx, width, height)
+        return tx
+
+    def acquire_texture(self, width, height, color=(0,0,0,0)):
+        """ returns a render target texture like new_texture(), reusing one given back with release_texture()
+        when there is one of that size; it is cleared to color and blends normally at full alpha """
+        tx = self.texture_pool.acquire(width, height)
+        if tx is None:
+            return self.new_texture(width, height, color)
+        self.set_texture_blendmode(tx, 'BLEND')
+        self.set_texture_alpha(tx, 255)
+        self.texture_clear(tx, color)
+        return tx
+
+    def release_texture(self, tx, width, height):
+        """ gives back a texture of the given size made by acquire_texture() or new_texture(), for acquire_texture()
+        to hand out again; nothing may draw it or draw into it afterwards """
+        self.texture_pool.release(tx, width, height)
+
+    def new_streaming_texture(self, width, height, mode="RGB"):
+        """ creates a texture whose pixels are replaced often (every frame of a movie) with
+        update_texture(); mode is "RGB" or "RGBA", the byte order of the pixels given to it """
+        if mode == "RGB":
+            pixel_format = sdl2.pixels.SDL_PIXELFORMAT_RGB24
+        elif mode == "RGBA":
+            if endian.SDL_BYTEORDER == endian.SDL_LIL_ENDIAN:
+                pixel_format = sdl2.pixels.SDL_PIXELFORMAT_ABGR8888
+            else:
+                pixel_format = sdl2.pixels.SDL_PIXELFORMAT_RGBA8888
+        else:
+            raise ValueError, "Format not supported"
+
+        t = sdl2.render.SDL_CreateTexture(self.texture_renderer.renderer, pixel_format,
+                                          sdl2.render.SDL_TEXTUREACCESS_STREAMING,
+                                          width, height)
+        if not t:
+            raise sdl2.ext.SDLError()
+        sdl2.SDL_SetTextureBlendMode(t, sdl2.SDL_BLENDMODE_BLEND)
+        tx = sdl2.ext.TextureSprite(t.contents)
+        tx.blendmode = sdl2.SDL_BLENDMODE_BLEND
+        self.texture_pool.track(tx, width, height)
+        return tx
+
+    def update_texture(self, texture, bits, pitch):
+        """ replaces all the pixels of a texture made by new_streaming_texture() with bits,
+        a pointer to height rows of pitch bytes """
+        if sdl2.render.SDL_UpdateTexture(texture.texture, None, bits, pitch) != 0:
+            raise sdl2.ext.SDLError()
 
 
     def texture_from_surface(self, surface):
@@ -771,6 +961,7 @@ class sdl2_DisplayManager(object):
         if not texture:
             raise sdl2.ext.SDLError()
         t = sdl2.ext.TextureSprite(texture.contents)
+        self.texture_pool.track(t, *t.size)
 
         #sdl2.surface.SDL_FreeSurface(surface)
         #del surface
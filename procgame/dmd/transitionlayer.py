@@ -76,7 +76,9 @@ class TransitionLayer(Layer):
 
     LENGTH_IN_FRAMES = 30
 
-    def __init__(self, layerA=None, layerB=None, transitionType=TYPE_PUSH, transitionParameter=None, lengthInFrames=LENGTH_IN_FRAMES,callback = None, width=DMD_WIDTH, height=DMD_HEIGHT):
+    def __init__(self, layerA=None, layerB=None, transitionType=TYPE_PUSH, transitionParameter=None, lengthInFrames=LENGTH_IN_FRAMES,callback = None, width=DMD_WIDTH, height=DMD_HEIGHT, duration=None):
+        """With *duration* (in seconds), the transition moves with the game clock rather than
+        by 1/*lengthInFrames* per frame, so it lasts as long when frames are dropped."""
         super(TransitionLayer, self).__init__(False)
 
         if layerA == None: layerA = FrameLayer(False,Frame(width,height))
@@ -109,6 +111,7 @@ class TransitionLayer(Layer):
                 self.transitionMgr = transition_class()
                         
         self.transitionMgr.progress_per_frame = 1.0 / lengthInFrames
+        self.transitionMgr.duration = duration
         self.transitionMgr.completed_handler = self.finished
         self.transitionMgr.start()
         self.next_frame()
@@ -288,22 +291,23 @@ class DoubleExpandTransition(transitions.LayerTransitionBase):
         self.direction = direction
         self.progress_per_frame = 1.0/11.0
         
-    def transition_frame(self, from_frame, to_frame):
-        frame = from_frame.copy()
-        dst_x, dst_y = 0, 0
-        prog = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog = progress
         if self.in_out == 'out':
             prog = 1.0 - prog
 
         if self.direction=='center':
-            dst_y = frame.height/2-prog*(frame.height/2)
-            dst_x = frame.width/2-prog*(frame.width/2)
+            dst_y = height/2-prog*(height/2)
+            dst_x = width/2-prog*(width/2)
         else:
-            dst_y = frame.height/2-prog*(frame.height/2)
-            dst_x = frame.width/2-prog*(frame.width/2)
+            dst_y = height/2-prog*(height/2)
+            dst_x = width/2-prog*(width/2)
+
+        return (dst_x, dst_y, prog*width, prog*height)
 
-        width=prog*frame.width
-        height = prog*frame.height
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height, copy_of=from_frame)
+        (dst_x, dst_y, width, height) = self.geometry(frame.width, frame.height)
 
         Frame.copy_rect(dst=frame, dst_x=dst_x, dst_y=dst_y, src=to_frame, src_x=dst_x, src_y=dst_y, width=width, height=height, op='copy')
-        return frame
\ No newline at end of file
+        return frame
@@ -1,9 +1,22 @@
 from dmd import *
 import sdl2.ext
 from sdl2.ext import *
+from procgame import clock
+
+geometry_tables = {}
+"""The geometry tables of the transitions, shared by the transitions of the same kind, size,
+length and direction; see :meth:`LayerTransitionBase.geometry`."""
 
 class LayerTransitionBase(object):
-    """Transition base class."""
+    """Transition base class.
+
+    The progress moves by :attr:`progress_per_frame` per frame, or by the time elapsed on the
+    game clock divided by :attr:`duration` if it is set, so that a transition lasts as long when
+    frames are dropped.  :meth:`seek` jumps to a given progress.
+
+    What moves in a transition (rectangles, alpha) is computed once per step by
+    :meth:`compute_geometry` and looked up with :meth:`geometry`, and the frames it returns
+    are scratch frames of the transition (see :meth:`scratch_frame`), drawn anew every frame."""
 
     progress = 0.0
     """Transition progress from 0.0 (100% from frame, 0% to frame) to 1.0 (0% from frame, 100% to frame).
@@ -11,6 +24,9 @@ class LayerTransitionBase(object):
     
     progress_per_frame = 1.0/30.0
     """Progress increment for each frame.  Defaults to 1/30, or 30fps."""
+
+    duration = None
+    """Length of the transition in seconds of game time, or ``None`` to move by :attr:`progress_per_frame` every frame."""
     
     progress_mult = 0 # not moving, -1 for B to A, 1 for A to B .... not documented as play/pause manipulates.
     
@@ -21,6 +37,10 @@ class LayerTransitionBase(object):
     """If ``'in'`` the transition is moving from `from` to `to`; if ``'out'`` the transition is moving
     from `to` to `from`."""
 
+    last_time = None
+
+    scratch_frames = None
+
     def __init__(self):
         super(LayerTransitionBase, self).__init__()
     
@@ -35,10 +55,21 @@ class LayerTransitionBase(object):
         """Reset the transition to the beginning."""
         self.progress_mult = 0.0
         self.progress = 0.0
+        self.last_time = clock.now()
+    def seek(self, progress):
+        """Moves the transition to *progress*, from 0.0 to 1.0; it goes on from there if it is running."""
+        self.progress = max(0.0, min(1.0, progress))
+        self.last_time = clock.now()
     def next_frame(self, from_frame, to_frame):
         """Applies the transition and increments the progress if the transition is running.  Returns the resulting frame."""
         #print 'TRANSITION NEXT FRAME PROGRESS IS' +str(self.progress)
-        self.progress = max(0.0, min(1.0, self.progress + self.progress_mult * self.progress_per_frame))
+        if self.duration:
+            now = clock.now()
+            step = (now - self.last_time) / self.duration if self.last_time is not None else 0.0
+            self.last_time = now
+        else:
+            step = self.progress_per_frame
+        self.progress = max(0.0, min(1.0, self.progress + self.progress_mult * step))
         if self.progress <= 0.0:
             if self.in_out == 'in':
                 return from_frame
@@ -58,29 +89,70 @@ class LayerTransitionBase(object):
            Base implementation simply returns the from_frame."""
         return from_frame
 
+    def steps(self):
+        """Returns the number of steps of the geometry table: the number of frames of the transition."""
+        return max(1, int(round(1.0 / self.progress_per_frame)))
+    def geometry(self, width, height):
+        """Returns what :meth:`compute_geometry` returns for the current progress (to the nearest
+        step) and a *width* x *height* frame.  The whole table is computed the first time."""
+        steps = self.steps()
+        key = (type(self), width, height, steps, self.geometry_key())
+        table = geometry_tables.get(key)
+        if table is None:
+            # the progress of each step is summed as next_frame sums it, so that the table
+            # gives the same dots as computing the geometry every frame would
+            progress = 0.0
+            table = [self.compute_geometry(progress, width, height)]
+            for i in range(steps):
+                progress = min(1.0, progress + self.progress_per_frame)
+                table.append(self.compute_geometry(progress, width, height))
+            geometry_tables[key] = table
+        return table[int(round(self.progress * steps))]
+    def geometry_key(self):
+        """Returns what, besides the kind, the size and the length of the transition, its geometry depends on."""
+        return (getattr(self, 'direction', None), self.in_out)
+    def compute_geometry(self, progress, width, height):
+        """Returns the rectangles, alpha, etc. of the transition at *progress* for a *width* x *height* frame.
+        Subclasses using :meth:`geometry` override this method."""
+        return None
+
+    def scratch_frame(self, width, height, index=0, copy_of=None):
+        """Returns the scratch frame *index* of the transition, cleared, or holding a copy of the
+        frame *copy_of*.  It is made once and drawn again every frame, instead of a new frame."""
+        if self.scratch_frames is None:
+            self.scratch_frames = []
+        while len(self.scratch_frames) <= index:
+            self.scratch_frames.append(None)
+        frame = self.scratch_frames[index]
+        if frame is None or frame.width != width or frame.height != height:
+            frame = self.scratch_frames[index] = Frame(width, height)
+        else:
+            frame.clear()
+        if copy_of is not None:
+            Frame.copy_rect(dst=frame, dst_x=0, dst_y=0, src=copy_of, src_x=0, src_y=0, width=width, height=height, op='copy')
+        return frame
+
 class ExpandTransition(LayerTransitionBase):
     def __init__(self, direction='vertical'):
         super(ExpandTransition, self).__init__()
         self.direction = direction
         self.progress_per_frame = 1.0/11.0
-    def transition_frame(self, from_frame, to_frame):
-        frame = from_frame.copy()
-        dst_x, dst_y = 0, 0
-        prog = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog = progress
         if self.in_out == 'out':
             prog = 1.0 - prog
         dst_x, dst_y = {
-         'vertical': (0, frame.height/2-prog*(frame.height/2)),
-         'horizontal':  (frame.width/2-prog*(frame.width/2), 0),
+         'vertical': (0, height/2-prog*(height/2)),
+         'horizontal':  (width/2-prog*(width/2), 0),
         }[self.direction]
 
         if (self.direction == 'vertical'):
-            width = frame.width
-            height = prog*frame.height
+            return (dst_x, dst_y, width, prog*height)
         else:
-            width = prog*frame.width
-            height = frame.height
-
+            return (dst_x, dst_y, prog*width, height)
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height, copy_of=from_frame)
+        (dst_x, dst_y, width, height) = self.geometry(frame.width, frame.height)
         Frame.copy_rect(dst=frame, dst_x=dst_x, dst_y=dst_y, src=to_frame, src_x=dst_x, src_y=dst_y, width=width, height=height, op='copy')
         return frame
 
@@ -89,18 +161,19 @@ class SlideOverTransition(LayerTransitionBase):
         super(SlideOverTransition, self).__init__()
         self.direction = direction
         self.progress_per_frame = 1.0/15.0
-    def transition_frame(self, from_frame, to_frame):
-        frame = from_frame.copy()
-        dst_x, dst_y = 0, 0
-        prog = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog = progress
         if self.in_out == 'in':
             prog = 1.0 - prog
-        dst_x, dst_y = {
-         'north': (0,  prog*frame.height),
-         'south': (0, -prog*frame.height),
-         'east':  (-prog*frame.width, 0),
-         'west':  ( prog*frame.width, 0),
+        return {
+         'north': (0,  prog*height),
+         'south': (0, -prog*height),
+         'east':  (-prog*width, 0),
+         'west':  ( prog*width, 0),
         }[self.direction]
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height, copy_of=from_frame)
+        (dst_x, dst_y) = self.geometry(frame.width, frame.height)
         Frame.copy_rect(dst=frame, dst_x=dst_x, dst_y=dst_y, src=to_frame, src_x=0, src_y=0, width=from_frame.width, height=from_frame.height, op='copy')
         return frame
 
@@ -109,21 +182,22 @@ class PushTransition(LayerTransitionBase):
         super(PushTransition, self).__init__()
         self.direction = direction
         self.progress_per_frame = 1.0/15.0
-    def transition_frame(self, from_frame, to_frame):
-        frame = Frame(width=from_frame.width, height=from_frame.height)
-        dst_x, dst_y = 0, 0
-        prog = self.progress
-        prog1 = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog = progress
+        prog1 = progress
         if self.in_out == 'in':
             prog = 1.0 - prog
         else:
             prog1 = 1.0 - prog1
-        dst_x, dst_y, dst_x1, dst_y1 = {
-         'north': (0,  prog*frame.height,  0, -prog1*frame.height),
-         'south': (0, -prog*frame.height,  0,  prog1*frame.height),
-         'east':  (-prog*frame.width, 0,    prog1*frame.width, 0),
-         'west':  ( prog*frame.width, 0,   -prog1*frame.width, 0),
+        return {
+         'north': (0,  prog*height,  0, -prog1*height),
+         'south': (0, -prog*height,  0,  prog1*height),
+         'east':  (-prog*width, 0,    prog1*width, 0),
+         'west':  ( prog*width, 0,   -prog1*width, 0),
         }[self.direction]
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height)
+        (dst_x, dst_y, dst_x1, dst_y1) = self.geometry(frame.width, frame.height)
         Frame.copy_rect(dst=frame, dst_x=dst_x, dst_y=dst_y, src=to_frame, src_x=0, src_y=0, width=from_frame.width, height=from_frame.height, op='copy')
         Frame.copy_rect(dst=frame, dst_x=dst_x1, dst_y=dst_y1, src=from_frame, src_x=0, src_y=0, width=from_frame.width, height=from_frame.height, op='copy')
         return frame
@@ -134,36 +208,37 @@ class WipeTransition(LayerTransitionBase):
         super(WipeTransition, self).__init__()
         self.direction = direction
         self.progress_per_frame = 1.0/30.0
-    def transition_frame(self, from_frame, to_frame):
-        frame = Frame(width=from_frame.width, height=from_frame.height)
-        prog0 = self.progress
-        prog1 = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog0 = progress
+        prog1 = progress
         if self.in_out == 'out':
             prog0 = 1.0 - prog0
         else:
             prog1 = 1.0 - prog1
             
         src_x, src_y = {
-         'north': (0,  prog1*frame.height),
-         'south': (0,  prog0*frame.height),
-         'east':  (prog0*frame.width, 0),
-         'west':  (prog1*frame.width, 0),
+         'north': (0,  prog1*height),
+         'south': (0,  prog0*height),
+         'east':  (prog0*width, 0),
+         'west':  (prog1*width, 0),
         }[self.direction]
         
-        width, height = {
-         'north': (frame.width,  prog1*frame.height+1),
-         'south': (frame.width,  prog0*frame.height+1),
-         'east':  (prog0*frame.width+1, frame.height),
-         'west':  (prog1*frame.width+1, frame.height),
+        wipe_width, wipe_height = {
+         'north': (width,  prog1*height+1),
+         'south': (width,  prog0*height+1),
+         'east':  (prog0*width+1, height),
+         'west':  (prog1*width+1, height),
         }[self.direction]
 
+        return (int(round(src_x)), int(round(src_y)), wipe_width, wipe_height)
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height)
+        (src_x, src_y, width, height) = self.geometry(frame.width, frame.height)
         
         if self.direction in ['east', 'south']:
             from_frame, to_frame = to_frame, from_frame
             #print "reverse to and from seeing going east or south" + str(self.direction)
         
-        src_x = int(round(src_x))
-        src_y = int(round(src_y))
         Frame.copy_rect(dst=frame, dst_x=0, dst_y=0, src=from_frame, src_x=0, src_y=0, width=width, height=height, op='copy')
         
         #print  src_x,  src_y, to_frame.height, to_frame.width, from_frame.height, from_frame.width, prog0, prog1, self.progress
@@ -179,24 +254,25 @@ class AccordianTransition(LayerTransitionBase):
         super(AccordianTransition, self).__init__()
         self.direction = direction
         self.progress_per_frame = 1.0/15.0
-    def transition_frame(self, from_frame, to_frame):
-        frame = Frame(width=from_frame.width, height=from_frame.height)
-        prog0 = self.progress
-        prog1 = self.progress
+    def compute_geometry(self, progress, width, height):
+        prog0 = progress
+        prog1 = progress
         if self.in_out == 'out':
             prog0 = 1.0 - prog0
         else:
             prog1 = 1.0 - prog1
         src_x, src_y = {
-         'north': (0,  prog1*frame.height),
-         'south': (0,  prog0*frame.height),
-         'east':  (prog0*frame.width, 0),
-         'west':  (prog1*frame.width, 0),
+         'north': (0,  prog1*height),
+         'south': (0,  prog0*height),
+         'east':  (prog0*width, 0),
+         'west':  (prog1*width, 0),
         }[self.direction]
+        return (int(round(src_x)), int(round(src_y)))
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height)
+        (src_x, src_y) = self.geometry(frame.width, frame.height)
         if self.direction in ['east', 'south']:
             from_frame, to_frame = to_frame, from_frame
-        src_x = int(round(src_x))
-        src_y = int(round(src_y))
         Frame.copy_rect(dst=frame, dst_x=0, dst_y=0, src=from_frame, src_x=0, src_y=0, width=from_frame.width, height=from_frame.height, op='copy')
         Frame.copy_rect(dst=frame, dst_x=src_x, dst_y=src_y, src=to_frame, src_x=src_x, src_y=src_y, width=from_frame.width-src_x, height=from_frame.height-src_y, op='copy')
         return frame
@@ -208,26 +284,30 @@ class ObscuredWipeTransition(LayerTransitionBase):
         self.direction = direction
         self.progress_per_frame = 1.0/15.0
         self.obs_frame = obscuring_frame
-    
-    def transition_frame(self, from_frame, to_frame):
-        frame = Frame(width=from_frame.width, height=from_frame.height)
-        prog0 = self.progress
-        prog1 = self.progress
+
+    def geometry_key(self):
+        return (self.direction, self.in_out, self.obs_frame.width, self.obs_frame.height)
+    def compute_geometry(self, progress, width, height):
+        prog0 = progress
+        prog1 = progress
         if self.in_out == 'out':
             prog0 = 1.0 - prog0
         else:
             prog1 = 1.0 - prog1
         # TODO: Improve the src_x/y so that it moves at the same speed as ovr_x/y, with the midpoint.
         src_x, src_y, ovr_x, ovr_y = {
-         'north': (0,  prog1*frame.height,   0,  frame.height-prog0*(self.obs_frame.height+2*frame.height)),
-         'south': (0,  prog0*frame.height,   0,  frame.height-prog1*(self.obs_frame.height+2*frame.height)),
-         'east':  (prog0*frame.width, 0,     frame.width-prog1*(self.obs_frame.width+2*frame.width), 0),
-         'west':  (prog1*frame.width, 0,     frame.width-prog0*(self.obs_frame.width+2*frame.width), 0),
+         'north': (0,  prog1*height,   0,  height-prog0*(self.obs_frame.height+2*height)),
+         'south': (0,  prog0*height,   0,  height-prog1*(self.obs_frame.height+2*height)),
+         'east':  (prog0*width, 0,     width-prog1*(self.obs_frame.width+2*width), 0),
+         'west':  (prog1*width, 0,     width-prog0*(self.obs_frame.width+2*width), 0),
         }[self.direction]
+        return (int(round(src_x)), int(round(src_y)), ovr_x, ovr_y)
+    
+    def transition_frame(self, from_frame, to_frame):
+        frame = self.scratch_frame(from_frame.width, from_frame.height)
+        (src_x, src_y, ovr_x, ovr_y) = self.geometry(frame.width, frame.height)
         if self.direction in ['east', 'south']:
             from_frame, to_frame = to_frame, from_frame
-        src_x = int(round(src_x))
-        src_y = int(round(src_y))
         Frame.copy_rect(dst=frame, dst_x=0, dst_y=0, src=from_frame, src_x=0, src_y=0, width=from_frame.width, height=from_frame.height, op='copy')
         Frame.copy_rect(dst=frame, dst_x=src_x, dst_y=src_y, src=to_frame, src_x=src_x, src_y=src_y, width=from_frame.width-src_x, height=from_frame.height-src_y, op='copy')
         Frame.copy_rect(dst=frame, dst_x=ovr_x, dst_y=ovr_y, src=self.obs_frame, src_x=0, src_y=0, width=self.obs_frame.width, height=self.obs_frame.height, op=self.composite_op)
@@ -241,12 +321,15 @@ class CrossFadeTransition(LayerTransitionBase):
         self.width, self.height = width, height
         self.progress_per_frame = 1.0/frame_count
 
+    def compute_geometry(self, progress, width, height):
+        return int(255 - (progress * 255))
+
     def transition_frame(self, from_frame, to_frame):
-        alpha_value = (self.progress * 255)
+        alpha_value = self.geometry(self.width, self.height)
         
-        from_frame = from_frame.copy()
-        to_frame = to_frame.copy()
-        sdl2.SDL_SetTextureAlphaMod(from_frame.pySurface.texture, int(255-alpha_value))
+        from_frame = self.scratch_frame(from_frame.width, from_frame.height, 0, copy_of=from_frame)
+        to_frame = self.scratch_frame(to_frame.width, to_frame.height, 1, copy_of=to_frame)
+        sdl2_DisplayManager.inst().set_texture_alpha(from_frame.pySurface, alpha_value)
         
         #sdl2.SDL_SetTextureAlphaMod(to_frame.pySurface.texture, int(alpha_value))
         
@@ -262,17 +345,21 @@ class FadeTransition(LayerTransitionBase):
         #self.width, self.height = width, height
         self.progress_per_frame = 1.0/frame_count
 
+    def compute_geometry(self, progress, width, height):
+        if self.direction == 'in':
+            return int(progress * 255)
+        return int(255-(progress * 255))
 
     def transition_frame(self, from_frame, to_frame=None):
         # Calculate the frame index:
         if self.direction == 'in':
-            alpha_value = (self.progress * 255)
-            frame = to_frame.copy()
+            source = to_frame
         else:
-            alpha_value = 255-(self.progress * 255)
-            frame = from_frame.copy()
+            source = from_frame
+        alpha_value = self.geometry(source.width, source.height)
+        frame = self.scratch_frame(source.width, source.height, copy_of=source)
 
-        sdl2.SDL_SetTextureAlphaMod(frame.pySurface.texture, int(alpha_value))
+        sdl2_DisplayManager.inst().set_texture_alpha(frame.pySurface, alpha_value)
 
         
         return frame
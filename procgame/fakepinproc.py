@@ -1,8 +1,11 @@
-import time
 import pinproc
 import Queue
+import threading
+import logging
 from game import gameitems
 from procgame import config
+from procgame import switchlog
+from procgame import clock
 
 
 class FakePinPROC(object):
@@ -20,19 +23,25 @@ class FakePinPROC(object):
 
     """Frames per second at which to dispatch :attr:`pinproc.EventTypeDMDFrameDisplayed` events."""
 
+    dmd_events = False
+    """True if :meth:`get_events` generates DMD events, that is when the ``proc_dmd`` config key is set."""
+
+    clock = None
+    """The clock the game must use instead of the one it creates, if any (see :meth:`GameController.create_clock`)."""
+
     def __init__(self, machine_type):
         # this short circuits the generation of 'extra' DMD events if the virtual/color DMD is used
-        use_proc_dmd = config.value_for_key_path(keypath='proc_dmd', default=False)
-        if use_proc_dmd:
+        self.dmd_events = config.value_for_key_path(keypath='proc_dmd', default=False)
+        if self.dmd_events:
             self.frames_per_second = config.value_for_key_path('dmd_framerate', 60)
-        else:
-            self.get_events = self.get_events_noDMD
 
         # Instantiate 256 drivers.
         for i in range(0, 256):
             name = 'driver' + str(i)
             self.drivers.add(name, gameitems.VirtualDriver(None, name, i, True))
 
+        # Set by add_switch_event() to wake up wait_for_events()
+        self.events_ready = threading.Event()
 
 
     def noop(self, *args, **kwargs):
@@ -48,7 +57,9 @@ class FakePinPROC(object):
         events = []
         events.extend(self.switch_events)
         self.switch_events = []
-        now = time.time()
+        if not self.dmd_events:
+            return events
+        now = clock.now()
         seconds_since_last_dmd_event = now - self.last_dmd_event
         missed_dmd_events = min(int(seconds_since_last_dmd_event*float(self.frames_per_second)), 16)
         if missed_dmd_events > 0:
@@ -63,6 +74,17 @@ class FakePinPROC(object):
         self.switch_events = []
         return events
 
+    def next_event_time(self):
+        """ Return the time at which get_events() will generate the next DMD event, or None if it does not generate them. """
+        if not self.dmd_events:
+            return None
+        return self.last_dmd_event + 1.0/self.frames_per_second
+
+    def wait_for_events(self, timeout):
+        """ Block until a switch event is added or timeout seconds have elapsed. """
+        self.events_ready.wait(timeout)
+        self.events_ready.clear()
+
 
     def driver_pulse(self, number, milliseconds):
         """ Send a pulse command to a virtual driver. """
@@ -114,8 +136,9 @@ class FakePinPROC(object):
         # of pending events.
         if self.switch_rules[rule_index]['notifyHost']:
             event = {'type':event_type, 'value':number,
-                'time': (time.clock() * 1000)} # req'd to use hw_timestamp in VP
+                'time': (clock.now() * 1000)} # req'd to use hw_timestamp in VP
             self.switch_events.append(event)
+            self.events_ready.set()
 
         # Now see if the switch rules indicate one or more drivers
         # needs to change.
@@ -148,26 +171,24 @@ class FakePinPROCPlayback(FakePinPROC):
 
     _playback_file = None # Playback file object that we read from
 
-    _events = dict() # We store events in a dictionary keyed by their simulator time
-
-    _event_timestamps = None # Event timestamps are stored in a list so they can be sorted so we access the dictionary in order.
+    _events = None # (simulator time, event) in the order to fire them; events with the same time keep their file order
 
     _states = [0] * 256 # Local switch state repository
 
     def __init__(self, machine_type):
         super(FakePinPROCPlayback, self).__init__(machine_type)
+        self.logger = logging.getLogger('fakepinproc')
 
         self._states = [0] * 256 # Initialize all switch values to 0
+        self._events = []
 
         self._playback_file = open("playback.txt", 'r') # Open our playback file for reading
         self._parse_playback_file() # Parse the playback file to get our initial switch states and load all events into memory
         self._playback_file.close() # Close the playback file after reading into memory
 
-        self._event_timestamps = self._events.keys() # Populate our list of timestamps from the events dictionary keys
-        self._event_timestamps.sort() # Sort timestamps from least to greatest so we access all events in order
-
+        self._events.sort(key=lambda entry: entry[0]) # Sort from least to greatest time so we access all events in order (the sort is stable)
 
-        self._start_time = (time.clock() * 1000) # Mark down the current start time so we know when to process an event
+        self._start_time = (clock.now() * 1000) # Mark down the current start time so we know when to process an event
 
     def switch_get_states(self, *args):
         """ Method to provide current simulator switch states. """
@@ -181,20 +202,31 @@ class FakePinPROCPlayback(FakePinPROC):
         current_time = self._get_current_simulator_time()
 
         # Loop through all events that we should execute now
-        while len(self._event_timestamps) > 0 and self._event_timestamps[0] <= current_time:
-            evt = self._events[self._event_timestamps[0]]
-            print "[%s] [%s] Firing switch %s" % (str(current_time),str(self._event_timestamps[0]), evt['swname'])
+        fired = 0
+        while fired < len(self._events) and self._events[fired][0] <= current_time:
+            (timestamp, evt) = self._events[fired]
+            self.logger.debug("[%s] [%s] Firing switch %s", current_time, timestamp, evt['swname'])
             # Add the event to the event queue
             events.append(evt)
-            # Remove the already processed events from our data structures so we don't process them again
-            del self._events[self._event_timestamps[0]]
-            del self._event_timestamps[0]
+            fired += 1
+        # Remove the already processed events so we don't process them again
+        del self._events[:fired]
 
         return events
 
+    def next_event_time(self):
+        """ Return the time of the next DMD or switch event get_events() will return. """
+        times = [super(FakePinPROCPlayback, self).next_event_time()]
+        if len(self._events) > 0:
+            times.append((self._start_time + self._events[0][0]) / 1000.0)
+        times = [t for t in times if t is not None]
+        if len(times) == 0:
+            return None
+        return min(times)
+
 
     def _get_current_simulator_time(self):
-        return (time.clock() * 1000) - self._start_time
+        return (clock.now() * 1000) - self._start_time
 
     def _parse_playback_file(self):
         line = self._playback_file.readline()
@@ -215,7 +247,82 @@ class FakePinPROCPlayback(FakePinPROC):
                 if len(evt) >= 5:
                     procEvent['time'] = evt[4]
 
-                self._events[float(evt[0])] = procEvent
+                self._events.append((float(evt[0]), procEvent))
 
             line = self._playback_file.readline()
 
+class FakePinPROCReplay(FakePinPROC):
+    """Replays a binary switch log written by :class:`~procgame.switchlog.SwitchEventRecorder`
+    as fast as the game can process it.
+
+    The replay runs on a :class:`~procgame.clock.SteppedClock` (the configured clock if it is
+    virtual, a new one otherwise): instead of sleeping, the event driven
+    :meth:`~procgame.game.GameController.run_loop` moves the clock to its next deadline or to
+    the next logged switch event, whichever comes first.  Replaying the same log therefore runs
+    the same run loop cycles each time, as long as the game does not depend on random numbers
+    or on threads.
+
+    The log is read from the file named by the ``switch_replay_file`` config key.  Once the last
+    event is replayed the game runs ``replay_tail`` seconds more, then the run loop ends and the
+    time spent in attract mode and in every ball is logged.
+    """
+
+    def __init__(self, machine_type):
+        super(FakePinPROCReplay, self).__init__(machine_type)
+        self.logger = logging.getLogger('fakepinproc')
+        filename = config.value_for_key_path('switch_replay_file', 'switches.log')
+        self.tail = config.value_for_key_path('replay_tail', 5.0)
+        (self.states, self.replay_events) = switchlog.read_switch_log(filename)
+        self.states.extend([0] * (256 - len(self.states)))
+        self.next_index = 0
+        self.game = None
+        self.finished = False
+        self.clock = clock.current
+        if not self.clock.virtual:
+            self.clock = clock.SteppedClock()
+        self.clock.horizon = self.next_event_time # never step over a switch event
+        self.start_time = self.clock.time()
+        self.due = [self.start_time + seconds for (seconds, event_type, number) in self.replay_events]
+        self.end_time = self.start_time + self.tail
+        if len(self.replay_events) > 0:
+            self.end_time = self.due[-1] + self.tail
+        self.stats = switchlog.ReplayStats(self.clock)
+        self.logger.info("Replaying %d switch events (%0.3f seconds) from %s", len(self.replay_events), self.end_time - self.start_time, filename)
+
+    def attach_game(self, game):
+        """Called by :class:`~procgame.game.GameController` once it has created this object."""
+        self.game = game
+        game.max_event_latency = 1.0
+
+    def switch_get_states(self, *args):
+        """ Return the switch states at the start of the log. """
+        return self.states
+
+    def get_events(self):
+        """ Return the DMD events and the logged switch events that are due. """
+        events = super(FakePinPROCReplay, self).get_events()
+        now = self.clock.time()
+        first = self.next_index
+        while self.next_index < len(self.replay_events) and self.due[self.next_index] <= now:
+            (seconds, event_type, number) = self.replay_events[self.next_index]
+            events.append({'type':event_type, 'value':number, 'time':self.due[self.next_index] * 1000.0})
+            self.next_index += 1
+        self.stats.update(self.phase(), self.next_index - first)
+        if now >= self.end_time and not self.finished:
+            self.finished = True
+            for line in self.stats.report():
+                self.logger.info(line)
+            events.append({'type':99, 'value':0}) # end the run loop
+        return events
+
+    def phase(self):
+        if self.game is None or self.game.ball == 0:
+            return 'attract'
+        return 'ball %d' % (self.game.ball)
+
+    def next_event_time(self):
+        """ Return the time of the next DMD or switch event, or of the end of the replay. """
+        times = [super(FakePinPROCReplay, self).next_event_time(), self.end_time]
+        if self.next_index < len(self.replay_events):
+            times.append(self.due[self.next_index])
+        return min([t for t in times if t is not None])
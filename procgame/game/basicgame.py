@@ -178,7 +178,7 @@ class BasicRecordableGame(BasicGame):
 		super(BasicRecordableGame, self).__init__(machine_type)
 			
 		# Mark down our start time so we get relative simulator timestamps when recording events
-		self._start_time = (time.time() * 1000)
+		self._start_time = (self.clock.time() * 1000)
 		
 		
 	def start_recording(self):
@@ -256,7 +256,7 @@ class BasicRecordableGame(BasicGame):
 
 	def write_event_to_file(self, event, friendly_switch_name = ""):
 		""" Writes the specified event array to a switch record file """
-		currentTime = (time.time() * 1000) - self._start_time
+		currentTime = (self.clock.time() * 1000) - self._start_time
 		eventStr = str(currentTime) + "|" + str(event['type']) + "|" + str(event['value']) + "|" + friendly_switch_name;
 		if 'time' in event:
 			eventStr = eventStr + "|" + str(event['time'])
@@ -0,0 +1,149 @@
+import collections
+import time
+import weakref
+
+class TimingStats(object):
+    """Count, total and longest of a series of durations, in seconds."""
+    __slots__ = ('count', 'total', 'longest')
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.longest:
+            self.longest = seconds
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class GameEvent(object):
+    """A SkeletonGame event (``evt_*``) waiting to be dispatched, or being dispatched."""
+    def __init__(self, name, args, on_complete_fn, only_active_modes, posted_at=None):
+        super(GameEvent, self).__init__()
+        self.name = name
+        self.args = args
+        self.on_complete_fn = on_complete_fn
+        self.only_active_modes = only_active_modes
+        self.posted_at = time.time() if posted_at is None else posted_at
+
+    def same_as(self, other):
+        """True if *other* would notify the same modes the same way."""
+        return (self.name == other.name and self.args == other.args and
+                self.on_complete_fn == other.on_complete_fn and self.only_active_modes == other.only_active_modes)
+
+class GameEventBus(object):
+    """Handler index, queue and statistics of the SkeletonGame events, owned by :class:`SkeletonGame`.
+
+    :attr:`handlers` maps every known event name to weak references to the modes that handle it,
+    in registration order.  :meth:`handlers_for` returns them in the order ``notifyModes()`` calls
+    them, from a per-event index that is only rebuilt when a handler is registered or when the
+    mode queue changes (see :attr:`ModeQueue.revision`).
+
+    Events posted while another is being dispatched wait in :attr:`queue` and are dispatched
+    first in, first out.  :meth:`post` can coalesce an event with an identical one still waiting.
+
+    :attr:`latency` holds, per event name, the time from posting to the start of the dispatch
+    (``waited``) and to its completion (``completed``); :attr:`handler_time` holds, per
+    (event name, mode class name), the time spent in the mode's handler method.
+    """
+
+    def __init__(self, event_names):
+        super(GameEventBus, self).__init__()
+        self.handlers = {}
+        for name in event_names:
+            self.handlers[name] = []
+        self.queue = collections.deque()
+        self.coalesced = 0
+        self.latency = {}
+        self.handler_time = {}
+        self.__registrations = 0
+        self.__index = {} # (name, only_active_modes) -> (validity key, [weakref to mode, ...])
+
+    def register(self, mode, name):
+        """Records that *mode* handles the event *name*, raising ValueError for an unknown event."""
+        if name not in self.handlers:
+            raise ValueError, "Mode: %s defined a function named '%s' which is not known to the Event System" % (mode, name)
+        self.handlers[name].append(weakref.ref(mode))
+        self.__registrations += 1
+
+    def handlers_for(self, name, mode_queue=None):
+        """Returns the modes handling the event *name*, lowest priority first: callers pop the next
+        mode to notify off the back, so the highest priority goes first and, among modes of equal
+        priority, the one registered last.  With a *mode_queue* only the modes in it are returned."""
+        if mode_queue is None:
+            key = (self.__registrations, None)
+        else:
+            key = (self.__registrations, mode_queue.revision)
+        entry = self.__index.get((name, mode_queue is not None))
+        if entry is not None and entry[0] == key:
+            modes = [ref() for ref in entry[1]]
+            if None not in modes:
+                return modes
+        refs = self.__rebuild(name, mode_queue)
+        self.__index[(name, mode_queue is not None)] = (key, refs)
+        return [ref() for ref in refs]
+
+    def __rebuild(self, name, mode_queue):
+        refs = [ref for ref in self.handlers[name] if ref() is not None]
+        self.handlers[name] = refs # forget the modes that went away
+        entries = [(ref(), seq, ref) for (seq, ref) in enumerate(refs)]
+        if mode_queue is not None:
+            active = set(mode_queue.modes)
+            entries = [entry for entry in entries if entry[0] in active]
+        entries.sort(key=lambda entry: (entry[0].priority, entry[1]))
+        return [ref for (mode, seq, ref) in entries]
+
+    def post(self, event, coalesce=False):
+        """Queues *event*, a :class:`GameEvent`.  With *coalesce*, an event identical to one still
+        waiting is dropped.  Returns False if it was dropped."""
+        if coalesce:
+            for waiting in self.queue:
+                if waiting.same_as(event):
+                    self.coalesced += 1
+                    return False
+        self.queue.append(event)
+        return True
+
+    def next_event(self):
+        """Removes and returns the oldest waiting event, or ``None``."""
+        if len(self.queue) == 0:
+            return None
+        return self.queue.popleft()
+
+    def clear_queue(self):
+        self.queue.clear()
+
+    def __stats(self, table, key):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = TimingStats()
+        return stats
+
+    def event_started(self, event, now=None):
+        if now is None:
+            now = time.time()
+        self.__stats(self.latency, (event.name, 'waited')).add(now - event.posted_at)
+
+    def event_completed(self, event, now=None):
+        if now is None:
+            now = time.time()
+        self.__stats(self.latency, (event.name, 'completed')).add(now - event.posted_at)
+
+    def handler_ran(self, name, mode, seconds):
+        self.__stats(self.handler_time, (name, type(mode).__name__)).add(seconds)
+
+    def report(self):
+        """Returns the statistics as a list of lines, slowest first."""
+        lines = []
+        for ((name, what), stats) in sorted(self.latency.items(), key=lambda item: -item[1].total):
+            lines.append("%-24s %-9s %5d events  mean %8.3f ms  max %8.3f ms" % (name, what, stats.count, stats.mean()*1000.0, stats.longest*1000.0))
+        for ((name, mode), stats) in sorted(self.handler_time.items(), key=lambda item: -item[1].total):
+            lines.append("%-24s %-24s %5d calls  mean %8.3f ms  max %8.3f ms" % (name, mode, stats.count, stats.mean()*1000.0, stats.longest*1000.0))
+        if self.coalesced:
+            lines.append("%d events coalesced" % (self.coalesced))
+        return lines
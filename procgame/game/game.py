@@ -12,6 +12,9 @@ from procgame import util
 from mode import *
 from pdb import PDBConfig, LED
 from procgame import LEDs
+from procgame import switchlog
+from procgame import clock
+from profiler import RunLoopProfiler
 from collections import OrderedDict
 
 def config_named(name):
@@ -59,7 +62,7 @@ class GameController(object):
     current_player_index = 0
     """Index in :attr:`players` of the current player."""
     t0 = None
-    """Start :class:`time.time` of the game program.  I.e., the time of power-up."""
+    """Start :attr:`clock` time of the game program.  I.e., the time of power-up."""
     config = None
     """YAML game configuration loaded by :meth:`load_config`."""
     balls_per_game = 3
@@ -75,6 +78,25 @@ class GameController(object):
     # MJO: Virtual DMD w/o h/w DMD
     frames_per_second = 30
 
+    event_driven_loop = False
+    """If ``True``, :meth:`run_loop` sleeps between cycles until :meth:`next_deadline` instead of polling
+    continuously.  Set from the ``event_driven_loop`` config key."""
+    max_event_latency = 0.005
+    """Longest time in seconds the event driven :meth:`run_loop` sleeps before polling for events again,
+    hence the maximum latency of a switch event.  Set from the ``max_event_latency`` config key."""
+    loop_stats = None
+    """:class:`RunLoopStats` of the current (or last) :meth:`run_loop`."""
+    clock = None
+    """The :mod:`~procgame.clock` timing the game, created by :meth:`create_clock`.  Read the time
+    from ``self.game.clock.time()`` rather than :func:`time.time` so the game can run on a
+    :class:`~procgame.clock.SteppedClock`."""
+    profiler = None
+    """:class:`~procgame.game.profiler.RunLoopProfiler` timing the parts of :meth:`run_loop`, created if
+    the ``profile_run_loop`` config key is set; ``None`` otherwise."""
+    event_recorder = None
+    """:class:`~procgame.switchlog.SwitchEventRecorder` logging the switch events passed to :meth:`process_event`,
+    created if the ``switch_record_file`` config key names a file."""
+
     """Setting this to true in the config.yaml enables a virtual DMD without physical DMD events going to the PROC"""
 
     LEDs = None
@@ -82,13 +104,42 @@ class GameController(object):
         super(GameController, self).__init__()
         self.logger = logging.getLogger('game')
         self.machine_type = pinproc.normalize_machine_type(machine_type)
+        self.clock = self.create_clock()
+        clock.use(self.clock)
         self.proc = self.create_pinproc()
+        proc_clock = getattr(self.proc, 'clock', None)
+        if proc_clock:
+            self.clock = proc_clock # e.g. the SteppedClock of FakePinPROCReplay
+            clock.use(self.clock)
         self.proc.reset(1)
         self.modes = ModeQueue(self)
-        self.t0 = time.time()
+        self.t0 = self.clock.time()
         self.LEDs = LEDs.LEDcontroller(self)
         self.dmd_updates = 0
         self.use_proc_dmd = config.value_for_key_path(keypath='proc_dmd', default=False)
+        self.event_driven_loop = config.value_for_key_path(keypath='event_driven_loop', default=False)
+        self.max_event_latency = config.value_for_key_path(keypath='max_event_latency', default=0.005)
+        if config.value_for_key_path(keypath='profile_run_loop', default=False):
+            self.profiler = RunLoopProfiler(window=config.value_for_key_path(keypath='profile_window', default=1000),
+                                            dump_file=config.value_for_key_path(keypath='profile_dump_file', default=None),
+                                            dump_interval=config.value_for_key_path(keypath='profile_dump_interval', default=10.0))
+        switch_record_file = config.value_for_key_path(keypath='switch_record_file', default=None)
+        if switch_record_file:
+            self.event_recorder = switchlog.SwitchEventRecorder(self, switch_record_file)
+        attach_game = getattr(self.proc, 'attach_game', None)
+        if attach_game:
+            attach_game(self) # e.g. FakePinPROCReplay, to drive the run loop
+
+    def create_clock(self):
+        """Instantiates and returns the clock to use as :attr:`clock`.
+
+        Checks :mod:`~procgame.config` for the key path ``clock_class``, the fully qualified name
+        of the class to instantiate without arguments, :class:`procgame.clock.RealClock` by default.
+        A P-ROC class (see :meth:`create_pinproc`) with a ``clock`` attribute replaces it.
+        """
+        klass_name = config.value_for_key_path('clock_class', 'procgame.clock.RealClock')
+        klass = util.get_class(klass_name)
+        return klass()
 
     def create_pinproc(self):
         """Instantiates and returns the class to use as the P-ROC device.
@@ -148,7 +199,7 @@ class GameController(object):
             return self.players[player].game_time
 
     def save_ball_start_time(self):
-        self.ball_start_time = time.time()
+        self.ball_start_time = self.clock.time()
 
     def start_ball(self):
         """Called by the implementor to notify the game that (usually the first) ball should be started."""
@@ -170,7 +221,7 @@ class GameController(object):
     def end_ball(self):
         """Called by the implementor to notify the game that the current ball has ended."""
 
-        self.ball_end_time = time.time()
+        self.ball_end_time = self.clock.time()
         # Calculate ball time and save it because the start time
         # gets overwritten when the next ball starts.
         self.ball_time = self.get_ball_time()
@@ -600,6 +651,8 @@ class GameController(object):
         self.proc.switch_update_rule(switch_num, switch_state, {'notifyHost':notify_host, 'reloadActive':reload_active}, drivers, drive_coil_now_if_valid)
 
     def process_event(self, event):
+        if self.event_recorder:
+            self.event_recorder.record(event)
         event_type = event['type']
         event_value = event['value']
         if event_type == 99: # CTRL-C to quit
@@ -692,7 +745,7 @@ class GameController(object):
     def get_virtualDMDevents(self):
         """ Get all switch and DMD events since the last time this was called. """
         events = []
-        now = time.time()
+        now = self.clock.time()
 
         frame_interval = float(1/float(self.frames_per_second))
         seconds_since_last_dmd_event = now - self.last_dmd_event
@@ -719,51 +772,103 @@ class GameController(object):
 
         return events
 
+    def next_virtualDMDevent_time(self):
+        """Returns the time at which :meth:`get_virtualDMDevents` will generate the next DMD event."""
+        frame_interval = 1.0/float(self.frames_per_second)
+        return self.last_dmd_event + (1.0 - self.rem_frames) * frame_interval
+
+    def next_deadline(self):
+        """Returns the earliest time at which the run loop has scheduled work to do:
+        the next DMD frame, mode delay (this includes RGB show steps), LED show action
+        or mode tick requested through :meth:`~procgame.game.Mode.next_tick_time`, such as lamp show ticks.
+        Events from the P-ROC or the keyboard are not scheduled; see :attr:`max_event_latency`."""
+        deadlines = [self.modes.next_deadline()]
+        if not self.use_proc_dmd:
+            deadlines.append(self.next_virtualDMDevent_time())
+        next_event_time = getattr(self.proc, 'next_event_time', None)
+        if next_event_time:
+            deadlines.append(next_event_time())
+        if self.LEDs:
+            deadlines.append(self.LEDs.next_deadline())
+        for mode in self.modes:
+            deadlines.append(mode.next_tick_time())
+        deadlines = [d for d in deadlines if d is not None]
+        if len(deadlines) == 0:
+            return None
+        return min(deadlines)
+
+    def wait_for_events(self, deadline):
+        """Blocks until *deadline* (a :attr:`clock` time, or ``None``) but no longer than
+        :attr:`max_event_latency` seconds.  If :attr:`proc` implements ``wait_for_events(timeout)``,
+        like :class:`~procgame.fakepinproc.FakePinPROC`, the wait ends early when a switch event arrives.
+        A virtual :attr:`clock` does not block, it moves forward instead."""
+        timeout = self.max_event_latency
+        if deadline is not None:
+            timeout = min(timeout, deadline - self.clock.time())
+        self.clock.wait(timeout, getattr(self.proc, 'wait_for_events', None))
+
     def run_loop(self, min_seconds_per_cycle=None):
-        """Called by the programmer to read and process switch events until interrupted."""
-        loops = 0
+        """Called by the programmer to read and process switch events until interrupted.
+
+        By default the loop polls continuously, sleeping only to make each cycle last
+        *min_seconds_per_cycle* if given.  With :attr:`event_driven_loop` set the loop instead
+        sleeps until :meth:`next_deadline` after each cycle, never longer than :attr:`max_event_latency`,
+        which is therefore the maximum delay before a switch event is processed.  The loop is
+        always event driven when the :attr:`clock` is virtual, since it would otherwise never advance.
+        :attr:`loop_stats` tracks how busy the loop is and :attr:`profiler`, if set, where the time goes."""
         self.done = False
-        self.last_dmd_event = time.time()
+        self.last_dmd_event = self.clock.time()
         self.run_started = self.last_dmd_event
         self.dmd_updates = 0
+        self.loop_stats = RunLoopStats(self)
+        profiler = self.profiler
         self.dmd_event()
         try:
             while self.done == False:
 
-                if min_seconds_per_cycle:
-                    t0 = time.time()
+                t0 = time.time()
 
-                loops += 1
                 for event in self.get_events():
                     self.process_event(event)
                 self.tick()
                 self.tick_virtual_drivers()
-                self.modes.tick()
-                self.LED_event()
+                if profiler:
+                    profiler.call('ModeQueue.tick', self.modes.tick)
+                    profiler.call('LEDcontroller.update', self.LED_event)
+                else:
+                    self.modes.tick()
+                    self.LED_event()
                 if self.proc:
                     self.proc.watchdog_tickle()
-                    self.proc.flush()
+                    if profiler:
+                        profiler.call('proc.flush', self.proc.flush)
+                    else:
+                        self.proc.flush()
                 if self.modes.changed:
                     self.modes.logger.info("Modes changed in last run loop cycle, now:")
                     self.modes.log_queue()
                     self.modes.changed = False
 
-                if min_seconds_per_cycle:
-                    dt = time.time() - t0
+                t1 = time.time()
+                if self.event_driven_loop or self.clock.virtual:
+                    self.wait_for_events(self.next_deadline())
+                elif min_seconds_per_cycle:
+                    dt = t1 - t0
                     if min_seconds_per_cycle > dt:
-                        time.sleep(min_seconds_per_cycle - dt)
+                        self.clock.sleep(min_seconds_per_cycle - dt)
+                self.loop_stats.add_cycle(t1 - t0, time.time() - t1)
+                if profiler:
+                    profiler.cycle_done()
         finally:
-            if loops != 0:
-                dt = time.time()-self.t0
-                dd = time.time() - self.run_started
-                self.logger.info("\nTotal Time: %0.3f Seconds",dt)
-                self.logger.info("Loops: " + str(loops))
-                if(dd > 0):
-                    self.logger.info("Overall loop rate: %0.3fHz", (loops/dd))
-                    self.logger.info("Frame rate: %0.3fFPS", (self.dmd_updates/dd))
-                if(self.dmd_updates>0):
-                    self.logger.info("DMD Updates: %s", str(self.dmd_updates))
-                    self.logger.info("loops between dmd updates: %0.3f", (loops/self.dmd_updates))
+            if self.event_recorder:
+                self.event_recorder.close()
+            if self.loop_stats.loops != 0:
+                self.logger.info("\nTotal Time: %0.3f Seconds", self.clock.time()-self.t0)
+                for line in self.loop_stats.report():
+                    self.logger.info(line)
+                if profiler:
+                    for line in profiler.report():
+                        self.logger.info(line)
 
                 #unload OSC server
                 try:
@@ -771,3 +876,54 @@ class GameController(object):
                 except:
                     pass
 
+class RunLoopStats(object):
+    """Utilization statistics of :meth:`GameController.run_loop`, available live
+    from :attr:`GameController.loop_stats`."""
+
+    def __init__(self, game):
+        super(RunLoopStats, self).__init__()
+        self.game = game
+        self.started = time.time()
+        self.game_started = game.clock.time()
+        self.loops = 0
+        self.busy_time = 0.0
+        """Seconds spent processing events, ticking modes and flushing the P-ROC."""
+        self.idle_time = 0.0
+        """Seconds spent sleeping or waiting for events."""
+        self.longest_cycle = 0.0
+
+    def add_cycle(self, busy, idle):
+        self.loops += 1
+        self.busy_time += busy
+        self.idle_time += idle
+        if busy > self.longest_cycle:
+            self.longest_cycle = busy
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def utilization(self):
+        """Fraction of the run time spent working rather than waiting, between 0 and 1."""
+        total = self.busy_time + self.idle_time
+        if total <= 0:
+            return 0.0
+        return self.busy_time / total
+
+    def report(self):
+        """Returns the statistics as a list of lines of text."""
+        lines = ["Loops: %d" % self.loops]
+        dd = self.elapsed()
+        dmd_updates = self.game.dmd_updates
+        if dd > 0:
+            lines.append("Overall loop rate: %0.3fHz" % (self.loops/dd))
+            lines.append("Frame rate: %0.3fFPS" % (dmd_updates/dd))
+            if type(self.game.clock) is not clock.RealClock:
+                game_time = self.game.clock.time() - self.game_started
+                lines.append("Game time: %0.3f Seconds, %0.1fx real time" % (game_time, game_time/dd))
+        if self.loops > 0:
+            lines.append("Loop utilization: %0.1f%% (busy %0.3fs, idle %0.3fs)" % (100.0 * self.utilization(), self.busy_time, self.idle_time))
+            lines.append("Cycle time: %0.3fms average, %0.3fms longest" % (1000.0 * self.busy_time / self.loops, 1000.0 * self.longest_cycle))
+        if dmd_updates > 0:
+            lines.append("DMD Updates: %d" % dmd_updates)
+            lines.append("loops between dmd updates: %0.3f" % (float(self.loops)/dmd_updates))
+        return lines
@@ -1,5 +1,5 @@
 import logging
-import time
+from procgame import clock
 
 class AttrCollection(object):
     """A collection of :class:`procgame.game.GameItem` objects."""
@@ -120,7 +120,7 @@ class Driver(GameItem):
         """Disables (turns off) this driver."""
         self.logger.debug('Driver %s - disable' % self.name)
         self.game.proc.driver_disable(self.number)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def pulse(self, milliseconds=None):
         """Enables this driver for `milliseconds`.
         
@@ -133,7 +133,7 @@ class Driver(GameItem):
             raise ValueError, 'milliseconds must be in range 0-255.'
         self.logger.debug("Driver %s - pulse %d", self.name, milliseconds)
         self.game.proc.driver_pulse(self.number, milliseconds)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def future_pulse(self, milliseconds=None, timestamp=0):
         """Enables this driver for `milliseconds` at P-ROC timestamp: `timestamp`.
         
@@ -147,7 +147,7 @@ class Driver(GameItem):
             raise ValueError, 'milliseconds must be in range 0-255.'
         self.logger.debug("Driver %s - future pulse %d", self.name, milliseconds, timestamp)
         self.game.proc.driver_future_pulse(self.number, milliseconds, timestamp)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def patter(self, on_time=10, off_time=10, original_on_time=0, now=True):
         """Enables a pitter-patter sequence.  
 
@@ -165,7 +165,7 @@ class Driver(GameItem):
 
         self.logger.debug("Driver %s - patter on:%d, off:%d, orig_on:%d, now:%s", self.name, on_time, off_time, original_on_time, now)
         self.game.proc.driver_patter(self.number, on_time, off_time, original_on_time, now)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def pulsed_patter(self, on_time=10, off_time=10, run_time=0, now=True):
         """Enables a pitter-patter sequence that runs for `run_time` milliseconds.  
 
@@ -182,12 +182,12 @@ class Driver(GameItem):
 
         self.logger.debug("Driver %s - pulsed patter on:%d, off:%d, run_time:%d, now:%s", self.name, on_time, off_time, run_time, now)
         self.game.proc.driver_pulsed_patter(self.number, on_time, off_time, run_time, now)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def schedule(self, schedule, cycle_seconds=0, now=True):
       """Schedules this driver to be enabled according to the given `schedule` bitmask."""
       self.logger.debug("Driver %s - schedule %08x", self.name, schedule)
       self.game.proc.driver_schedule(number=self.number, schedule=schedule, cycle_seconds=cycle_seconds, now=now)
-      self.last_time_changed = time.time()
+      self.last_time_changed = clock.now()
     def enable(self):
         """Enables this driver indefinitely.
         
@@ -198,7 +198,7 @@ class Driver(GameItem):
         
         """
         self.schedule(0xffffffff, 0, True)
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
     def state(self):
         """Returns a dictionary representing this driver's current configuration state."""
         return self.game.proc.driver_get_state(self.number)
@@ -224,7 +224,7 @@ class Switch(GameItem):
     """`False` indicates open, `True` is closed.
     In most applications the :meth:`is_active` and :meth:`is_inactive` methods should be used to determine a switch's state."""
     last_changed = None
-    """:class:`time` of the last state change of this switch.  `None` if the :class:`GameController` has not yet initialized this switch's state."""
+    """:func:`~procgame.clock.now` of the last state change of this switch.  `None` if the :class:`GameController` has not yet initialized this switch's state."""
     hw_timestamp = None
     """Hardware timestamp of the last state change of this switch.  `None` until an event is received."""
     type = None
@@ -273,10 +273,10 @@ class Switch(GameItem):
         if self.last_changed == None:
             return 1000000
         else:
-            return time.time() - self.last_changed
+            return clock.now() - self.last_changed
     def reset_timer(self):
         """Resets the value returned by :meth:`time_since_change` to 0.0.  Normally this is called by the :class:`GameController`, but it can be triggered manually if needed."""
-        self.last_changed = time.time()
+        self.last_changed = clock.now()
     def state_str(self):
         if self.is_closed():
             return 'closed'
@@ -348,8 +348,8 @@ class VirtualDriver(Driver):
             milliseconds = self.default_pulse_time
         self.change_state(True)
         if milliseconds == 0: self.time_ms = 0
-        else: self.time_ms = time.time() + milliseconds/1000.0
-        self.logger.debug("Time: %f: VirtualDriver %s - pulse %d. End time: %f", time.time(), self.name, milliseconds, self.time_ms)
+        else: self.time_ms = clock.now() + milliseconds/1000.0
+        self.logger.debug("Time: %f: VirtualDriver %s - pulse %d. End time: %f", clock.now(), self.name, milliseconds, self.time_ms)
 
     def schedule(self, schedule, cycle_seconds=0, now=True):
         """Schedules this driver to be enabled according to the given `schedule` bitmask."""
@@ -357,10 +357,10 @@ class VirtualDriver(Driver):
         self.function_active = True
         self.state['timeslots'] = schedule
         if cycle_seconds == 0: self.time_ms = 0
-        else: self.time_ms = time.time() + cycle_seconds
+        else: self.time_ms = clock.now() + cycle_seconds
         self.logger.debug("VirtualDriver %s - schedule %08x", self.name, schedule)
         self.change_state(schedule & 0x1)
-        self.next_action_time_ms = time.time() + 0.03125
+        self.next_action_time_ms = clock.now() + 0.03125
 
     def enable(self):
         """Enables this driver indefinitely.
@@ -376,17 +376,17 @@ class VirtualDriver(Driver):
     def change_state(self, new_state):
         self.curr_state = new_state
         self.curr_value = not (self.curr_state ^ self.state['polarity'])
-        self.last_time_changed = time.time()
+        self.last_time_changed = clock.now()
         if self.state_change_handler: self.state_change_handler()
         self.logger.debug("VirtualDriver %s - state change: %d", self.name, self.curr_state)
 
     def tick(self):
         if self.function_active:
             # Check for time expired.  time_ms == 0 is a special case that never expires.
-            if time.time() >= self.time_ms and self.time_ms > 0:
+            if clock.now() >= self.time_ms and self.time_ms > 0:
                 self.disable()
             elif self.function == 'schedule':
-                if time.time() >= self.next_action_time_ms:
+                if clock.now() >= self.next_action_time_ms:
                     self.inc_schedule()
 
     def inc_schedule(self):
@@ -1,8 +1,8 @@
-import time
 import re
 import copy
 import logging
 import uuid
+from scheduler import DelayScheduler
 
 # Documented in game.rst:
 SwitchStop = True
@@ -60,8 +60,6 @@ class Mode(object):
         self.priority = priority
         self.__is_started = False
         self.__accepted_switches = []
-        self.__delayed = []
-        self.__cancelled_delayed = []
         self.__children = []
         self.__scan_switch_handlers()
     
@@ -132,6 +130,8 @@ class Mode(object):
         asw = Mode.AcceptedSwitch(name=name, event_type=et, delay=delay, handler=handler, param=sw)
         if asw not in self.__accepted_switches:
             self.__accepted_switches.append(asw)
+            if self.__is_started:
+                self.game.modes.index_switch_handler(self, asw)
         else:
             self.game.logger.error("framework suppressed redundant switch handler: [name=%s, event_type=%s, delay=%s, handler=%s, param=%s]" % (name, et, delay, handler, sw))
     
@@ -178,14 +178,7 @@ class Mode(object):
             event_type = {'closed':1, 'open':2}[event_type]
         if name == None:
             name = 'anon_delay'+str(uuid.uuid1())
-        self.__delayed.append(Mode.Delayed(name=name, time=time.time()+delay, handler=handler, event_type=event_type, param=param))
-        try:
-            self.__delayed.sort(self.cmp_time) # this must be a stable sort
-        except TypeError, ex:
-            # Debugging code:
-            for x in self.__delayed:
-                print(x)
-            raise ex
+        self.game.modes.delays.schedule(self, Mode.Delayed(name=name, time=self.game.clock.time()+delay, handler=handler, event_type=event_type, param=param))
         return name
 
     def cmp_time(self, x, y):
@@ -200,64 +193,66 @@ class Mode(object):
     def cancel_delayed(self, name):
         """Removes the given named delays from the delayed list, cancelling their execution."""
         names = name if type(name) == list else [name]
-        self.__delayed = filter(lambda x: x.name not in names, self.__delayed)
-        if name not in self.__cancelled_delayed:
-            self.__cancelled_delayed.append(name)
+        self.game.modes.delays.cancel(self, names)
 
     def delay_info(self,name):
-        for x in self.__delayed:
-            if x.name == name:
-                return x
+        for x in self.game.modes.delays.pending(self, name):
+            return x
         return None
 
     def extend_delay_by(self,name,delay):
-        for x in self.__delayed:
-            if x.name == name:
-                x.time += delay
-                return True
+        for x in self.game.modes.delays.pending(self, name):
+            return self.game.modes.delays.retime(self, x, x.time + delay)
         return False
 
     def reset_delay_to(self,name,delay):
-        for x in self.__delayed:
-            if x.name == name:
-                x.time = time.time()+delay
-                return True
+        for x in self.game.modes.delays.pending(self, name):
+            return self.game.modes.delays.retime(self, x, self.game.clock.time() + delay)
         return False
 
     def is_delayed(self,name):
-        for d in self.__delayed:
-            if d.name == name:
-                return True
-        return False
+        return len(self.game.modes.delays.pending(self, name)) > 0
 
     def clear_delayed(self):
-        self.__delayed[:] = [] # clear in place to abort the for loop in dispatch_delayed() if it is in our call stack
-        self.__cancelled_delayed = []
+        self.game.modes.delays.clear(self) # also cancels the delays of this mode dispatch_delayed() has yet to call
     
     def handle_event(self, event):
-        # We want to turn this event into a function call.
+        """Dispatches a switch event to this mode's handlers only.
+
+        The run loop does not call this method; :meth:`ModeQueue.handle_event` looks up the
+        subscribed handlers of all modes in its switch index instead.
+        """
         sw_name = self.game.switches[event['value']].name
         handled = False
-
-        # Filter out all of the delayed events that have been disqualified by this state change.
-        # Remove all items that are for this switch (sw_name) but for a different state (type).
-        # Put another way, keep delayed items pertaining to other switches, plus delayed items 
-        # pertaining to this switch for another state.
-        self.__delayed = filter(lambda x: not (sw_name == x.name and x.event_type != event['type']), self.__delayed)
-        
-        filt = lambda accepted: (accepted.event_type == event['type']) and (accepted.name == sw_name)
-        for accepted in filter(filt, self.__accepted_switches):
+        self.__discard_switch_delays(sw_name, event['type'])
+        for accepted in self.__accepted_switches:
+            if accepted.event_type != event['type'] or accepted.name != sw_name:
+                continue
             if not self.__is_started:
                 break
-            if accepted.delay == None or accepted.delay == 0:
-                handler = accepted.handler
-                result = handler(self.game.switches[accepted.name])
-                if result == SwitchStop:
-                    handled = True
-            else:
-                self.delay(name=sw_name, event_type=accepted.event_type, delay=accepted.delay, handler=accepted.handler, param=accepted.param)
+            if self.__invoke_switch_handler(accepted):
+                handled = True
         return handled
-        
+
+    def __discard_switch_delays(self, sw_name, event_type):
+        # Cancel all of the delayed events that have been disqualified by this state change:
+        # the items that are for this switch (sw_name) but for a different state (type).
+        for x in self.game.modes.delays.pending(self, sw_name):
+            if x.event_type != event_type:
+                self.game.modes.delays.cancel_item(self, x)
+
+    def __invoke_switch_handler(self, accepted):
+        # Returns True if the handler asked to stop the event from reaching lower priority modes.
+        if accepted.delay == None or accepted.delay == 0:
+            profiler = self.game.profiler
+            if profiler:
+                result = profiler.call('sw ' + profiler.handler_name(self, accepted.handler), accepted.handler, self.game.switches[accepted.name])
+            else:
+                result = accepted.handler(self.game.switches[accepted.name])
+            return result == SwitchStop
+        self.delay(name=accepted.name, event_type=accepted.event_type, delay=accepted.delay, handler=accepted.handler, param=accepted.param)
+        return False
+
     def mode_started(self):
         """Notifies the mode that it is now active on the mode queue.
         
@@ -285,32 +280,24 @@ class Mode(object):
         """Called by the GameController run loop during each loop when the mode is running."""
         pass
 
+    def next_tick_time(self):
+        """Returns the :attr:`GameController.clock` time at which :meth:`mode_tick` next has time-critical work to do,
+        or ``None``.  An event driven run loop (see :meth:`GameController.run_loop`) wakes up at that time;
+        otherwise :meth:`mode_tick` may wait up to :attr:`GameController.max_event_latency` seconds."""
+        return None
+
     def dispatch_delayed(self):
         """Called by the GameController to dispatch any delayed events."""
-        # implementation requirements:
-        #   caller makes sure the mode is started
-        #   removing a mode clears its __delayed list in place to abort the dispatch_delayed for loop early
-        #   cancelling a delay must assign a new list to __delayed (never remove individual delays in place, that breaks the dispatch_delayed iteration)
-        #   cancelling a delay adds its name to __cancelled_delayed 
-        #   new delays can be appended in place with time >= t (no negative delays)
-        #   sorting delays uses a stable sort
-        self.__cancelled_delayed = [] # blacklist of delays cancelled during this dispatch_delayed
-        t = time.time()
-
-        items = filter(lambda x: x.time <= t, self.__delayed)
-        # removing the ready items now allows the creation of new delayed handlers with delay=0 thus possibly same time t
-        self.__delayed = filter(lambda x: x.time > t, self.__delayed)
-
-        for item in items:
-            if item.time <= t:
-                if item.name not in self.__cancelled_delayed:
-                    handler = item.handler
-                    if item.param != None:
-                        handler(item.param)
-                    else:
-                        handler()
+        # The ModeQueue collects the due delays of all modes from its scheduler before calling this method.
+        # Delays cancelled while we are calling earlier handlers (including by removing this mode) are skipped.
+        profiler = self.game.profiler
+        for item in self.game.modes.delays.take_due(self):
+            handler = item.handler
+            args = () if item.param == None else (item.param,)
+            if profiler:
+                profiler.call('delay ' + profiler.handler_name(self, handler), handler, *args)
             else:
-                break
+                handler(*args)
 
     def is_started(self):
         """Returns ``True`` if this mode is on the mode queue (:meth:`mode_started` has already been called)."""
@@ -381,7 +368,7 @@ class Mode(object):
         def __str__(self):
             return '<name=%s event_type=%s delay=%s>' % (self.name, self.event_type, self.delay)
     
-    # Data structure used by the __delayed array:
+    # Data structure of the items held by the ModeQueue's delay scheduler:
     class Delayed:
         def __init__(self, name, time, handler, event_type, param):
             self.name = name
@@ -397,13 +384,60 @@ class ModeQueue(object):
     
     changed = False
     """True if the contents of the queue has changed since the last time this variable was set to False."""
+
+    revision = 0
+    """Incremented every time a mode is added to or removed from the queue."""
     
     def __init__(self, game):
         super(ModeQueue, self).__init__()
         self.game = game
+        self.delays = DelayScheduler()
         self.modes = []
         self.logger = logging.getLogger('game.modes')
 
+    @property
+    def modes(self):
+        """List of the modes in the queue, sorted by priority (highest first)."""
+        return self.__modes
+
+    @modes.setter
+    def modes(self, modes):
+        # Some callers replace the whole list, rebuild the switch index to match.
+        self.__modes = modes
+        self.revision += 1
+        self.__switch_index = {}
+        for mode in modes:
+            self.__index_mode(mode)
+        self.__number_modes()
+
+    def __number_modes(self):
+        # position of each mode in the queue, to put the modes an event visits in priority order
+        self.__positions = dict((mode, idx) for (idx, mode) in enumerate(self.__modes))
+
+    def __index_mode(self, mode):
+        for accepted in mode._Mode__accepted_switches:
+            self.index_switch_handler(mode, accepted)
+
+    def __unindex_mode(self, mode):
+        for accepted in mode._Mode__accepted_switches:
+            key = (accepted.name, accepted.event_type)
+            entries = self.__switch_index.get(key)
+            if entries is None:
+                continue
+            entries = [entry for entry in entries if entry[0] is not mode]
+            if entries:
+                self.__switch_index[key] = entries
+            else:
+                del self.__switch_index[key]
+
+    def index_switch_handler(self, mode, accepted):
+        """Records that *mode* subscribes to the switch event described by *accepted*,
+        a :class:`Mode.AcceptedSwitch`.  Called by :meth:`Mode.add_switch_handler`
+        when the mode is already on the queue."""
+        key = (accepted.name, accepted.event_type)
+        # assign a new list, never append in place, so a dispatch in progress is not affected
+        self.__switch_index[key] = self.__switch_index.get(key, []) + [(mode, accepted)]
+
     def reset(self):
         for mode in self.modes:
             mode._Mode__is_started = False
@@ -415,12 +449,16 @@ class ModeQueue(object):
         for m in add_modes:
             if m in self.modes:
                 raise ValueError, "Attempted to add mode "+str(m)+", already in mode queue."
-            self.modes += [m]
+            self.modes.append(m)
+            self.__index_mode(m)
             # Sort by priority, descending:
             self.modes.sort(lambda x, y: y.priority - x.priority)
+            self.__number_modes()
             self.changed = True
+            self.revision += 1
             self.logger.info("Added %s.", str(m))
             m._Mode__is_started = True
+            self.delays.resume(m)
             m.mode_started()
             if m == self.modes[0]:
                 m.mode_topmost()
@@ -431,7 +469,10 @@ class ModeQueue(object):
             for idx, m in enumerate(self.modes): # this iterator is not vulnerable to changes in self.modes since we break as soon as we find a match
                 if m == rm:
                     del self.modes[idx]
+                    self.__unindex_mode(rm)
+                    self.__number_modes()
                     self.changed = True
+                    self.revision += 1
                     self.logger.info("Removed %s.", str(rm))
                     rm._Mode__is_started = False
                     rm.clear_delayed()
@@ -453,20 +494,65 @@ class ModeQueue(object):
         return self.modes[v]
     
     def handle_event(self, event):
-        modes = copy.copy(self.modes) # Make a copy so if a mode is added we don't get into a loop.
+        """Dispatches a switch event to the handlers subscribed to it, in priority order,
+        until a mode returns :data:`SwitchStop`.  Only the modes with a handler registered for
+        this switch name and event type, or a delayed handler pending for this switch, are visited."""
+        if self.game.profiler:
+            self.game.profiler.call('ModeQueue.handle_event', self.__handle_event, event)
+        else:
+            self.__handle_event(event)
+
+    def __handle_event(self, event):
+        sw_name = self.game.switches[event['value']].name
+        subscribers = {}
+        for mode, accepted in self.__switch_index.get((sw_name, event['type']), []):
+            subscribers.setdefault(mode, []).append(accepted)
+
+        # the modes to visit: the subscribers and the modes whose delays on this switch this event may cancel,
+        # in the order of the queue; a list of their own so a mode added by a handler is not visited
+        positions = self.__positions
+        modes = set(subscribers)
+        modes.update(mode for mode in self.delays.owners(sw_name) if mode in positions)
+        modes = sorted(modes, key=lambda mode: positions.get(mode, len(positions)))
         for mode in modes:
-            if mode._Mode__is_started:
-                handled = mode.handle_event(event)
-                if handled:
+            if not mode._Mode__is_started:
+                continue
+            mode._Mode__discard_switch_delays(sw_name, event['type'])
+            handled = False
+            for accepted in subscribers.get(mode, []):
+                if not mode._Mode__is_started:
                     break
+                if mode._Mode__invoke_switch_handler(accepted):
+                    handled = True
+            if handled:
+                break
     
     def tick(self):
-        modes = copy.copy(self.modes) # Make a copy so if a mode is added we don't get into a loop.
-        for mode in modes:
-            if mode._Mode__is_started: # Make sure the mode was not stopped since the start of this loop
-                mode.dispatch_delayed()
-            if mode._Mode__is_started:
-                mode.mode_tick()
+        self.delays.collect(self.game.clock.time(), lambda mode: mode._Mode__is_started)
+        profiler = self.game.profiler
+        try:
+            modes = copy.copy(self.modes) # Make a copy so if a mode is added we don't get into a loop.
+            for mode in modes:
+                if profiler:
+                    self.__profiled_tick(mode, profiler)
+                    continue
+                if mode._Mode__is_started: # Make sure the mode was not stopped since the start of this loop
+                    mode.dispatch_delayed()
+                if mode._Mode__is_started:
+                    mode.mode_tick()
+        finally:
+            self.delays.release()
+
+    def __profiled_tick(self, mode, profiler):
+        name = type(mode).__name__
+        if mode._Mode__is_started:
+            profiler.call('dispatch_delayed ' + name, mode.dispatch_delayed)
+        if mode._Mode__is_started:
+            profiler.call('mode_tick ' + name, mode.mode_tick)
+
+    def next_deadline(self):
+        """Returns the time at which the earliest delayed handler of any mode is due, or ``None``."""
+        return self.delays.next_deadline()
 
     def log_queue(self, log_level=logging.INFO):
         log_rows = []
@@ -0,0 +1,152 @@
+import bisect
+import collections
+import logging
+import time
+
+class RollingHistogram(object):
+    """Histogram of the last *window* durations added, in seconds.
+
+    The buckets are bounded by :attr:`bounds` (upper bounds, the last bucket holds whatever is
+    longer).  Adding a duration is O(log buckets): the oldest duration leaves the window as the
+    new one enters it."""
+
+    bounds = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05)
+
+    def __init__(self, window=1000):
+        super(RollingHistogram, self).__init__()
+        self.window = window
+        self.samples = collections.deque()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        """Sum of the durations in the window."""
+        self.calls = 0
+        """Number of durations ever added."""
+
+    def add(self, seconds):
+        bucket = bisect.bisect_left(self.bounds, seconds)
+        self.samples.append((seconds, bucket))
+        self.counts[bucket] += 1
+        self.total += seconds
+        self.calls += 1
+        if len(self.samples) > self.window:
+            (seconds, bucket) = self.samples.popleft()
+            self.counts[bucket] -= 1
+            self.total -= seconds
+
+    def mean(self):
+        if len(self.samples) == 0:
+            return 0.0
+        return self.total / len(self.samples)
+
+    def longest(self):
+        if len(self.samples) == 0:
+            return 0.0
+        return max(seconds for (seconds, bucket) in self.samples)
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the given *fraction* (0 to 1) of the
+        durations in the window, or ``None`` if that is the last bucket."""
+        target = fraction * len(self.samples)
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                if bucket < len(self.bounds):
+                    return self.bounds[bucket]
+                return None
+        return None
+
+class RunLoopProfiler(object):
+    """Times the parts of :meth:`GameController.run_loop` into a :class:`RollingHistogram` per component.
+
+    Created by :class:`GameController` as :attr:`GameController.profiler` when the ``profile_run_loop``
+    config key is set; otherwise that attribute is ``None`` and the run loop, :class:`ModeQueue`,
+    :meth:`Mode.dispatch_delayed` and :class:`~procgame.dmd.DisplayController` only test it.
+
+    The components are named after what was timed:
+
+    * ``ModeQueue.tick``, ``ModeQueue.handle_event``, ``DisplayController.update``,
+      ``LEDcontroller.update`` and ``proc.flush``;
+    * ``mode_tick <mode>`` and ``dispatch_delayed <mode>``, per mode class;
+    * ``sw <mode>.<handler>`` and ``delay <mode>.<handler>``, per switch and delayed handler;
+    * ``next_frame <layer>``, per layer class composited by the display controller.
+
+    The histograms hold the last ``profile_window`` (1000) durations of each component.
+    :meth:`report` returns them as text; with the ``profile_dump_file`` config key set the
+    report is appended to that file every ``profile_dump_interval`` (10) seconds, followed by
+    the lines of the :attr:`reports` (such as the live SDL textures, added by the display controller).
+    """
+
+    def __init__(self, window=1000, dump_file=None, dump_interval=10.0):
+        super(RunLoopProfiler, self).__init__()
+        self.logger = logging.getLogger('game.profiler')
+        self.window = window
+        self.dump_file = dump_file
+        self.dump_interval = dump_interval
+        self.histograms = {}
+        self.reports = []
+        """Functions returning more lines for :meth:`dump`."""
+        self.started = time.time()
+        self.next_dump = self.started + dump_interval
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        return histogram
+
+    def add(self, name, seconds):
+        """Adds a duration of *seconds* to the component *name*."""
+        self.histogram(name).add(seconds)
+
+    def call(self, name, fn, *args):
+        """Calls *fn(\*args)*, adds its duration to the component *name* and returns its result."""
+        t0 = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self.add(name, time.time() - t0)
+
+    def cycle_done(self):
+        """Called by the run loop at the end of each cycle; dumps the report when it is time."""
+        if self.dump_file is None:
+            return
+        now = time.time()
+        if now >= self.next_dump:
+            self.next_dump = now + self.dump_interval
+            self.dump()
+
+    def dump(self):
+        """Appends the :meth:`report` to :attr:`dump_file`."""
+        with open(self.dump_file, 'a') as f:
+            f.write("%s, %0.1f seconds after start\n" % (time.strftime('%Y-%m-%d %H:%M:%S'), time.time() - self.started))
+            for line in self.report():
+                f.write(line + '\n')
+            for report in self.reports:
+                for line in report():
+                    f.write(line + '\n')
+            f.write('\n')
+
+    def report(self):
+        """Returns the histograms as a list of lines, the most time consuming component first.
+        The times cover the last durations of each component (see :class:`RollingHistogram`)."""
+        bounds = RollingHistogram.bounds
+        header = ' '.join(['%6s' % ('<' + self.format_bound(bound)) for bound in bounds] + ['%6s' % 'more'])
+        lines = ["%-44s %8s %9s %9s %9s  %s" % ('component', 'calls', 'mean ms', 'p95 ms', 'max ms', header)]
+        for (name, histogram) in sorted(self.histograms.items(), key=lambda item: -item[1].total):
+            p95 = histogram.percentile(0.95)
+            p95 = '>%0.3f' % (bounds[-1] * 1000.0) if p95 is None else '<%0.3f' % (p95 * 1000.0)
+            counts = ' '.join(['%6d' % count for count in histogram.counts])
+            lines.append("%-44s %8d %9.3f %9s %9.3f  %s" % (name[:44], histogram.calls, histogram.mean() * 1000.0, p95, histogram.longest() * 1000.0, counts))
+        return lines
+
+    def format_bound(bound):
+        if bound < 0.001:
+            return '%dus' % int(round(bound * 1000000))
+        return '%gms' % (bound * 1000)
+    format_bound = staticmethod(format_bound)
+
+    def handler_name(mode, handler):
+        """Returns ``<mode class>.<handler name>``."""
+        return '%s.%s' % (type(mode).__name__, getattr(handler, '__name__', type(handler).__name__))
+    handler_name = staticmethod(handler_name)
@@ -0,0 +1,199 @@
+import heapq
+import itertools
+
+# States of a scheduled entry:
+QUEUED = 0     # waiting in the heap
+PARKED = 1     # due, but its owner was not started; waits in __parked until resume()
+DUE = 2        # collected by collect(), waiting for take_due()
+CANCELLED = 3
+DONE = 4
+
+class DelayScheduler(object):
+    """Game-wide timer scheduler holding the delayed handlers of every :class:`Mode`.
+
+    Entries are kept in a heap ordered by (time, insertion order) so scheduling is O(log n),
+    and an index by (owner, name) makes cancelling by name O(k) for the k delays sharing that
+    name.  A second index gives the owners having entries of a given name (:meth:`owners`).
+    Cancelled entries are flagged and dropped lazily when they reach the top of the heap.
+
+    The :class:`ModeQueue` owns one instance, :attr:`ModeQueue.delays`.  Once per run loop
+    cycle it calls :meth:`collect` with the current time, each started mode then fires its
+    share of the due entries through :meth:`take_due` and finally :meth:`release` puts back
+    whatever was not taken.
+    """
+
+    def __init__(self):
+        super(DelayScheduler, self).__init__()
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__by_owner = {} # owner -> {name: [entry, ...]} for every entry not yet fired or cancelled
+        self.__by_name = {} # name -> set of the owners having that name in __by_owner
+        self.__parked = {} # owner -> [entry, ...]
+        self.__due = {} # owner -> [entry, ...] collected during the current cycle
+        self.__stale = 0 # number of cancelled entries still sitting in the heap
+
+    def __len__(self):
+        return sum(len(entries) for names in self.__by_owner.values() for entries in names.values())
+
+    def __push(self, entry):
+        entry.state = QUEUED
+        heapq.heappush(self.__heap, (entry.item.time, entry.seq, entry))
+
+    def __forget(self, entry):
+        names = self.__by_owner.get(entry.owner)
+        if names is None:
+            return
+        entries = names.get(entry.item.name)
+        if entries is None:
+            return
+        entries = [e for e in entries if e is not entry]
+        if entries:
+            names[entry.item.name] = entries
+        else:
+            del names[entry.item.name]
+            self.__unname(entry.owner, entry.item.name)
+            if not names:
+                del self.__by_owner[entry.owner]
+
+    def __unname(self, owner, name):
+        owners = self.__by_name.get(name)
+        if owners is not None:
+            owners.discard(owner)
+            if not owners:
+                del self.__by_name[name]
+
+    def __cancel_entry(self, entry):
+        if entry.state == QUEUED:
+            self.__stale += 1
+        entry.state = CANCELLED
+
+    def __compact(self):
+        # Rebuild the heap without its cancelled entries once they make up most of it.
+        if self.__stale > 32 and self.__stale * 2 > len(self.__heap):
+            self.__heap = [node for node in self.__heap if node[2].state == QUEUED]
+            heapq.heapify(self.__heap)
+            self.__stale = 0
+
+    def schedule(self, owner, item):
+        """Schedules *item* on behalf of *owner*.  *item* must have ``name`` and ``time`` attributes,
+        ``time`` being the absolute time at which it becomes due."""
+        entry = ScheduledEntry(owner, item, next(self.__counter))
+        self.__by_owner.setdefault(owner, {}).setdefault(item.name, []).append(entry)
+        self.__by_name.setdefault(item.name, set()).add(owner)
+        self.__push(entry)
+        return item
+
+    def pending(self, owner, name):
+        """Returns the items of *owner* named *name* that have not come due yet, ordered by time."""
+        names = self.__by_owner.get(owner)
+        if names is None or name not in names:
+            return []
+        entries = [e for e in names[name] if e.state == QUEUED or e.state == PARKED]
+        entries.sort(key=lambda e: (e.item.time, e.seq))
+        return [e.item for e in entries]
+
+    def owners(self, name):
+        """Returns the owners having entries named *name* not yet fired or cancelled."""
+        return list(self.__by_name.get(name, ()))
+
+    def cancel(self, owner, names):
+        """Cancels every entry of *owner* whose name is in the list *names*,
+        including entries already collected but not yet fired."""
+        by_name = self.__by_owner.get(owner)
+        if by_name is None:
+            return
+        for name in names:
+            if name in by_name:
+                self.__unname(owner, name)
+            for entry in by_name.pop(name, []):
+                self.__cancel_entry(entry)
+        if not by_name:
+            del self.__by_owner[owner]
+        self.__compact()
+
+    def cancel_item(self, owner, item):
+        """Cancels the single scheduled *item* of *owner*."""
+        for entry in self.__by_owner.get(owner, {}).get(item.name, []):
+            if entry.item is item:
+                self.__cancel_entry(entry)
+                self.__forget(entry)
+                break
+        self.__compact()
+
+    def retime(self, owner, item, time):
+        """Moves the pending *item* of *owner* to the absolute *time*."""
+        for entry in self.__by_owner.get(owner, {}).get(item.name, []):
+            if entry.item is item and (entry.state == QUEUED or entry.state == PARKED):
+                self.__cancel_entry(entry)
+                self.__forget(entry)
+                item.time = time
+                self.schedule(owner, item)
+                return True
+        return False
+
+    def clear(self, owner):
+        """Cancels every entry of *owner*, including entries already collected but not yet fired."""
+        for (name, entries) in self.__by_owner.pop(owner, {}).items():
+            self.__unname(owner, name)
+            for entry in entries:
+                self.__cancel_entry(entry)
+        self.__parked.pop(owner, None)
+        self.__compact()
+
+    def resume(self, owner):
+        """Puts the parked entries of *owner* back in the heap.  Called when the owner is started."""
+        for entry in self.__parked.pop(owner, []):
+            if entry.state == PARKED:
+                self.__push(entry)
+
+    def next_deadline(self):
+        """Returns the time of the earliest scheduled entry, or ``None`` if nothing is scheduled."""
+        heap = self.__heap
+        while heap and heap[0][2].state == CANCELLED:
+            heapq.heappop(heap)
+            self.__stale -= 1
+        if heap:
+            return heap[0][0]
+        return None
+
+    def collect(self, now, is_active):
+        """Moves every entry due at *now* out of the heap, grouped by owner for :meth:`take_due`.
+        Entries whose owner fails ``is_active(owner)`` are parked until :meth:`resume`."""
+        heap = self.__heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)[2]
+            if entry.state == CANCELLED:
+                self.__stale -= 1
+            elif not is_active(entry.owner):
+                entry.state = PARKED
+                self.__parked.setdefault(entry.owner, []).append(entry)
+            else:
+                entry.state = DUE
+                self.__due.setdefault(entry.owner, []).append(entry)
+
+    def take_due(self, owner):
+        """Generates the collected items of *owner* in due order.  An item cancelled while
+        earlier items are being handled is skipped."""
+        for entry in self.__due.pop(owner, []):
+            if entry.state == DUE:
+                entry.state = DONE
+                self.__forget(entry)
+                yield entry.item
+
+    def release(self):
+        """Puts the collected entries nobody took back in the heap, keeping them for the next cycle."""
+        due = self.__due
+        self.__due = {}
+        for entries in due.values():
+            for entry in entries:
+                if entry.state == DUE:
+                    self.__push(entry)
+
+class ScheduledEntry(object):
+    """Bookkeeping for an item held by :class:`DelayScheduler`."""
+    __slots__ = ('owner', 'item', 'seq', 'state')
+    def __init__(self, owner, item, seq):
+        self.owner = owner
+        self.item = item
+        self.seq = seq
+        self.state = QUEUED
@@ -58,6 +58,7 @@ from procgame.yaml_helper import value_for_key
 # from weakref import WeakValueDictionary
 
 from game import config_named
+from eventbus import GameEventBus, GameEvent
 from procgame.modes.rgbshow import RgbShowPlayer
 
 try:
@@ -184,7 +185,6 @@ class SkeletonGame(BasicGame):
 
             # event hanlders are lists of AdvancedModes (again, weakref) that care about these specific
             # events (i.e., these classes define functions to handle these specific events)
-            self.event_handlers = {}
             # the evt_ methods:
             self.known_events = [ 'evt_tilt', 'evt_shoot_again', 'evt_single_ball_play', \
                                     'evt_ball_ending', 'evt_ball_starting', 'evt_ball_saved', \
@@ -193,13 +193,13 @@ class SkeletonGame(BasicGame):
                                     'evt_volume_up', 'evt_volume_down', 'evt_tilt_warning', \
                                     'evt_game_ended', 'evt_initial_entry', 'evt_mb_drain']
 
-            for e in self.known_events:
-                self.event_handlers[e] = []
-
-            self.sg_event_queue = [] # if a known event fires while still processing another, this will
-            # hold the queue of out-standing SG events
+            # the bus indexes the handlers by priority, queues the events that fire while another
+            # is still being processed (first in, first out) and times both
+            self.event_bus = GameEventBus(self.known_events)
+            self.event_handlers = self.event_bus.handlers
 
             self.event = None # the current SG event being processed
+            self.current_event = None # and its GameEvent
 
             self.game_tilted = False # indicates if any kind of tilt has occured; tilt, slam_tilt
 
@@ -406,6 +406,11 @@ class SkeletonGame(BasicGame):
 
     def end_run_loop(self):
         if(not self.cleaned_up): # if the game hasn't crashed, this might be called twice
+            if(hasattr(self, 'asset_mgr')):
+                self.asset_mgr.session_over()
+            if(hasattr(self, 'event_bus')):
+                for line in self.event_bus.report():
+                    self.logger.info("event bus: %s" % line)
             if sdl2_DisplayManager.inst():
                 sdl2_DisplayManager.inst().close()
             cleanup()
@@ -552,15 +557,15 @@ class SkeletonGame(BasicGame):
         #     self.add_evt_handler(new_mode, evt_name, handler=handlerfn)
 
     def add_evt_handler(self, mode, evt_name):
-        if(evt_name not in self.event_handlers):
-            raise ValueError, "Mode: %s defined a function named '%s' which is not known to the Event System" % (mode, evt_name)
-
-        self.event_handlers[evt_name].append(weakref.ref(mode))
+        self.event_bus.register(mode, evt_name)
 
     def notifyNextMode(self):
         self.curr_delayed_by_mode = None
         if(len(self.notify_list)==0):
             self.event = None
+            if(self.current_event is not None):
+                self.event_bus.event_completed(self.current_event)
+                self.current_event = None
             if(self.event_complete_fn is not None):
                 self.logger.debug("Skel: completing event '%s' by calling '%s'" % (self.event, self.event_complete_fn))
                 self.event_complete_fn()
@@ -574,7 +579,9 @@ class SkeletonGame(BasicGame):
 
         self.logger.debug("Skel: calling mode '%s' event handler for event '%s'" % (next_handler, self.event))
 
+        t0 = time.time()
         d = next_handler.handle_game_event(self.event,params=self.args)
+        self.event_bus.handler_ran(self.event, next_handler, time.time() - t0)
         # if(self.args is None):
         #     d = evt_handler()
         # else:
@@ -624,14 +631,17 @@ class SkeletonGame(BasicGame):
             self.logger.critical("Skel: notifyNextModeNow called by %s, but this mode is not blocking this event! (%s is)!?" % (caller_mode, self.curr_delayed_by_mode))
 
     def checkOutstandingSGEvents(self):
-        if(len(self.sg_event_queue)>0):
-            self.logger.info("Processing SG Event Queue: contains %d events" % len(self.sg_event_queue))
-            evt = self.sg_event_queue.pop()
-            self.notifyModes(evt.name, evt.args, evt.on_complete_fn, evt.only_active_modes)
+        if(self.event is not None):
+            # the completion function started another event which is still being processed,
+            # the waiting events are dispatched when it completes
+            self.logger.info("SG Event Queue -- waiting for event [%s]" % (self.event))
+        elif(len(self.event_bus.queue)>0):
+            self.logger.info("Processing SG Event Queue: contains %d events" % len(self.event_bus.queue))
+            self.dispatchEvent(self.event_bus.next_event())
         else:
             self.logger.info("SG Event Queue -- All Clear")
 
-    def notifyModes(self, event, args=None, event_complete_fn=None, only_active_modes=True):
+    def notifyModes(self, event, args=None, event_complete_fn=None, only_active_modes=True, coalesce=False):
         """ this method will notify all AdvencedMode derived modes of the given event.  Modes
             will be notified in priority order and notifications happen over time -- that is,
             the next mode will be notified after the previous mode has completed dealing with this
@@ -645,37 +655,48 @@ class SkeletonGame(BasicGame):
             Setting the only_active_modes=False will notify _all_ known modes, not just active
             modes.  This will be of _very_ limited utility, however is useful for events such as
             evt_player_added.
+
+            An event fired while another is still being processed waits its turn; events wait
+            in the order they were fired.  With coalesce=True the event is dropped if an
+            identical one (same name, args and completion function) is already waiting.
         """
 
+        evt = GameEvent(event, args, event_complete_fn, only_active_modes)
+
         if(self.event is not None):
             #We are still processing an event
             self.logger.error("Trying to notify modes about new event [%s] while [%s] is still being processed!!" % (event, self.event))
 
-            self.sg_event_queue.append(SGEvent(event,args,event_complete_fn,only_active_modes))
+            if not self.event_bus.post(evt, coalesce=coalesce):
+                self.logger.info("Skel: event [%s] is already waiting; coalesced" % (event))
             return
 
-        delay = 0
+        self.dispatchEvent(evt)
+
+    def dispatchEvent(self, evt):
+        """ starts notifying the modes of the GameEvent evt; see notifyModes() """
         self.notify_list = []
-        self.event_complete_fn = event_complete_fn
-        self.args = args
+        self.event_complete_fn = evt.on_complete_fn
+        self.args = evt.args
         # if(event.startswith('evt_')):
         #     self.event = event[4:]
-        self.event = event
+        self.event = evt.name
+        self.current_event = evt
+        self.event_bus.event_started(evt)
 
-        self.logger.info("Skel: preparing to notify modes of event %s." % event)
+        self.logger.info("Skel: preparing to notify modes of event %s." % evt.name)
 
-        if(only_active_modes):
-            handlers = [h() for h in self.event_handlers[self.event] if h() is not None and h() in self.modes]
+        if(evt.only_active_modes):
+            handlers = self.event_bus.handlers_for(evt.name, self.modes)
         else:
-            handlers = [h() for h in self.event_handlers[self.event] if h() is not None]
+            handlers = self.event_bus.handlers_for(evt.name)
 
         for h in handlers:
-            self.logger.debug("Skel: event '%s' queuing handler found in mode [%s]" % (event, h))
-            self.notify_list.append(h)
+            self.logger.debug("Skel: event '%s' queuing handler found in mode [%s]" % (evt.name, h))
 
-        # note this sort is in reverse priority order because we pop
+        # note this list is in reverse priority order because we pop
         # off the back!
-        self.notify_list.sort(lambda x, y: x.priority - y.priority)
+        self.notify_list = handlers
 
         self.notifyNextMode()
 
@@ -695,27 +716,20 @@ class SkeletonGame(BasicGame):
             #We are still processing an event
             self.logger.info("NOTE: we are notifying modes about a 'quick' event [%s] while a system event [%s] is still being processed!!" % (event, self.event))
 
-        quick_notify_list = []
-
         self.logger.info("Skel: preparing to notify modes of 'quick' event %s." % event)
 
         if(only_active_modes):
-            handlers = [h() for h in self.event_handlers[event] if h() is not None and h() in self.modes]
+            quick_notify_list = self.event_bus.handlers_for(event, self.modes)
         else:
-            handlers = [h() for h in self.event_handlers[event] if h() is not None]
-
-        for h in handlers:
-            self.logger.debug("Skel: quick event '%s' handler found in mode [%s]" % (event, h))
-            quick_notify_list.append(h)
-
-        # note this sort is in reverse priority order because we pop
-        # off the back!
-        quick_notify_list.sort(lambda x, y: x.priority - y.priority)
-
+            quick_notify_list = self.event_bus.handlers_for(event)
 
+        # note this list is in reverse priority order because it is meant to be
+        # popped off the back!
         for h in quick_notify_list:
             self.logger.debug("Skel: quick event '%s' being handled in mode [%s]" % (event, h))
+            t0 = time.time()
             d = h.handle_game_event(event,params=args)
+            self.event_bus.handler_ran(event, h, time.time() - t0)
             if(d is not None) and (d!=0):
                 self.logger.error("modes '%s' has a quick event handler for event [%s] that seems to be requesting additional time.  This is not possible!" % (event, h))
 
@@ -742,9 +756,10 @@ class SkeletonGame(BasicGame):
         # clear the notification list
         self.notify_list = []
         self.event_complete_fn = None
-        self.sg_event_queue = []
+        self.event_bus.clear_queue()
         self.switchmonitor.cancel_delayed(name='notifyNextMode')
         self.event = None
+        self.current_event = None
 
         super(SkeletonGame,self).reset()
 
@@ -987,7 +1002,7 @@ class SkeletonGame(BasicGame):
             if self.ball >= self.balls_per_game:
                 last_ball = True
 
-            self.ball_end_time = time.time()
+            self.ball_end_time = self.clock.time()
 
             # Calculate ball time and save it because the start time
             # gets overwritten when the next ball starts.
@@ -1376,14 +1391,7 @@ class SkeletonGame(BasicGame):
             # self.set_status("Balls Missing: PLEASE WAIT!!", 3.0)
             self.notifyModes('evt_balls_missing', args=None, event_complete_fn=None)
 
-class SGEvent(object):
-    """An object to hold an SGEvent; useful if multiple events come in at a time"""
-    def __init__(self, event_name, evt_args, on_complete_fn, only_active_modes):
-        super(SGEvent, self).__init__()
-        self.name = event_name
-        self.args = evt_args
-        self.on_complete_fn = on_complete_fn
-        self.only_active_modes = only_active_modes
+SGEvent = GameEvent # the name this class had before the event bus
 
 class AdvPlayer(Player):
     """Represents a player in the game.
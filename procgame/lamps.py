@@ -6,7 +6,7 @@ import string
 import math
 import copy
 import re
-import time
+import os
 import logging
 
 # Pattern functions:
@@ -39,17 +39,84 @@ def fade_fade(l):
         return a[:-1] + ' ' + b
     else:
         return a + ' ' + b
+expand_re = re.compile('([\[<])[\- ]*([\]>])')
+expansions = {}
+def expand_match(m):
+    """Returns the expansion of an open/close pair matched by :data:`expand_re`; they are cached by kind and length."""
+    key = (m.group(1), m.group(2), m.end() - m.start())
+    expansion = expansions.get(key)
+    if expansion is None:
+        (open, close, l) = key
+        if open == '[' and close == ']':
+            expansion = '.'*l
+        elif open == '<' and close == ']':
+            expansion = fade_in(l)[:-1] + '.'
+        elif open == '[' and close == '>':
+            expansion = '.'+fade_out(l)[1:]
+        else:
+            expansion = fade_fade(l)
+        expansions[key] = expansion
+    return expansion
 def expand_line(str):
     """Expands special characters ``<>[]`` within *str* and returns the dots-and-spaces representation.  
     Used by :class:`LampShowTrack`.
     """
-    str = re.sub('(\[[\- ]*\])', lambda m: '.'*len(m.group(1)), str)
-    str = re.sub('(\<[\- ]*\])', lambda m: fade_in(len(m.group(1)))[:-1] + '.', str)
-    str = re.sub('(\[[\- ]*\>)', lambda m: '.'+fade_out(len(m.group(1)))[1:], str)
-    str = re.sub('(\<[\- ]*\>)', lambda m: fade_fade(len(m.group(1))), str)
-    return str
+    # The pairs can't overlap, so all four kinds are expanded in a single pass.
+    return expand_re.sub(expand_match, str)
 # End of Pattern functions
 
+# Maps every character of an expanded track to its schedule bit: '0' for a space, '1' otherwise.
+schedule_bits_table = string.maketrans(''.join([chr(i) for i in range(256)]), ''.join([(chr(i) == ' ' and '0' or '1') for i in range(256)]))
+
+track_line_re = re.compile('(?P<name>\S+)\s*\| (?P<data>.*)$')
+
+def schedules_from_data(data):
+    """Returns the 32-bit schedules of the expanded track *data* (see :func:`expand_line`), one for every
+    16 characters (half a second): schedule ``i`` holds characters ``16*i`` to ``16*i+31``, the first one
+    in bit 0.  The data is padded with 32 spaces first, so the last schedule ends with spaces and every
+    character of the track is in two schedules.
+    """
+    bits = (data + ' '*32).translate(schedule_bits_table)
+    count = len(bits) / 16
+    # Reversed, each 16 character chunk reads as its 16-bit value, the first character being bit 0.
+    reversed_bits = bits[:count*16][::-1]
+    halves = [int(reversed_bits[i:i+16], 2) for i in range(0, count*16, 16)]
+    halves.reverse()
+    return [halves[i] | (halves[i+1] << 16) for i in range(count-1)]
+
+def parse_track_line(line):
+    """Returns the (name, schedules) of a lamp show track *line*.  Used by :class:`LampShowTrack`."""
+    m = track_line_re.match(line)
+    if m == None:
+        raise ValueError, "Regexp didn't match on track line: "+line
+    data = m.group('data')
+    if '[' in data or '<' in data:
+        data = expand_line(data)
+    return (m.group('name'), schedules_from_data(data))
+
+compiled_shows = {}
+"""Compiled lamp shows by file name: (mtime, size, tracks), see :func:`compile_show`."""
+
+def compile_show(filename):
+    """Returns the tracks of the lamp show *filename* as a list of (name, schedules) pairs.  The result is
+    kept in :data:`compiled_shows` and only compiled again when the modification time or the size of the
+    file changes.  The schedule lists are shared, don't modify them.
+    """
+    st = os.stat(filename)
+    entry = compiled_shows.get(filename)
+    if entry is not None and entry[0] == st.st_mtime and entry[1] == st.st_size:
+        return entry[2]
+    tracks = []
+    f = open(filename, 'r')
+    try:
+        for line in f.readlines():
+            if line[0] != '#':
+                tracks.append(parse_track_line(line))
+    finally:
+        f.close()
+    compiled_shows[filename] = (st.st_mtime, st.st_size, tracks)
+    return tracks
+
 class LampShowTrack(object):
     """A series of schedules to be applied to a driver over a period of time, usually in concert with other tracks
     to make up a :class:`LampShow`.
@@ -118,40 +185,18 @@ class LampShowTrack(object):
     driver = None
     """The :class:`~procgame.game.Driver` correspopnding to this track."""
     
-    def __init__(self, line):
+    def __init__(self, line=None, name=None, schedules=None):
+        """Creates the track from a *line* of a lamp show, or from the *name* and *schedules*
+        returned by :func:`parse_track_line`."""
         super(LampShowTrack, self).__init__()
-        self.load_from_line(line)
+        if line is not None:
+            self.load_from_line(line)
+        else:
+            self.name = name
+            self.schedules = schedules
     
     def load_from_line(self, line):
-        line_re = re.compile('(?P<name>\S+)\s*\| (?P<data>.*)$')
-        m = line_re.match(line)
-        if m == None:
-            raise ValueError, "Regexp didn't match on track line: "+line
-        self.name = m.group('name')
-        data = m.group('data')+(' '*32) # Pad it with 32 spaces so that the FIXME below doesn't cause a problem.
-        data = expand_line(data)
-        bits = 0
-        bit_count = 0
-        ignore_first = True
-        self.schedules = []
-        for ch in data:
-            bits >>= 1
-            bit_count += 1
-            if ch != " ":
-                bits |= 1 << 31
-            if bit_count % 16 == 0:
-                if not ignore_first:
-                    self.schedules.append(bits)
-                    #bits = 0
-                    #bit_count = 0
-                ignore_first = False
-        # FIXME: This lops off the last up to 31 bits of track data!
-        # Print out all of the data for debugging purposes:
-        # print "Loaded %d schedules for %s:" % (len(self.schedules), self.name)
-        # for sch in self.schedules:
-        #   print " - % 8x" % (sch)
-        # print "%s | %s" % (self.name, m.group('data'))
-        # print "%s | %s" % (self.name, data)
+        (self.name, self.schedules) = parse_track_line(line)
 
     def resolve_driver_with_game(self, game):
         if self.name.startswith('coil:'):
@@ -180,6 +225,10 @@ class LampShowTrack(object):
         """True if this track's schedules have all been used."""
         return self.current_index >= len(self.schedules)
 
+    def seek(self, tick):
+        """Moves this track to the schedule of the given *tick* (half second)."""
+        self.current_index = max(0, min(tick, len(self.schedules)))
+
 class LampShow(object):
     """Manages loading and playing a lamp show consisting of several lamps (or other drivers), 
     each of which is a track (:class:`LampShowTrack`, to be precise)."""
@@ -209,17 +258,16 @@ class LampShow(object):
             lamp:Right  |     ..      ..
         
         See :class:`LampShowTrack` for a complete description of the track line format.
+        The file is only read again if it changed since it was last loaded (see :func:`compile_show`).
         """
-        f = open(filename, 'r')
-        for line in f.readlines():
-            if line[0] != '#':
-                self.tracks.append(LampShowTrack(line))
+        for (name, schedules) in compile_show(filename):
+            self.tracks.append(LampShowTrack(name=name, schedules=schedules))
         
     def tick(self):
-        """Instructs the lamp show to advance based on the system clock and update the drivers associated with its tracks."""
+        """Instructs the lamp show to advance based on the game clock and update the drivers associated with its tracks."""
         if self.t0 == None:
-            self.t0 = time.time()
-        new_time = (time.time() - self.t0)
+            self.t0 = self.game.clock.time()
+        new_time = (self.game.clock.time() - self.t0)
         seconds = int(new_time)
         time_diff = new_time - self.last_time
         if (time_diff > 0.500):
@@ -233,12 +281,28 @@ class LampShow(object):
                 else:
                     tr.driver.schedule(schedule=sch, cycle_seconds=1, now=True)
     
+    def next_tick_time(self):
+        """Returns the time at which :meth:`tick` will next update the drivers."""
+        if self.t0 == None:
+            return self.game.clock.time()
+        return self.t0 + self.last_time + 0.500
+
     def restart(self):
         """Restart the show from the beginning."""
         for tr in self.tracks:
             tr.restart()
         #self.t0 = None
         #self.last_seconds = -1
+
+    def seek(self, tick):
+        """Moves the show to the given *tick*; the show applies one schedule per tick, every half
+        second.  The schedules of that tick are applied on the next :meth:`tick`."""
+        for tr in self.tracks:
+            tr.seek(tick)
+
+    def length(self):
+        """Returns the number of ticks of the show, that of its longest track."""
+        return max([len(tr.schedules) for tr in self.tracks] or [0])
     
     def is_complete(self):
         """``True`` if each of the tracks has completed."""
@@ -282,6 +346,11 @@ class LampShowMode(game.Mode):
         elif not self.show_over:
             self.lampshow.tick()
 
+    def next_tick_time(self):
+        if self.show_over:
+            return None
+        return self.lampshow.next_tick_time()
+
 class LampController(object):
     """Controller object that encapsulates a :class:`LampShow` and helps to restore lamp drivers to their prior state."""
     
@@ -299,9 +368,12 @@ class LampController(object):
         self.logger = logging.getLogger('game.lamps')
         
     def register_show(self, key, show_file):
-                self.shows[key] = show_file
+        """Registers the lamp show *show_file* as *key*; the show is compiled now, so
+        :meth:`play_show` finds it ready (see :func:`compile_show`)."""
+        compile_show(show_file)
+        self.shows[key] = show_file
 
-    def play_show(self, key, repeat=False, callback='None'):
+    def play_show(self, key, repeat=False, callback='None', start_tick=0):
         # Always stop any previously running show first.
         self.stop_show()
         if(key not in self.shows):
@@ -310,6 +382,8 @@ class LampController(object):
             return
             
         self.show.load(self.shows[key], repeat, callback)
+        if start_tick:
+            self.show.lampshow.seek(start_tick)
         self.game.modes.add(self.show)
         self.show_playing = True
 
@@ -331,7 +405,7 @@ class LampController(object):
             else:
                 state_dict[lamp.name] = {'time':lamp.last_time_changed, 'state':lamp.state()}
         self.saved_state_dicts[key] = state_dict
-        self.saved_state_dicts[key + '_time'] = time.time()
+        self.saved_state_dicts[key + '_time'] = self.game.clock.time()
 
     def restore_state(self, key):
         self.logger.info('Restoring lamp state "%s"...', key)
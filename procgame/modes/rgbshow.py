@@ -4,6 +4,11 @@
 import re
 import logging
 import sys
+import os
+import bisect
+import hashlib
+import cPickle
+from procgame import config
 from procgame.game import Mode
 from procgame.game.advancedmode import AdvancedMode
 
@@ -14,10 +19,22 @@ class RgbShowPlayer(AdvancedMode):
         self.shows = {}
         self.active_shows = []
         self.prior_lamp_states = {}
+        self.updated_at = {} # key -> clock time of the show's last update
 
-    def load(self, key, filename):
-        # load the show
-        self.shows[key] = RgbShow(self.game, key, filename)
+    def load(self, key, filename, compiled=None):
+        # load the show; compiled is the result of read_rgbshow(filename) if it was read ahead
+        self.shows[key] = RgbShow(self.game, key, filename, compiled)
+
+    def position(self, key):
+        """ returns the step the show 'key' is at; pass it to play_show as start to resume
+            the show from there """
+        show = self.shows[key]
+        if(key not in self.active_shows):
+            return show.position()
+        # the show is only updated when something changes, count the steps played since
+        # (the small amount keeps rounding errors from losing a step)
+        elapsed = (self.game.clock.time() - self.updated_at[key]) * 1000.0 / show.time
+        return show.position(int(elapsed + 1e-6))
 
     def stop(self, key, cleanup=False):
         if(key not in self.active_shows):
@@ -45,11 +62,14 @@ class RgbShowPlayer(AdvancedMode):
 
         self.shows[key].restart()
 
-    def play_show(self, key, repeat=None, save_state=True, time=None, callback_fn=None, callback_param=None):
+    def play_show(self, key, repeat=None, save_state=True, time=None, callback_fn=None, callback_param=None, start=None):
         """ plays an RgbShow --
             use repeat to override the behavior described in the show file
             if time is None, the value in the file is used; if none in the file
             the default time (timestep) is 33ms per update
+            start is the step to start from, for example to resume a show from the
+            position() it was stopped at; the devices are set to the state of the
+            show at that step first
         """
         if(key not in self.shows):
             self.logger.info("suppressing request to play unknown show: %s" % key)
@@ -73,6 +93,8 @@ class RgbShowPlayer(AdvancedMode):
         if(time is not None):
             self.shows[key].time = time
         self.shows[key].restart()
+        if(start):
+            self.shows[key].seek(start)
         # self.shows[key].debug_show()
         self.__update_show(key)
 
@@ -155,11 +177,13 @@ class RgbShowPlayer(AdvancedMode):
             raise ValueError, "request to update inactive show: %s" % key
             return
 
-        if(self.shows[key].update()):
-            # if it returns true, the show is still live
+        self.updated_at[key] = self.game.clock.time()
+        steps = self.shows[key].advance()
+        if(steps):
+            # the show is still live; it has nothing to do for the next steps-1 steps
             self.delay(name=key,
                 event_type=None,
-                delay=(self.shows[key].time)/1000.0, # delay is in seconds...
+                delay=steps*(self.shows[key].time)/1000.0, # delay is in seconds...
                 handler=self.__update_show,
                 param=key)
         else:
@@ -176,77 +200,45 @@ class RgbShowPlayer(AdvancedMode):
         pass
 
 class RgbShow(object):
-    def __init__(self, game, key, filename):
+    def __init__(self, game, key, filename, compiled=None):
         self.logger = logging.getLogger("rgbShow")
         self.logger.info("loading RgbShow '%s'" % filename)
 
         self.game = game
-        self.color_map = {}
         self.tracks = []
         self.length = 0
-        self.hold = False
-        self.repeat = False
-        self.time = 33
         self.callback_fired = False
         self.callback = None
         self.callback_param = None
-        self.now = 0
+        self.now = 0 # the next step to play
+        self.wake = 0 # the step of the next update, see advance()
         self.key = key
         self.shows_over = False
 
-        f = open(filename, 'r')
-        for line in f.readlines():
-            if (line.lstrip().startswith('#') or line.lstrip().rstrip()==""):
-                # comment or blank line, ignore
-                pass
-            elif(line.lstrip().startswith('!')):
-                # header data
-                t = line.lstrip()[1:].lstrip()
-                k = t[0:1]
-                # print("t=%s;k=%s" % (t, k))
-                if(t.find('~>')>=0):
-                    # FADE TO
-                    v = t[t.find("~>")+2:].lstrip().rstrip()
-                    v=int(v,16)
-                    c = [v >> 16, (v & 0x00ff00) >> 8 , v & 0x0000ff]
-                    self.color_map[k] = {'color': c, 'fade': True}
-                elif(t.find('=>')>=0):
-                    # IMMEDIATE COLOR CHANGE
-                    v = t[t.find("=>")+2:].lstrip().rstrip()
-                    if(v=='None'):
-                        self.color_map[k] = None
-                    else:
-                        v=int(v,16)
-                        c = [v >> 16, (v & 0x00ff00) >> 8 , v & 0x0000ff]
-                        self.color_map[k] = {'color': c, 'fade': False}
-                elif(t.find('=')>0):
-                    # RGB Show Parameter
-                    k = t[:t.find("=")-1].lstrip().rstrip()
-                    v = t[t.find("=")+1:].lstrip().rstrip()
-                    if(k=="time"):
-                        self.time = int(v)
-                        pass
-                    elif(k=="repeat"):
-                        tmp = v.lower()
-                        self.repeat = (tmp =='true' or tmp == '1')
-                        pass
-                    elif(k=="hold"):
-                        tmp = v.lower()
-                        self.hold = (tmp =='true' or tmp == '1')
-                        pass
-                    else:
-                        raise ValueError, "Could not parse RgbShow header line: '%s'" % line
-                else:
-                    # bad line!
-                    raise ValueError, "Could not parse RgbShow header line: '%s'" % line
-                pass
-            else:
-                # track data
-                t = RgbTrack(line, self.color_map, self)
-                self.tracks.append(t)
-                self.length = t.length
-
-        f.close()
+        if(compiled is None):
+            compiled = read_rgbshow(filename)
+
+        self.color_map = compiled['color_map']
+        self.hold = compiled['hold']
+        self.repeat = compiled['repeat']
+        self.time = compiled['time']
+        self.length = compiled['length']
+
+        for (device_type, name) in compiled['tracks']:
+            self.tracks.append(RgbTrack(self, device_type, name))
+
+        # the timeline: the steps where some track changes, in order, and the
+        # (track, command) pairs of each of those steps
+        self.steps = []
+        self.changes = []
+        for (step, changes) in compiled['timeline']:
+            commands = []
+            for (index, color, transition_time) in changes:
+                track = self.tracks[index]
+                commands.append((track, track.add_command(step, color, transition_time)))
+            self.steps.append(step)
+            self.changes.append(commands)
+        self.next_change = 0 # index in steps of the first change at or after now
 
     def debug_show(self):
         self.logger.info("Show Parameters:")
@@ -264,26 +256,55 @@ class RgbShow(object):
         self.shows_over = True
 
     def restart(self):
-        self.now = 0
+        self.goto(0)
         self.shows_over = False
         for t in self.tracks:
             # t.fn([0,0,0], 0)  # set this lamp's color to black
             # t.device.enable() # turn on the device (schedule-wise)
             pass
 
+    def goto(self, step):
+        self.now = step
+        self.wake = step
+        self.next_change = bisect.bisect_left(self.steps, step)
+
+    def position(self, elapsed=0):
+        """ returns the next step to play, elapsed steps after the last update """
+        return min(self.now + elapsed, self.wake)
+
+    def seek(self, step, apply=True):
+        """ moves the show to step, so the next update plays that step.  With apply, every
+            track is set to the color it has at that step: its last command is replayed with
+            whatever remains of its transition.
+        """
+        step = max(0, min(step, self.length))
+        self.goto(step)
+        if(apply):
+            for t in self.tracks:
+                t.seek(step)
+            # the changes at step were just played
+            self.next_change = bisect.bisect_right(self.steps, step)
+
+    def seek_time(self, ms, apply=True):
+        """ seeks to the step playing ms milliseconds into the show """
+        self.seek(int(ms / self.time), apply)
+
     def update(self):
         # self.logger.debug("Show '%s' received update(%d/%d)" % (self.key, self.now, self.length))
 
         if(self.now < self.length):
-            for track in self.tracks:
-                track.update(self.now)
+            i = self.next_change
+            if(i < len(self.steps) and self.steps[i] == self.now):
+                for (track, cmd) in self.changes[i]:
+                    track.play(cmd)
+                self.next_change = i + 1
             self.now += 1
             return True
         else:
             # if(self.now >= self.length):
             # show is done playing through once, but is it *done*
             if(self.repeat):
-                self.now = 0
+                self.goto(0)
                 self.callback_fired = False
                 return True
 
@@ -294,11 +315,29 @@ class RgbShow(object):
 
             if(self.hold):
                 # reset back to the last frame
-                self.now = self.length-1
+                self.goto(self.length-1)
                 return True
 
             return False
 
+    def advance(self):
+        """ does what update() does, then skips the steps where nothing changes.  Returns
+            the number of steps until the show needs to be advanced again, or 0 if it is over.
+            Until then now stays at the step after the one played and wake holds the step
+            the next advance() plays.
+        """
+        self.now = self.wake # the steps skipped by the previous advance() are over
+        if(not self.update()):
+            return 0
+        if(self.now < self.length):
+            if(self.next_change < len(self.steps)):
+                self.wake = min(self.steps[self.next_change], self.length)
+            else:
+                self.wake = self.length
+            return self.wake - self.now + 1
+        self.wake = self.now
+        return 1
+
     def is_device_in_use(self, name):
         for t in self.tracks:
             if(t.name == name and t.enabled):
@@ -321,38 +360,50 @@ class RgbShow(object):
 
 class RgbTrack(object):
     def __str__(self):
-        return "".join([str(t)+":"+str(v)+";" for t,v in enumerate(self.data)])
+        return "".join([str(t)+":"+str(self.commands[t])+";" for t in self.starts])
 
     def update(self, now):
         # self.logger.debug("Track '%s' received update(%d) [length of the track is (%d)]" % (self.name, now, self.length))
 
+        if(now >= self.length):
+            raise ValueError, "Track '%s' received index '%d' beyond the length of the track (%d)" % (self.name, now, self.length)
+        cmd = self.commands.get(now)
+        if(cmd is not None):
+            self.play(cmd)
+
+    def play(self, cmd, time=None):
         if(self.enabled):
-            if(now >= len(self.data)):
-                raise ValueError, "Track '%s' received index '%d' beyond the length of the track (%d)" % (self.name, now, self.length)
-            cmd = self.data[now]
-            if(cmd is not None):
-                cmd.process_command()
-                if(self.device_type=="rgb"):
-                    self.device.enable() # hack for wsRGB only
-
-    def __init__(self, line, color_map, show):
+            cmd.process_command(time)
+            if(self.device_type=="rgb"):
+                self.device.enable() # hack for wsRGB only
+
+    def seek(self, step):
+        """ replays the last command at or before step, minus the part of its transition
+            already over by then """
+        i = bisect.bisect_right(self.starts, step) - 1
+        if(i >= 0):
+            start = self.starts[i]
+            cmd = self.commands[start]
+            self.play(cmd, max(0, start + cmd.time - step))
+
+    def add_command(self, start, color, transition_time):
+        c = RgbCommand(self.name, self.fn, color, transition_time, self.show)
+        self.commands[start] = c
+        bisect.insort(self.starts, start)
+        return c
+
+    def __init__(self, show, device_type, name):
         self.logger = logging.getLogger("rgbTrack")
-        self.data = []
+        self.commands = {} # start step -> RgbCommand
+        self.starts = [] # the keys of commands, in order
         self.device = None
         self.fn = None
+        self.show = show
         self.enabled = True # a track may be disabled if it's device is in use by another playing show
 
         self.time = show.time
-
-        #print line
-        line_re = re.compile('\s*(?P<type>\S+\:)?\s*(?P<name>\S+)\s*\| (?P<data>.*)$')
-
-        m = line_re.match(line)
-        if m is None:
-            raise ValueError("Regexp didn't match on track line: " + line)
-
-        device_type = m.group('type')
-        self.name = m.group('name')
+        self.name = name
+        self.length = show.length
 
         # build function map
         if(device_type is None):
@@ -381,48 +432,6 @@ class RgbTrack(object):
         self.fn = fn
         self.device_type = device_type
 
-        data = m.group('data')
-
-        self.data = [None]* len(data)
-
-        last_color = None
-        last_run_starts = 0
-        last_run_length = 0
-
-        for i in range(0,len(data),1):
-            this_color = data[i]
-
-            if(this_color!=last_color):
-                # end prev run, start new run
-                if(last_color is not None):
-                    # save old run
-                    cdata = color_map[last_color]
-                    if(cdata is None):
-                        c = None
-                    elif(cdata['fade']):
-                        c = RgbCommand(self.name, fn, cdata['color'], last_run_length,show)
-                    else:
-                        c = RgbCommand(self.name, fn, cdata['color'], 0, show)
-                    self.data[last_run_starts] = c
-                # start new run
-                last_run_length = 0
-                last_run_starts = i
-            if(i==len(data)-1): # last slot
-                if(last_run_length==0) or (last_color==this_color): # just started a new run; so store this run
-                    cdata = color_map[this_color]
-                    if(cdata is None):
-                        c = None
-                    elif(cdata['fade']):
-                        c = RgbCommand(self.name, fn, cdata['color'], last_run_length,show)
-                    else:
-                        c = RgbCommand(self.name, fn, cdata['color'], 0, show)
-                    self.data[last_run_starts] = c
-            else:
-                # continuing run
-                last_run_length += 1
-            last_color = this_color
-        self.length = len(data)
-
 class RgbCommand(object):
     def __init__(self, name, fn, new_color, transition_time, show_for_time):
         self.new_color = new_color
@@ -434,6 +443,180 @@ class RgbCommand(object):
     def __str__(self):
         return "[name=%s color='%s';time='%s']" % (self.name, self.new_color, self.time*self.show_for_time.time)
 
-    def process_command(self):
+    def process_command(self, time=None):
         # print(" doing  %s" % str(self))
-        self.fn(self.new_color, self.time*self.show_for_time.time)
\ No newline at end of file
+        # time is the transition length in steps, the whole transition if None
+        if(time is None):
+            time = self.time
+        self.fn(self.new_color, time*self.show_for_time.time)
+
+RGBSHOW_CACHE_VERSION = 1
+
+def read_rgbshow(filename):
+    """ returns the compiled RgbShow in filename (see compile_rgbshow), from the cache
+        directory configured by rgbshow_cache_path when it holds an up to date copy.
+        Like parse_rgbshow_file, this can run on a worker thread or process.
+    """
+    cache_path = config.value_for_key_path('rgbshow_cache_path', None)
+    if(not cache_path):
+        return compile_rgbshow(parse_rgbshow_file(filename))
+
+    cache_path = os.path.expanduser(cache_path)
+    st = os.stat(filename)
+    fingerprint = (RGBSHOW_CACHE_VERSION, st.st_mtime, st.st_size)
+    cached = os.path.join(cache_path, hashlib.md5(os.path.abspath(filename)).hexdigest() + '.rgbshow')
+    try:
+        f = open(cached, 'rb')
+        try:
+            (cached_fingerprint, compiled) = cPickle.load(f)
+        finally:
+            f.close()
+        if(cached_fingerprint == fingerprint):
+            return compiled
+    except Exception:
+        pass # missing, stale or unreadable: compile it again
+
+    compiled = compile_rgbshow(parse_rgbshow_file(filename))
+    try:
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+        tmp = '%s.%d' % (cached, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            cPickle.dump((fingerprint, compiled), f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, cached)
+    except (IOError, OSError), e:
+        logging.getLogger("rgbShow").warning("could not cache RgbShow '%s': %s" % (filename, e))
+    return compiled
+
+def compile_rgbshow(parsed):
+    """ turns the result of parse_rgbshow_file into a sparse timeline: the show parameters,
+        the (type, name) of each track and a list of (step, changes) for the steps where at
+        least one track changes, in order.  changes lists the (track index, color, transition
+        length in steps) of those tracks.  The result is plain data that can be pickled.
+    """
+    compiled = {'color_map': parsed['color_map'], 'hold': parsed['hold'],
+                'repeat': parsed['repeat'], 'time': parsed['time'], 'length': 0, 'tracks': []}
+    changes = {}
+    for (index, (line, track)) in enumerate(parsed['tracks']):
+        compiled['tracks'].append((track['type'], track['name']))
+        compiled['length'] = track['length'] # the show is as long as its last track
+        for (start, command) in track['runs']:
+            if(command is not None):
+                (color, transition_time) = command
+                changes.setdefault(start, []).append((index, color, transition_time))
+
+    compiled['timeline'] = [(step, changes[step]) for step in sorted(changes) if step < compiled['length']]
+    return compiled
+
+def parse_rgbshow_file(filename):
+    """ reads an RgbShow file into plain data: the show parameters, its color map and
+        the parsed tracks.  Nothing here touches the game, so this can run on a worker
+        thread or process (see AssetManager); RgbShow binds the result to the devices.
+    """
+    show = {'color_map': {}, 'tracks': [], 'hold': False, 'repeat': False, 'time': 33}
+    color_map = show['color_map']
+
+    f = open(filename, 'r')
+    for line in f.readlines():
+        if (line.lstrip().startswith('#') or line.lstrip().rstrip()==""):
+            # comment or blank line, ignore
+            pass
+        elif(line.lstrip().startswith('!')):
+            # header data
+            t = line.lstrip()[1:].lstrip()
+            k = t[0:1]
+            # print("t=%s;k=%s" % (t, k))
+            if(t.find('~>')>=0):
+                # FADE TO
+                v = t[t.find("~>")+2:].lstrip().rstrip()
+                v=int(v,16)
+                c = [v >> 16, (v & 0x00ff00) >> 8 , v & 0x0000ff]
+                color_map[k] = {'color': c, 'fade': True}
+            elif(t.find('=>')>=0):
+                # IMMEDIATE COLOR CHANGE
+                v = t[t.find("=>")+2:].lstrip().rstrip()
+                if(v=='None'):
+                    color_map[k] = None
+                else:
+                    v=int(v,16)
+                    c = [v >> 16, (v & 0x00ff00) >> 8 , v & 0x0000ff]
+                    color_map[k] = {'color': c, 'fade': False}
+            elif(t.find('=')>0):
+                # RGB Show Parameter
+                k = t[:t.find("=")-1].lstrip().rstrip()
+                v = t[t.find("=")+1:].lstrip().rstrip()
+                if(k=="time"):
+                    show['time'] = int(v)
+                    pass
+                elif(k=="repeat"):
+                    tmp = v.lower()
+                    show['repeat'] = (tmp =='true' or tmp == '1')
+                    pass
+                elif(k=="hold"):
+                    tmp = v.lower()
+                    show['hold'] = (tmp =='true' or tmp == '1')
+                    pass
+                else:
+                    raise ValueError, "Could not parse RgbShow header line: '%s'" % line
+            else:
+                # bad line!
+                raise ValueError, "Could not parse RgbShow header line: '%s'" % line
+            pass
+        else:
+            # track data
+            show['tracks'].append((line, parse_rgbtrack_line(line, color_map, show['time'])))
+
+    f.close()
+    return show
+
+def parse_rgbtrack_line(line, color_map, time):
+    """ parses a track line into its device type and name and the runs of the track:
+        a list of (start, command) where command is None (no change) or
+        (color, transition length in steps)
+    """
+    #print line
+    line_re = re.compile('\s*(?P<type>\S+\:)?\s*(?P<name>\S+)\s*\| (?P<data>.*)$')
+
+    m = line_re.match(line)
+    if m is None:
+        raise ValueError("Regexp didn't match on track line: " + line)
+
+    data = m.group('data')
+    runs = []
+
+    def command(color, run_length):
+        cdata = color_map[color]
+        if(cdata is None):
+            return None
+        elif(cdata['fade']):
+            return (cdata['color'], run_length)
+        else:
+            return (cdata['color'], 0)
+
+    last_color = None
+    last_run_starts = 0
+    last_run_length = 0
+
+    for i in range(0,len(data),1):
+        this_color = data[i]
+
+        if(this_color!=last_color):
+            # end prev run, start new run
+            if(last_color is not None):
+                # save old run
+                runs.append((last_run_starts, command(last_color, last_run_length)))
+            # start new run
+            last_run_length = 0
+            last_run_starts = i
+        if(i==len(data)-1): # last slot
+            if(last_run_length==0) or (last_color==this_color): # just started a new run; so store this run
+                runs.append((last_run_starts, command(this_color, last_run_length)))
+        else:
+            # continuing run
+            last_run_length += 1
+        last_color = this_color
+
+    return {'type': m.group('type'), 'name': m.group('name'), 'time': time, 'length': len(data), 'runs': runs}
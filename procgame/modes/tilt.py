@@ -3,7 +3,6 @@ import procgame
 from ..game import Mode
 from ..game.advancedmode import AdvancedMode
 from .. import dmd
-import time
 import os
 
 class Tilted(AdvancedMode):
@@ -54,7 +53,7 @@ class TiltMonitorMode(AdvancedMode):
             self.game.tilted_mode = Tilted(game=self.game)
 
     def tilt_handler(self, sw):
-        now = time.time()
+        now = self.game.clock.time()
         self.logger.info('tilt bob switch active [%d]' % now)
         if(self.previous_warning_time is not None) and ((now - self.previous_warning_time) < self.tilt_bob_settle_time):
             self.logger.info('tilt bob still swinging from previous warning')
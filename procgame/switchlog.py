@@ -0,0 +1,113 @@
+"""Binary switch event logs: recording them from a running game and replaying them on a stepped clock.
+
+A log starts with a header (the magic ``PGSL``, the format version and the number of switch
+states) followed by the state of every switch when recording started, one byte each.  Then
+comes one 7 byte record per switch event: the milliseconds since recording started, the
+switch number and the event type, all little endian.
+
+:class:`SwitchEventRecorder` writes a log (see the ``switch_record_file`` config key) and
+:class:`~procgame.fakepinproc.FakePinPROCReplay` plays it back as fast as it can.
+"""
+import struct
+import time
+import logging
+
+MAGIC = 'PGSL'
+VERSION = 1
+
+header_format = struct.Struct('<4sHH')
+record_format = struct.Struct('<IHB')
+
+switch_event_types = (1, 2, 3, 4)
+"""The pinproc switch event types: closed/open debounced, closed/open nondebounced."""
+
+class SwitchEventRecorder(object):
+    """Appends the switch events given to :meth:`record` to the switch log *filename*,
+    after the switch states :attr:`game.proc` reports at creation."""
+
+    def __init__(self, game, filename):
+        super(SwitchEventRecorder, self).__init__()
+        self.logger = logging.getLogger('game.switchlog')
+        self.filename = filename
+        self.clock = game.clock
+        self.started = self.clock.time()
+        self.count = 0
+        states = [int(bool(state)) for state in game.proc.switch_get_states()]
+        self.file = open(filename, 'wb')
+        self.file.write(header_format.pack(MAGIC, VERSION, len(states)))
+        self.file.write(''.join(chr(state) for state in states))
+        self.logger.info("Recording switch events to %s", filename)
+
+    def record(self, event):
+        """Writes *event*, a P-ROC event dictionary, to the log if it is a switch event."""
+        if self.file is None or event['type'] not in switch_event_types:
+            return
+        ms = int(round((self.clock.time() - self.started) * 1000.0))
+        self.file.write(record_format.pack(max(ms, 0), event['value'], event['type']))
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.logger.info("Recorded %d switch events to %s", self.count, self.filename)
+
+def read_switch_log(filename):
+    """Returns ``(states, events)`` from the switch log *filename*: the list of the initial switch
+    states and the list of ``(seconds, event type, switch number)`` in recording order."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < header_format.size:
+        raise ValueError, "%s is not a switch log" % (filename)
+    (magic, version, count) = header_format.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError, "%s is not a switch log" % (filename)
+    if version != VERSION:
+        raise ValueError, "%s is a version %d switch log, expected version %d" % (filename, version, VERSION)
+    offset = header_format.size
+    states = [ord(ch) for ch in data[offset:offset+count]]
+    offset += count
+    events = []
+    size = record_format.size
+    for i in range(offset, len(data) - size + 1, size):
+        (ms, number, event_type) = record_format.unpack_from(data, i)
+        events.append((ms / 1000.0, event_type, number))
+    return (states, events)
+
+class ReplayStats(object):
+    """Per phase (attract mode or a ball in play) loop and event counts, game time (read from
+    *clock*) and real time of a replay.  :meth:`update` is called once per run loop cycle."""
+
+    def __init__(self, clock):
+        super(ReplayStats, self).__init__()
+        self.clock = clock
+        self.phases = [] # [name, loops, events, virtual seconds, real seconds]
+        self.started = (clock.time(), time.time())
+        self.last = self.started
+
+    def phase(self, name):
+        if len(self.phases) == 0 or self.phases[-1][0] != name:
+            self.phases.append([name, 0, 0, 0.0, 0.0])
+        return self.phases[-1]
+
+    def update(self, name, events=0):
+        now = (self.clock.time(), time.time())
+        phase = self.phase(name)
+        phase[1] += 1
+        phase[2] += events
+        phase[3] += now[0] - self.last[0]
+        phase[4] += now[1] - self.last[1]
+        self.last = now
+
+    def report(self):
+        """Returns the statistics as a list of lines, one per phase and the totals."""
+        lines = []
+        for (name, loops, events, virtual, real) in self.phases:
+            lines.append(self.line(name, loops, events, virtual, real))
+        lines.append(self.line('total', sum(p[1] for p in self.phases), sum(p[2] for p in self.phases),
+                               self.last[0] - self.started[0], self.last[1] - self.started[1]))
+        return lines
+
+    def line(self, name, loops, events, virtual, real):
+        speedup = virtual / real if real > 0 else 0.0
+        return "%-10s %8d loops %6d events %9.3fs game time %8.3fs real time  %7.1fx" % (name, loops, events, virtual, real, speedup)
@@ -0,0 +1,48 @@
+from procgame import clock
+import time
+import unittest
+
+class ClockTest(unittest.TestCase):
+
+	def test_stepped(self):
+		c = clock.SteppedClock(start=100.0)
+		self.assertTrue(c.virtual)
+		c.sleep(0.5)
+		self.assertEqual(c.time(), 100.5)
+		c.advance_to(99.0)
+		self.assertEqual(c.time(), 100.5)
+		c.wait(1.5, wait_fn=self.fail) # never really waits
+		self.assertEqual(c.time(), 102.0)
+
+	def test_min_step(self):
+		c = clock.SteppedClock(start=10.0)
+		c.min_step = 0.25
+		c.wait(0)
+		self.assertEqual(c.time(), 10.25)
+		c.horizon = lambda: 10.375
+		c.wait(-1)
+		self.assertEqual(c.time(), 10.375)
+		c.wait(0) # the horizon passed: step anyway
+		self.assertEqual(c.time(), 10.625)
+
+	def test_accelerated(self):
+		c = clock.AcceleratedClock(rate=50)
+		t0 = c.time()
+		waited = []
+		c.wait(1.0, waited.append)
+		self.assertEqual(waited, [0.02])
+		c.sleep(0.5)
+		self.assertTrue(c.time() - t0 >= 0.5)
+
+	def test_current(self):
+		previous = clock.current
+		try:
+			c = clock.SteppedClock(start=5.0)
+			clock.use(c)
+			self.assertEqual(clock.now(), 5.0)
+		finally:
+			clock.use(previous)
+		self.assertTrue(abs(clock.now() - time.time()) < 1.0)
+
+if __name__ == '__main__':
+	unittest.main()
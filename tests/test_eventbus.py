@@ -0,0 +1,128 @@
+from procgame.game.eventbus import GameEventBus, GameEvent
+from procgame.game.skeletongame import SkeletonGame
+import logging
+import unittest
+
+class Mode(object):
+	def __init__(self, name, priority):
+		self.name = name
+		self.priority = priority
+
+class Queue(object):
+	def __init__(self, modes):
+		self.modes = modes
+		self.revision = 0
+
+class EventBusTest(unittest.TestCase):
+
+	def setUp(self):
+		self.bus = GameEventBus(['evt_a', 'evt_b'])
+		self.low = Mode('low', 1)
+		self.high = Mode('high', 10)
+		self.other = Mode('other', 1)
+		for mode in [self.low, self.high, self.other]:
+			self.bus.register(mode, 'evt_a')
+		self.queue = Queue([self.high, self.low])
+
+	def names(self, modes):
+		return [mode.name for mode in modes]
+
+	def test_unknown_event(self):
+		self.assertRaises(ValueError, self.bus.register, self.low, 'evt_c')
+
+	def test_priority_order(self):
+		# popped off the back: highest priority first, then the last registered
+		self.assertEqual(self.names(self.bus.handlers_for('evt_a')), ['low', 'other', 'high'])
+		self.assertEqual(self.bus.handlers_for('evt_b'), [])
+
+	def test_active_modes_only(self):
+		self.assertEqual(self.names(self.bus.handlers_for('evt_a', self.queue)), ['low', 'high'])
+		self.queue.modes.remove(self.low)
+		self.assertEqual(self.names(self.bus.handlers_for('evt_a', self.queue)), ['low', 'high'])
+		self.queue.revision += 1
+		self.assertEqual(self.names(self.bus.handlers_for('evt_a', self.queue)), ['high'])
+
+	def test_dead_mode_forgotten(self):
+		self.bus.handlers_for('evt_a')
+		del self.other
+		self.assertEqual(self.names(self.bus.handlers_for('evt_a')), ['low', 'high'])
+
+	def test_fifo(self):
+		for name in ['evt_a', 'evt_b', 'evt_a']:
+			self.bus.post(GameEvent(name, None, None, True))
+		self.assertEqual([self.bus.next_event().name for i in range(3)], ['evt_a', 'evt_b', 'evt_a'])
+		self.assertEqual(self.bus.next_event(), None)
+
+	def test_coalesce(self):
+		self.assertTrue(self.bus.post(GameEvent('evt_a', None, None, True), coalesce=True))
+		self.assertFalse(self.bus.post(GameEvent('evt_a', None, None, True), coalesce=True))
+		self.assertTrue(self.bus.post(GameEvent('evt_a', {'x':1}, None, True), coalesce=True))
+		self.assertTrue(self.bus.post(GameEvent('evt_a', None, None, True)))
+		self.assertEqual(len(self.bus.queue), 3)
+		self.assertEqual(self.bus.coalesced, 1)
+
+	def test_latency(self):
+		event = GameEvent('evt_a', None, None, True, posted_at=1.0)
+		self.bus.event_started(event, now=1.5)
+		self.bus.event_completed(event, now=3.0)
+		self.assertEqual(self.bus.latency[('evt_a', 'waited')].total, 0.5)
+		self.assertEqual(self.bus.latency[('evt_a', 'completed')].longest, 2.0)
+		self.bus.handler_ran('evt_a', self.low, 0.25)
+		self.assertEqual(self.bus.handler_time[('evt_a', 'Mode')].count, 1)
+		self.assertEqual(len(self.bus.report()), 3)
+
+class DelayingMode(Mode):
+	def handle_game_event(self, name, params=None):
+		return 1.0 # seconds
+
+class SwitchMonitor(object):
+	def __init__(self):
+		self.delayed = []
+
+	def delay(self, name, event_type, delay, handler):
+		self.delayed.append(handler)
+
+	def cancel_delayed(self, name):
+		del self.delayed[:]
+
+	def fire(self):
+		self.delayed.pop(0)()
+
+class DispatchTest(unittest.TestCase):
+
+	def setUp(self):
+		# only the attributes the event dispatch uses
+		self.game = SkeletonGame.__new__(SkeletonGame)
+		self.game.logger = logging.getLogger('game')
+		self.game.event_bus = GameEventBus(['evt_a', 'evt_b', 'evt_c'])
+		self.game.switchmonitor = SwitchMonitor()
+		self.game.event = None
+		self.game.current_event = None
+		self.game.curr_delayed_by_mode = None
+		mode = DelayingMode('delaying', 1)
+		self.game.event_bus.register(mode, 'evt_a')
+		self.game.event_bus.register(mode, 'evt_b')
+		self.game.modes = Queue([mode])
+		self.completed = []
+
+	def complete(self, name, then=None):
+		def fn():
+			self.completed.append(name)
+			if then:
+				then()
+		return fn
+
+	def test_event_started_by_completion(self):
+		start_b = lambda: self.game.notifyModes('evt_b', event_complete_fn=self.complete('b'))
+		self.game.notifyModes('evt_a', event_complete_fn=self.complete('a', start_b))
+		self.game.notifyModes('evt_c', event_complete_fn=self.complete('c'))
+		self.game.switchmonitor.fire() # evt_a completes and starts evt_b, which delays
+		self.assertEqual(self.completed, ['a'])
+		self.assertEqual(self.game.event, 'evt_b')
+		self.assertEqual(len(self.game.event_bus.queue), 1)
+		self.game.switchmonitor.fire()
+		self.assertEqual(self.completed, ['a', 'b', 'c'])
+		self.assertEqual(self.game.event, None)
+
+if __name__ == '__main__':
+	unittest.main()
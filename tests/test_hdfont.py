@@ -0,0 +1,78 @@
+from procgame.dmd.hdfont import RenderCache, GlyphAtlas, color_key
+from procgame.dmd.layers import HDTextLayer
+import unittest
+
+class RenderCacheTest(unittest.TestCase):
+
+	def test_least_recently_used_evicted(self):
+		cache = RenderCache(2)
+		cache.put('a', 1)
+		cache.put('b', 2)
+		self.assertEqual(cache.get('a'), 1) # 'b' is now the least recently used
+		cache.put('c', 3)
+		self.assertEqual(len(cache), 2)
+		self.assertEqual(cache.get('b'), None)
+		self.assertEqual(cache.get('a'), 1)
+		self.assertEqual(cache.get('c'), 3)
+		self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+	def test_put_replaces(self):
+		cache = RenderCache(2)
+		cache.put('a', 1)
+		cache.put('b', 2)
+		cache.put('a', 10) # 'a' is the most recently used again
+		cache.put('c', 3)
+		self.assertEqual(cache.get('a'), 10)
+		self.assertEqual(cache.get('b'), None)
+
+	def test_disabled(self):
+		cache = RenderCache(0)
+		self.assertEqual(cache.put('a', 1), 1)
+		self.assertEqual(len(cache), 0)
+		self.assertEqual(cache.get('a'), None)
+
+class KeyTest(unittest.TestCase):
+
+	def layer(self, width=128, justify='left'):
+		layer = HDTextLayer.__new__(HDTextLayer)
+		(layer.font, layer.width, layer.height, layer.justify, layer.Vjustify) = ('font', width, 32, justify, None)
+		return layer
+
+	def test_color_key(self):
+		self.assertEqual(color_key([255, 0, 0]), (255, 0, 0))
+		self.assertEqual(color_key(None), None)
+
+	def test_colors_from_yaml(self):
+		key = self.layer().cache_key('100', None, [0, 0, 0], 2, [255, 255, 255])
+		self.assertEqual(key, self.layer().cache_key('100', None, (0, 0, 0), 2, (255, 255, 255)))
+		hash(key)
+
+	def test_unfilled_text_shared_across_layouts(self):
+		self.assertEqual(self.layer().cache_key('100', None, None, 0, (255, 255, 255)),
+			self.layer(width=64, justify='center').cache_key('100', None, None, 0, (255, 255, 255)))
+		self.assertNotEqual(self.layer().cache_key('100', None, None, 0, (255, 255, 255)),
+			self.layer().cache_key('100', None, None, 0, (255, 0, 0)))
+
+	def test_filled_text_keyed_by_layout(self):
+		self.assertNotEqual(self.layer().cache_key('100', (0, 0, 0), None, 0, (255, 255, 255)),
+			self.layer(justify='center').cache_key('100', (0, 0, 0), None, 0, (255, 255, 255)))
+
+class GlyphAtlasTest(unittest.TestCase):
+
+	def atlas(self, kerning):
+		atlas = GlyphAtlas.__new__(GlyphAtlas) # without a font: only the lookups are tested
+		atlas.supported = set('AV0123456789')
+		atlas.use_kerning = kerning
+		atlas.kerning = {('A', 'V'): -2}
+		return atlas
+
+	def test_can_draw(self):
+		atlas = self.atlas(True)
+		self.assertTrue(atlas.can_draw('AV10'))
+		self.assertFalse(atlas.can_draw('A~b'))
+
+	def test_kerning_lookup(self):
+		atlas = self.atlas(True)
+		self.assertEqual(atlas.kern(None, 'V'), 0)
+		self.assertEqual(atlas.kern('A', 'V'), -2) # kept from the first lookup
+		self.assertEqual(self.atlas(False).kern('A', 'V'), 0)
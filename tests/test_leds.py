@@ -0,0 +1,101 @@
+from procgame.LEDs import LEDcontroller, LEDshow
+from procgame.clock import SteppedClock
+import unittest
+
+class LED(object):
+	def __init__(self, name):
+		self.name = name
+		self.writes = []
+
+	def color(self, color):
+		self.writes.append(('color', color))
+
+	def color_with_fade(self, color, fadems):
+		self.writes.append(('fade', color, fadems))
+
+class LEDs(object):
+	def __init__(self, names):
+		self.items = [LED(name) for name in names]
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __getitem__(self, name):
+		for led in self.items:
+			if led.name == name:
+				return led
+		raise KeyError, name
+
+class Game(object):
+	def __init__(self, clock, names):
+		self.clock = clock
+		self.leds = LEDs(names)
+		self.LEDs = LEDcontroller(self)
+
+red = [255, 0, 0]
+green = [0, 255, 0]
+blue = [0, 0, 255]
+white = [255, 255, 255]
+off = [0, 0, 0]
+
+class LEDsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.clock = SteppedClock(start=100.0)
+		self.game = Game(self.clock, ['a', 'b', 'c'])
+
+	def step(self, seconds):
+		self.clock.advance(seconds)
+		self.game.LEDs.update()
+
+	def writes(self, name):
+		return self.game.leds[name].writes
+
+	def test_deltas_across_fades(self):
+		show = LEDshow(self.game, actions=[
+			{'tocks': 1, 'LEDs': {'a': 'ff0000', 'b': '00ff00-f2', 'c': 'ffffff'}},
+			{'tocks': 1, 'LEDs': {'a': 'ff0000', 'b': '0000ff-f2', 'c': 'ffffff'}},
+			{'tocks': 1, 'LEDs': {'a': '000000', 'b': '0000ff', 'c': 'ffffff'}}])
+		# a fade is always sent again, and so is the colour it faded to
+		self.assertEqual([entry[0] for entry in show.steps[1][2]], ['b'])
+		self.assertEqual(sorted(entry[0] for entry in show.steps[2][2]), ['a', 'b'])
+		show.play(repeat=True, tocks_per_sec=4)
+		self.step(0)
+		for i in range(3):
+			self.step(0.25)
+		self.assertEqual(self.writes('a'), [('color', red), ('color', off), ('color', red)])
+		self.assertEqual(self.writes('b'), [('fade', green, 500.0), ('fade', blue, 500.0),
+			('color', blue), ('fade', green, 500.0)])
+		self.assertEqual(self.writes('c'), [('color', white)])
+
+	def test_resync_after_enable(self):
+		show = LEDshow(self.game, actions=[
+			{'tocks': 1, 'LEDs': {'a': 'ff0000'}},
+			{'tocks': 1, 'LEDs': {'a': 'ff0000'}}])
+		show.play(repeat=True, priority=2, tocks_per_sec=4)
+		self.step(0)
+		self.step(0.25)
+		self.assertEqual(self.writes('a'), [('color', red)])
+		self.step(0.125)
+		self.game.LEDs.enable('a', priority=2, color='00ff00')
+		self.step(0)
+		self.assertEqual(self.writes('a'), [('color', red), ('color', green)])
+		# the show takes the LED back, then only sends what changes again
+		self.step(0.125)
+		self.step(0.25)
+		self.step(0.25)
+		self.assertEqual(self.writes('a'), [('color', red), ('color', green), ('color', red)])
+
+	def test_overlapping_scripts_priority(self):
+		low = [{'color': 'ff0000', 'time': 1}, {'color': '00ff00', 'time': 1}]
+		high = [{'color': '0000ff', 'time': 2}]
+		self.game.LEDs.run_script('a', low, priority=1, tps=4)
+		self.game.LEDs.run_script('a', high, priority=3, tps=4)
+		self.step(0)
+		self.step(0.25) # the low priority script changes colour underneath
+		self.assertEqual(self.writes('a'), [('color', blue)])
+		self.game.LEDs.stop_script(priority=3)
+		self.step(0)
+		self.assertEqual(self.writes('a'), [('color', blue), ('color', green)])
+		self.step(0.25)
+		self.assertEqual(self.writes('a'), [('color', blue), ('color', green), ('color', red)])
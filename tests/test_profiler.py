@@ -0,0 +1,54 @@
+from procgame.game.profiler import RollingHistogram, RunLoopProfiler
+import os
+import tempfile
+import unittest
+
+class Mode(object):
+	def handler(self, sw):
+		return sw
+
+class ProfilerTest(unittest.TestCase):
+
+	def test_rolling_window(self):
+		h = RollingHistogram(window=3)
+		for seconds in [0.00001, 0.0003, 0.0003, 0.1]:
+			h.add(seconds)
+		self.assertEqual(h.calls, 4)
+		self.assertEqual(sum(h.counts), 3)
+		self.assertEqual(h.counts[0], 0) # the 10us duration left the window
+		self.assertEqual(h.counts[3], 2)
+		self.assertEqual(h.counts[-1], 1)
+		self.assertAlmostEqual(h.total, 0.1006)
+		self.assertEqual(h.longest(), 0.1)
+
+	def test_percentile(self):
+		h = RollingHistogram()
+		for i in range(99):
+			h.add(0.0008)
+		self.assertEqual(h.percentile(0.95), 0.001)
+		h.add(1.0)
+		self.assertEqual(h.percentile(1.0), None)
+
+	def test_call(self):
+		profiler = RunLoopProfiler()
+		mode = Mode()
+		name = 'sw ' + profiler.handler_name(mode, mode.handler)
+		self.assertEqual(name, 'sw Mode.handler')
+		self.assertEqual(profiler.call(name, mode.handler, 'sw'), 'sw')
+		self.assertEqual(profiler.histograms[name].calls, 1)
+		self.assertEqual(len(profiler.report()), 2)
+
+	def test_dump(self):
+		(fd, path) = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			profiler = RunLoopProfiler(dump_file=path, dump_interval=0)
+			profiler.add('proc.flush', 0.001)
+			profiler.cycle_done()
+			with open(path) as f:
+				self.assertTrue('proc.flush' in f.read())
+		finally:
+			os.remove(path)
+
+if __name__ == '__main__':
+	unittest.main()
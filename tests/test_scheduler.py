@@ -0,0 +1,91 @@
+from procgame.game.scheduler import DelayScheduler
+import unittest
+
+class Item(object):
+	def __init__(self, name, time):
+		self.name = name
+		self.time = time
+
+class SchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.delays = DelayScheduler()
+		self.active = set(['a', 'b'])
+
+	def collect(self, now, owner):
+		self.delays.collect(now, lambda o: o in self.active)
+		items = [item.name for item in self.delays.take_due(owner)]
+		self.delays.release()
+		return items
+
+	def test_due_order_is_stable(self):
+		for name in ['x', 'y', 'z']:
+			self.delays.schedule('a', Item(name, 1.0))
+		self.delays.schedule('a', Item('w', 0.5))
+		self.assertEqual(self.collect(1.0, 'a'), ['w', 'x', 'y', 'z'])
+		self.assertEqual(self.delays.next_deadline(), None)
+
+	def test_only_due(self):
+		self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('a', Item('y', 2.0))
+		self.assertEqual(self.collect(1.5, 'a'), ['x'])
+		self.assertEqual(self.delays.next_deadline(), 2.0)
+
+	def test_cancel_by_name(self):
+		self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('b', Item('x', 1.0))
+		self.delays.cancel('a', ['x'])
+		self.assertEqual(self.delays.pending('a', 'x'), [])
+		self.assertEqual(len(self.delays.pending('b', 'x')), 1)
+		self.assertEqual(self.collect(1.0, 'a'), [])
+
+	def test_cancel_during_dispatch(self):
+		self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('a', Item('y', 1.0))
+		self.delays.collect(1.0, lambda o: True)
+		fired = []
+		for item in self.delays.take_due('a'):
+			fired.append(item.name)
+			self.delays.cancel('a', ['y'])
+		self.assertEqual(fired, ['x'])
+
+	def test_clear_owner(self):
+		self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('b', Item('y', 1.0))
+		self.delays.clear('a')
+		self.assertEqual(len(self.delays), 1)
+		self.assertEqual(self.collect(1.0, 'a'), [])
+
+	def test_inactive_owner_is_parked(self):
+		self.delays.schedule('c', Item('x', 1.0))
+		self.assertEqual(self.collect(1.0, 'c'), [])
+		self.assertEqual(len(self.delays.pending('c', 'x')), 1)
+		self.active.add('c')
+		self.delays.resume('c')
+		self.assertEqual(self.collect(1.0, 'c'), ['x'])
+
+	def test_retime(self):
+		item = self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('a', Item('y', 2.0))
+		self.assertTrue(self.delays.retime('a', item, 3.0))
+		self.assertEqual(self.collect(2.5, 'a'), ['y'])
+		self.assertEqual(self.collect(3.0, 'a'), ['x'])
+
+	def test_owners_by_name(self):
+		item = self.delays.schedule('a', Item('x', 1.0))
+		self.delays.schedule('b', Item('x', 2.0))
+		self.delays.schedule('b', Item('y', 2.0))
+		self.assertEqual(sorted(self.delays.owners('x')), ['a', 'b'])
+		self.delays.cancel_item('a', item)
+		self.assertEqual(self.delays.owners('x'), ['b'])
+		self.delays.cancel('b', ['x'])
+		self.assertEqual(self.delays.owners('x'), [])
+		self.assertEqual(self.delays.owners('y'), ['b'])
+		self.assertEqual(self.collect(2.0, 'b'), ['y'])
+		self.assertEqual(self.delays.owners('y'), [])
+		self.delays.schedule('a', Item('z', 3.0))
+		self.delays.clear('a')
+		self.assertEqual(self.delays.owners('z'), [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,54 @@
+from procgame import switchlog
+from procgame.clock import SteppedClock
+import os
+import tempfile
+import unittest
+
+class Proc(object):
+	def switch_get_states(self):
+		return [0, 1, 0, True]
+
+class Game(object):
+	def __init__(self, clock):
+		self.proc = Proc()
+		self.clock = clock
+
+class SwitchLogTest(unittest.TestCase):
+
+	def setUp(self):
+		(fd, self.path) = tempfile.mkstemp(suffix='.log')
+		os.close(fd)
+		self.clock = SteppedClock(start=100.0)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test_round_trip(self):
+		recorder = switchlog.SwitchEventRecorder(Game(self.clock), self.path)
+		recorder.record({'type':1, 'value':3})
+		recorder.record({'type':5, 'value':0}) # DMD event, not logged
+		self.clock.sleep(0.25)
+		recorder.record({'type':2, 'value':3})
+		recorder.record({'type':4, 'value':200})
+		recorder.close()
+		(states, events) = switchlog.read_switch_log(self.path)
+		self.assertEqual(states, [0, 1, 0, 1])
+		self.assertEqual(events, [(0.0, 1, 3), (0.25, 2, 3), (0.25, 4, 200)])
+
+	def test_not_a_log(self):
+		with open(self.path, 'w') as f:
+			f.write('0|1\n')
+		self.assertRaises(ValueError, switchlog.read_switch_log, self.path)
+
+	def test_replay_stats(self):
+		stats = switchlog.ReplayStats(self.clock)
+		self.clock.advance(2.0)
+		stats.update('attract', 1)
+		self.clock.advance(1.0)
+		stats.update('ball 1', 2)
+		stats.update('ball 1')
+		self.assertEqual([phase[:4] for phase in stats.phases], [['attract', 1, 1, 2.0], ['ball 1', 2, 2, 1.0]])
+		self.assertEqual(len(stats.report()), 3)
+
+if __name__ == '__main__':
+	unittest.main()
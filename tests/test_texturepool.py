@@ -0,0 +1,49 @@
+from procgame.dmd.sdl2_displaymanager import TexturePool
+import unittest
+
+class Texture(object):
+	pass
+
+class TexturePoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = TexturePool(per_size=2)
+
+	def test_acquire_released(self):
+		self.assertEqual(self.pool.acquire(128, 32), None)
+		tx = Texture()
+		self.pool.release(tx, 128, 32)
+		self.assertEqual(self.pool.acquire(64, 32), None)
+		self.assertTrue(self.pool.acquire(128, 32) is tx)
+		self.assertEqual(self.pool.acquire(128, 32), None)
+		self.assertEqual((self.pool.released, self.pool.reused), (1, 1))
+
+	def test_per_size(self):
+		for i in range(3):
+			self.pool.release(Texture(), 128, 32)
+		self.pool.release(Texture(), 64, 32)
+		self.assertEqual(self.pool.dropped, 1)
+		self.assertEqual(self.pool.free_count(), 3)
+		self.assertEqual(self.pool.free_bytes(), (2 * 128 * 32 + 64 * 32) * 4)
+
+	def test_live_bytes(self):
+		a = Texture()
+		b = Texture()
+		self.pool.track(a, 128, 32)
+		self.pool.track(b, 64, 32)
+		self.assertEqual(self.pool.live_bytes, (128 * 32 + 64 * 32) * 4)
+		del a
+		self.assertEqual(len(self.pool.live), 1)
+		self.assertEqual(self.pool.live_bytes, 64 * 32 * 4)
+		self.assertEqual(self.pool.peak_bytes, (128 * 32 + 64 * 32) * 4)
+		self.assertEqual(self.pool.created, 2)
+
+	def test_pooled_textures_stay_live(self):
+		tx = Texture()
+		self.pool.track(tx, 128, 32)
+		self.pool.release(tx, 128, 32)
+		del tx
+		self.assertEqual(self.pool.live_bytes, 128 * 32 * 4)
+		self.pool.acquire(128, 32)
+		self.assertEqual(self.pool.live_bytes, 0)
+		self.assertEqual(len(self.pool.report()), 2)
@@ -0,0 +1,95 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+from procgame.dmd.sdl2_displaymanager import sdl2_DisplayManager
+
+# Compares an animation of many small frames loaded with a texture per frame
+# and packed into a texture atlas: texture count, texture memory, load time
+# and the time to composite AnimatedLayers of it, one frame after another.
+#
+# Usage: atlasbench.py [frames] [width] [height] [layers]
+#
+# Figures measured with SDL 2.32.10 using the software renderer (SDL_VIDEODRIVER=dummy,
+# SDL_RENDER_DRIVER=software), 500 cycles each.  Composite time is per cycle:
+#
+#   frames        layers   textures   texture bytes        load ms        composite ms
+#   200 x 16x16     10     200 -> 1   204800 -> 269148    7.7 -> 4.4      0.43 -> 0.45
+#   1000 x 32x32    10    1000 -> 1  4096000 -> 4580800  45.6 -> 54.2     0.55 -> 0.57
+#   100 x 128x32     4     100 -> 1  1638400 -> 1779280   5.3 -> 10.3     0.45 -> 0.49
+#   60 x 64x64      20      60 -> 1   983040 -> 1039224   4.1 -> 5.7      1.42 -> 1.30
+#
+# The atlas always brings the texture count down to one page.  It costs 6-30% more texture
+# memory for the padding and the unused part of the page.  The software renderer has no
+# texture switches to save, so composite time stays within the run-to-run noise (about 10%)
+# there.  Any batching gain must be measured with a hardware renderer.
+
+def random_frames(count, width, height):
+	frames = []
+	for i in range(count):
+		bits = ''.join(chr(random.randrange(256)) for j in range(width * height * 3))
+		frames.append((width, height, 'RGB', bits))
+	return frames
+
+def load(dmd, frames, use_atlas):
+	anim = dmd.Animation()
+	t0 = time.time()
+	if use_atlas:
+		anim.set_atlas(dmd.pack_atlas(frames, 'blacksrc'))
+	else:
+		for (width, height, mode, bits) in frames:
+			anim.append_frame_from_bits(width, height, mode, bits, 'blacksrc')
+	return (anim, time.time() - t0)
+
+def composite(dmd, anim, layer_count, cycles):
+	target = dmd.Frame(128, 32)
+	layers = []
+	for i in range(layer_count):
+		layer = dmd.AnimatedLayer(frames=anim.frames, repeat=True, hold=False, frame_time=1)
+		layer.frame_pointer = (i * 7) % len(anim.frames)
+		layer.set_target_position((i * 13) % 96, (i * 5) % 16)
+		layers.append(layer)
+	t0 = time.time()
+	for i in range(cycles):
+		target.clear()
+		for layer in layers:
+			layer.composite_next(target)
+	return time.time() - t0
+
+def main():
+	count = 200
+	width = 16
+	height = 16
+	layer_count = 10
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		width = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		height = int(sys.argv[3])
+	if len(sys.argv) > 4:
+		layer_count = int(sys.argv[4])
+	cycles = 500
+
+	sdl2_DisplayManager.Init(128, 32, 1, "atlasbench")
+	from procgame import dmd
+
+	random.seed(1)
+	frames = random_frames(count, width, height)
+	print("%d frames of %dx%d, %d AnimatedLayers, %d cycles" % (count, width, height, layer_count, cycles))
+	for use_atlas in (False, True):
+		(anim, t_load) = load(dmd, frames, use_atlas)
+		if use_atlas:
+			textures = len(anim.atlas.pages)
+			size = anim.atlas.texture_bytes()
+			title = 'atlas'
+		else:
+			textures = len(anim.frames)
+			size = sum(frame.width * frame.height * 4 for frame in anim.frames)
+			title = 'texture per frame'
+		t = composite(dmd, anim, layer_count, cycles)
+		print("  %-18s %5d textures %9d bytes  load %8.3f ms  composite %7.3f ms/cycle" % (title, textures, size, t_load * 1000.0, t * 1000.0 / cycles))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import sdl2
+from procgame.dmd.sdl2_displaymanager import sdl2_DisplayManager
+
+# Counts the SDL calls issued while compositing a GroupedLayer of FrameLayers,
+# with and without the render target batching of sdl2_DisplayManager.
+#
+# Usage: blitbench.py [layers] [frames]
+
+COUNTED = ['SDL_GetRenderTarget', 'SDL_SetRenderTarget', 'SDL_SetTextureBlendMode', 'SDL_SetTextureAlphaMod']
+
+class CallCounter(object):
+	def __init__(self):
+		self.counts = {}
+		self.originals = {}
+	def install(self):
+		for name in COUNTED:
+			self.originals[name] = getattr(sdl2, name)
+			setattr(sdl2, name, self.wrap(name, self.originals[name]))
+		renderer = sdl2_DisplayManager.inst().texture_renderer
+		self.originals['copy'] = renderer.copy
+		renderer.copy = self.wrap('SDL_RenderCopy', renderer.copy)
+	def uninstall(self):
+		for name in COUNTED:
+			setattr(sdl2, name, self.originals[name])
+		sdl2_DisplayManager.inst().texture_renderer.copy = self.originals['copy']
+	def wrap(self, name, fn):
+		def counted(*args, **kwargs):
+			self.counts[name] = self.counts.get(name, 0) + 1
+			return fn(*args, **kwargs)
+		return counted
+	def reset(self):
+		self.counts = {}
+
+def forget_texture_state(layers):
+	# Emulates the behaviour before the blend/alpha state was remembered on each texture.
+	for layer in layers:
+		for attr in ('blendmode', 'alphamod'):
+			if attr in layer.frame.pySurface.__dict__:
+				del layer.frame.pySurface.__dict__[attr]
+
+def run(group, frames, counter, batching):
+	sdl2_DisplayManager.batching = batching
+	counter.reset()
+	t0 = time.time()
+	for i in range(frames):
+		if not batching:
+			forget_texture_state(group.layers)
+		group.next_frame()
+	elapsed = time.time() - t0
+	return (dict(counter.counts), elapsed)
+
+def report(title, counts, elapsed, frames):
+	print("%s:" % title)
+	total = 0
+	for name in COUNTED + ['SDL_RenderCopy']:
+		n = counts.get(name, 0)
+		total += n
+		print("  %-26s %8.1f per frame" % (name, float(n)/frames))
+	print("  %-26s %8.1f per frame" % ('total', float(total)/frames))
+	print("  %-26s %8.3f ms" % ('time per frame', elapsed*1000.0/frames))
+
+def main():
+	layer_count = 10
+	frames = 500
+	if len(sys.argv) > 1:
+		layer_count = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		frames = int(sys.argv[2])
+
+	sdl2_DisplayManager.Init(128, 32, 1, "blitbench")
+	from procgame import dmd
+	dmd.Compositor.enabled = False # redraw every frame; we want to measure the blits themselves
+
+	layers = []
+	for i in range(layer_count):
+		frame = dmd.Frame(32, 16)
+		frame.fill_rect(0, 0, 32, 16, (255, (i*40) % 256, 0, 255))
+		layer = dmd.FrameLayer(frame=frame)
+		layer.set_target_position((i*12) % 96, (i*5) % 16)
+		layer.blendmode = 'BLEND'
+		layer.alpha = 192
+		layers.append(layer)
+	group = dmd.GroupedLayer(128, 32, layers)
+
+	counter = CallCounter()
+	counter.install()
+	try:
+		(before, t_before) = run(group, frames, counter, batching=False)
+		(after, t_after) = run(group, frames, counter, batching=True)
+	finally:
+		counter.uninstall()
+
+	print("GroupedLayer with %d FrameLayers, %d frames" % (layer_count, frames))
+	report("Without batching", before, t_before, frames)
+	report("With batching", after, t_after, frames)
+
+if __name__ == "__main__":
+	main()
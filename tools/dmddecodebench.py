@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+import struct
+import tempfile
+from procgame.dmd import Frame, VgaDMD, decode_dmd_file
+
+# Times the decoding of an 8-bit .dmd file to RGB: the original per-dot loop,
+# Frame.decode_8bit_dmd_string() frame by frame and on the whole file,
+# decode_dmd_file() (file read included) and NumPy palette indexing when
+# NumPy is installed.
+#
+# Usage: dmddecodebench.py [frames] [width] [height]
+
+def write_dmd(path, frames, width, height):
+	with open(path, 'wb') as f:
+		f.write(struct.pack("IIII", 0x00646D64, frames, width, height))
+		for i in range(frames):
+			f.write(''.join(chr(random.randrange(256)) for j in range(width * height)))
+
+def per_dot(str_data):
+	# the decoder Frame.build_surface_from_8bit_dmd_string used before
+	eight_to_RGB_map = VgaDMD.get_palette_ch()
+	d = ""
+	for dot in str_data:
+		(r,g,b) = eight_to_RGB_map[ord(dot)]
+		d += r + g + b
+	return d
+
+def numpy_take(str_data):
+	import numpy
+	palette = numpy.frombuffer(''.join(r + g + b for (r, g, b) in VgaDMD.get_palette_ch()), dtype=numpy.uint8).reshape(256, 3)
+	return palette.take(numpy.frombuffer(str_data, dtype=numpy.uint8), axis=0).tostring()
+
+def frame_by_frame(decode, data, frame_size):
+	return ''.join([decode(data[i:i+frame_size]) for i in range(0, len(data), frame_size)])
+
+def main():
+	frames = 500
+	width = 128
+	height = 32
+	if len(sys.argv) > 1:
+		frames = int(sys.argv[1])
+	if len(sys.argv) > 3:
+		width = int(sys.argv[2])
+		height = int(sys.argv[3])
+
+	(fd, path) = tempfile.mkstemp(suffix='.dmd')
+	os.close(fd)
+	try:
+		write_dmd(path, frames, width, height)
+		with open(path, 'rb') as f:
+			data = f.read()[16:]
+
+		runs = [
+			('per dot loop, frame by frame', lambda: frame_by_frame(per_dot, data, width * height)),
+			('translate, frame by frame', lambda: frame_by_frame(Frame.decode_8bit_dmd_string, data, width * height)),
+			('translate, whole file', lambda: Frame.decode_8bit_dmd_string(data)),
+			('decode_dmd_file()', lambda: ''.join([bits for (w, h, mode, bits) in decode_dmd_file(open(path, 'rb'))])),
+		]
+		try:
+			import numpy
+			runs.append(('numpy take, whole file', lambda: numpy_take(data)))
+		except ImportError:
+			print("NumPy is not installed; skipping it")
+
+		print("%d frames of %dx%d" % (frames, width, height))
+		expected = None
+		for (title, fn) in runs:
+			elapsed = None
+			for i in range(3): # best of 3
+				t0 = time.time()
+				rgb = fn()
+				t = time.time() - t0
+				if elapsed is None or t < elapsed:
+					elapsed = t
+			if expected is None:
+				expected = rgb
+			status = "ok" if rgb == expected else "MISMATCH"
+			print("  %-30s %9.3f ms  %8.4f ms/frame  %s" % (title, elapsed*1000.0, elapsed*1000.0/frames, status))
+	finally:
+		os.remove(path)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,74 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+from procgame.dmd.sdl2_displaymanager import sdl2_DisplayManager
+
+# Times the score display of a 4 player game at 60 fps: every frame the player up
+# scores some points and the four HDTextLayers showing the scores are set and
+# composited.  Runs without the rendered text caches, with them, and with the
+# glyph atlases, and reports the cache hits and misses of each run.
+#
+# Usage: hdtextbench.py [font name] [font size] [seconds]
+
+FPS = 60
+
+def configure(hdfont, layers, cache_size, glyph_atlas):
+	hdfont.HDFont.rendered_text = hdfont.RenderCache(cache_size)
+	hdfont.HDFont.glyph_atlases = hdfont.RenderCache(32)
+	hdfont.HDFont.use_glyph_atlas = glyph_atlas
+	layers.HDTextLayer.rendered_frames = hdfont.RenderCache(cache_size)
+
+def run(dmd, font, frames, seed):
+	rnd = random.Random(seed)
+	style = dmd.HDFontStyle(interior_color=(255,255,0), line_width=1, line_color=(128,0,0))
+	score_layers = [dmd.HDTextLayer(0, 0, font, 'right', fontstyle=style) for i in range(4)]
+	for (i, layer) in enumerate(score_layers):
+		layer.set_target_position((i % 2) * 64, (i / 2) * 16)
+	group = dmd.GroupedLayer(128, 32, score_layers)
+	scores = [0] * 4
+	t0 = time.time()
+	for i in range(frames):
+		player = (i / (FPS * 5)) % 4 # change player every 5 seconds
+		if rnd.random() < 0.5:
+			scores[player] += rnd.choice([10, 100, 1000, 5000])
+		for (layer, score) in zip(score_layers, scores):
+			layer.set_text("{:,}".format(score))
+		group.next_frame()
+	return time.time() - t0
+
+def report(title, hdfont, layers, elapsed, frames):
+	budget = 1000.0 / FPS
+	ms = elapsed * 1000.0 / frames
+	print("%s:" % title)
+	print("  %-24s %8.3f ms (%.1f%% of a %.1f ms frame)" % ('time per frame', ms, ms * 100.0 / budget, budget))
+	for (name, cache) in [('HDTextLayer frames', layers.HDTextLayer.rendered_frames), ('rendered strings', hdfont.HDFont.rendered_text), ('glyph atlases', hdfont.HDFont.glyph_atlases)]:
+		print("  %-24s %8d hits %8d misses" % (name, cache.hits, cache.misses))
+
+def main():
+	font_name = 'Courier'
+	font_size = 14
+	seconds = 30
+	if len(sys.argv) > 1:
+		font_name = sys.argv[1]
+	if len(sys.argv) > 2:
+		font_size = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		seconds = int(sys.argv[3])
+	frames = seconds * FPS
+
+	sdl2_DisplayManager.Init(128, 32, 1, "hdtextbench")
+	sdl2_DisplayManager.inst().fonts_init(None, font_name)
+	from procgame import dmd
+	from procgame.dmd import hdfont, layers
+	font = dmd.hdfont_named(font_name, font_size)
+
+	print("4 player scores in %s %d, %d frames at %d fps" % (font_name, font_size, frames, FPS))
+	for (title, cache_size, glyph_atlas) in [('No caches', 0, False), ('Rendered text caches', 128, False), ('Glyph atlases', 128, True)]:
+		configure(hdfont, layers, cache_size, glyph_atlas)
+		elapsed = run(dmd, font, frames, seed=1)
+		report(title, hdfont, layers, elapsed, frames)
+
+if __name__ == "__main__":
+	main()
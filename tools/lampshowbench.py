@@ -0,0 +1,105 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+import re
+import tempfile
+import procgame.game # before the module below, to get around the procgame <-> procgame.game circular import
+from procgame import lamps
+
+# Times the loading of a large lamp show: the four regular expression passes
+# and the per-character loop LampShowTrack.load_from_line used before,
+# lamps.compile_show() and compile_show() again once the show is cached.
+#
+# Usage: lampshowbench.py [tracks] [seconds]
+
+def write_show(path, tracks, seconds):
+	with open(path, 'w') as f:
+		f.write('# generated by lampshowbench.py\n')
+		for i in range(tracks):
+			data = []
+			length = 0
+			while length < seconds * 32:
+				r = random.random()
+				if r < 0.4:
+					part = random.choice(' .') * random.randint(1, 16)
+				else:
+					part = random.choice('[<') + ' ' * random.randint(2, 30) + random.choice(']>')
+				data.append(part)
+				length += len(part)
+			f.write('lamp:L%03d | %s\n' % (i, ''.join(data)))
+
+def four_passes(str):
+	# the expand_line used before
+	str = re.sub('(\[[\- ]*\])', lambda m: '.'*len(m.group(1)), str)
+	str = re.sub('(\<[\- ]*\])', lambda m: lamps.fade_in(len(m.group(1)))[:-1] + '.', str)
+	str = re.sub('(\[[\- ]*\>)', lambda m: '.'+lamps.fade_out(len(m.group(1)))[1:], str)
+	str = re.sub('(\<[\- ]*\>)', lambda m: lamps.fade_fade(len(m.group(1))), str)
+	return str
+
+def per_char(line):
+	# the track compiler LampShowTrack.load_from_line used before
+	m = lamps.track_line_re.match(line)
+	data = four_passes(m.group('data')+(' '*32))
+	bits = 0
+	bit_count = 0
+	ignore_first = True
+	schedules = []
+	for ch in data:
+		bits >>= 1
+		bit_count += 1
+		if ch != " ":
+			bits |= 1 << 31
+		if bit_count % 16 == 0:
+			if not ignore_first:
+				schedules.append(bits)
+			ignore_first = False
+	return (m.group('name'), schedules)
+
+def per_char_show(path):
+	with open(path, 'r') as f:
+		return [per_char(line) for line in f.readlines() if line[0] != '#']
+
+def compile_uncached(path):
+	lamps.compiled_shows.clear()
+	lamps.expansions.clear()
+	return lamps.compile_show(path)
+
+def main():
+	tracks = 150
+	seconds = 120
+	if len(sys.argv) > 1:
+		tracks = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		seconds = int(sys.argv[2])
+
+	(fd, path) = tempfile.mkstemp(suffix='.lampshow')
+	os.close(fd)
+	try:
+		random.seed(1)
+		write_show(path, tracks, seconds)
+		runs = [
+			('per character loop', per_char_show),
+			('compile_show()', compile_uncached),
+			('compile_show(), cached', lamps.compile_show),
+		]
+		print("%d tracks of %d seconds" % (tracks, seconds))
+		expected = None
+		for (title, fn) in runs:
+			elapsed = None
+			for i in range(3): # best of 3
+				t0 = time.time()
+				result = fn(path)
+				t = time.time() - t0
+				if elapsed is None or t < elapsed:
+					elapsed = t
+			if expected is None:
+				expected = result
+			status = "ok" if result == expected else "MISMATCH"
+			print("  %-26s %9.3f ms  %s" % (title, elapsed*1000.0, status))
+	finally:
+		os.remove(path)
+
+if __name__ == "__main__":
+	main()
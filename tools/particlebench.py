@@ -0,0 +1,53 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+from procgame.dmd import particle
+
+# Reports how many particles per millisecond each particle engine updates (and
+# turns into the rows that ParticleEmitter.draw() blits) for a fireworks show of
+# several emitters of 200 particles, plus fire and snow emitters.
+#
+# Usage: particlebench.py [emitters] [frames]
+
+def make_emitters(count, engine):
+	emitters = []
+	for i in range(count):
+		emitters.append(particle.ParticleEmitter(20 + i*40, 20, max_life=20, max_particles=200, particles_per_update=100, total_creations=None, particle_class=particle.FireworkParticle, engine=engine))
+	emitters.append(particle.ParticleEmitter(112, 100, max_life=20, max_particles=200, particles_per_update=40, particle_class=particle.FireParticle, engine=engine))
+	emitters.append(particle.ParticleEmitter(112, 0, max_life=35, max_particles=500, particles_per_update=16, particle_class=particle.SnowParticle, engine=engine))
+	return emitters
+
+def run(emitters, frames):
+	updated = 0
+	t0 = time.time()
+	for i in range(frames):
+		for e in emitters:
+			e.update()
+			updated += len(e.rows())
+	return (updated, time.time() - t0)
+
+def main():
+	count = 4
+	frames = 300
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		frames = int(sys.argv[2])
+
+	engines = ['objects', 'python']
+	if particle.numpy is not None:
+		engines.append('numpy')
+	else:
+		print("NumPy is not installed; skipping the numpy engine")
+
+	print("%d firework emitters + fire + snow, %d frames" % (count, frames))
+	for engine in engines:
+		random.seed(1)
+		emitters = make_emitters(count, engine)
+		(updated, elapsed) = run(emitters, frames)
+		print("  %-8s %10.1f particles/ms  %8.3f ms/frame  %6d particles/frame" % (engine, updated / (elapsed*1000.0), elapsed*1000.0/frames, updated / frames))
+
+if __name__ == "__main__":
+	main()
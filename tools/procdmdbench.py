@@ -0,0 +1,54 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+from procgame.dmd.displaycontroller import ShadeConverter
+
+# Reports how many frames per second can be converted from the RGBA data read back
+# from a frame to the 4-bit shades sent to the P-ROC DMD, for the per-dot loop
+# DisplayController.proc_dmd_draw used before and for ShadeConverter.
+#
+# Usage: procdmdbench.py [frames] [width] [height]
+
+def per_dot(bits, width, height):
+	# the conversion DisplayController.proc_dmd_draw used before
+	dmd_bytes = bytearray(width * height)
+	for b in range(height * width):
+		b0 = b * 4
+		dmd_bytes[b] = (bits[b0] + bits[b0+1] + bits[b0+2]) // (3 * 16)
+	return dmd_bytes.decode(encoding='ascii')
+
+def main():
+	frames = 1000
+	width = 128
+	height = 32
+	if len(sys.argv) > 1:
+		frames = int(sys.argv[1])
+	if len(sys.argv) > 3:
+		width = int(sys.argv[2])
+		height = int(sys.argv[3])
+
+	rgba = ''.join(chr(random.randrange(256)) for i in range(width * height * 4))
+
+	runs = [
+		('per dot loop', lambda rgba: per_dot(bytearray(rgba), width, height)),
+		('ShadeConverter', ShadeConverter(width, height).convert),
+		('ShadeConverter, gamma 2.2', ShadeConverter(width, height, gamma=2.2).convert),
+		('ShadeConverter, dithered', ShadeConverter(width, height, dither=True).convert),
+	]
+
+	expected = per_dot(bytearray(rgba), width, height)
+	print("%d frames of %dx%d" % (frames, width, height))
+	for (title, convert) in runs:
+		t0 = time.time()
+		for i in range(frames):
+			shades = convert(rgba)
+		elapsed = time.time() - t0
+		status = ""
+		if title == 'ShadeConverter':
+			status = "ok" if shades == expected else "MISMATCH"
+		print("  %-28s %10.0f frames/s  %8.4f ms/frame  %s" % (title, frames / elapsed, elapsed*1000.0/frames, status))
+
+if __name__ == "__main__":
+	main()
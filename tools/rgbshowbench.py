@@ -0,0 +1,136 @@
+import sys
+import os
+sys.path.append(sys.path[0]+'/..') # Set the path so we can find procgame.  We are assuming (stupidly?) that the first member is our directory.
+import time
+import random
+import tempfile
+import procgame.game # before the module below, to get around the procgame <-> procgame.game circular import
+from procgame.modes import rgbshow
+
+# Compares the per-step track data RgbShow used to keep (a slot per track per
+# step, every track visited every step) with the compiled timeline (only the
+# steps where some track changes) on a show of 200 LED tracks: memory, the
+# cost of playing it and the cost of seeking.
+#
+# Usage: rgbshowbench.py [tracks] [steps] [changes per track]
+
+class Device(object):
+	def __init__(self, name):
+		self.name = name
+		self.calls = 0
+	def color_with_fade(self, color, time):
+		self.calls += 1
+
+class Game(object):
+	def __init__(self, names):
+		self.leds = dict((name, Device(name)) for name in names)
+		self.lamps = {}
+
+def write_show(path, tracks, steps, changes):
+	lines = ['!time = 33\n', '!A => ff0000\n', '!B ~> 00ff00\n', '!C => 000000\n', '!. => None\n']
+	for i in range(tracks):
+		data = ['.'] * steps
+		for j in random.sample(range(steps), changes):
+			data[j] = random.choice('ABC')
+		lines.append('LED%03d | %s\n' % (i, ''.join(data)))
+	with open(path, 'w') as f:
+		f.write(''.join(lines))
+
+def size_of(obj, seen=None):
+	# rough deep size of lists, tuples, dicts and what they hold
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum(size_of(k, seen) + size_of(v, seen) for (k, v) in obj.items())
+	elif isinstance(obj, (list, tuple)):
+		size += sum(size_of(v, seen) for v in obj)
+	return size
+
+def dense_tracks(parsed):
+	# the per-step data of the tracks, as RgbTrack kept it
+	tracks = []
+	for (line, track) in parsed['tracks']:
+		data = [None] * track['length']
+		for (start, command) in track['runs']:
+			data[start] = command
+		tracks.append((track['name'], data))
+	return tracks
+
+def play_dense(game, tracks, length):
+	steps = 0
+	for now in range(length):
+		for (name, data) in tracks:
+			command = data[now]
+			if command is not None:
+				game.leds[name].color_with_fade(command[0], command[1] * 33)
+		steps += 1
+	return steps
+
+def play_timeline(show):
+	show.restart()
+	calls = 0
+	while show.advance():
+		calls += 1
+	return calls
+
+def main():
+	tracks = 200
+	steps = 2000
+	changes = 40
+	if len(sys.argv) > 1:
+		tracks = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		steps = int(sys.argv[2])
+	if len(sys.argv) > 3:
+		changes = int(sys.argv[3])
+
+	(fd, path) = tempfile.mkstemp(suffix='.rgbshow')
+	os.close(fd)
+	try:
+		random.seed(1)
+		write_show(path, tracks, steps, changes)
+
+		t0 = time.time()
+		parsed = rgbshow.parse_rgbshow_file(path)
+		t1 = time.time()
+		compiled = rgbshow.compile_rgbshow(parsed)
+		t2 = time.time()
+		print("%d tracks of %d steps, %d changes per track" % (tracks, steps, changes))
+		print("  parse %.1f ms, compile %.1f ms" % ((t1 - t0) * 1000.0, (t2 - t1) * 1000.0))
+
+		dense = dense_tracks(parsed)
+		print("  %-22s %10d bytes" % ('per-step track data', size_of(dense)))
+		print("  %-22s %10d bytes  %d steps with changes" % ('timeline', size_of(compiled['timeline']), len(compiled['timeline'])))
+
+		game = Game([name for (t, name) in compiled['tracks']])
+		t0 = time.time()
+		ticks = play_dense(game, dense, compiled['length'])
+		elapsed = time.time() - t0
+		print("  %-22s %8.4f ms/step  %6d calls" % ('per-step walk', elapsed * 1000.0 / ticks, ticks))
+
+		show = rgbshow.RgbShow(game, 'bench', path, compiled)
+		t0 = time.time()
+		calls = play_timeline(show)
+		elapsed = time.time() - t0
+		print("  %-22s %8.4f ms/step  %6d calls" % ('timeline', elapsed * 1000.0 / compiled['length'], calls))
+
+		seeks = 1000
+		t0 = time.time()
+		for i in range(seeks):
+			show.seek(random.randrange(compiled['length']), apply=False)
+		elapsed = time.time() - t0
+		print("  %-22s %8.4f ms" % ('seek', elapsed * 1000.0 / seeks))
+		t0 = time.time()
+		for i in range(seeks):
+			show.seek(random.randrange(compiled['length']))
+		elapsed = time.time() - t0
+		print("  %-22s %8.4f ms" % ('seek and apply', elapsed * 1000.0 / seeks))
+	finally:
+		os.remove(path)
+
+if __name__ == "__main__":
+	main()